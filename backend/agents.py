@@ -1,27 +1,89 @@
 import os
-import json
 import datetime
-from typing import List, Optional, Dict, Any
-from groq import Groq
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 from bson import ObjectId
 from dotenv import load_dotenv
-from langsmith import traceable
+from tracing import traceable
+from procurement import ProcurementQueue
+from low_stock import LowStockView, PROJECTION as LOW_STOCK_PROJECTION
+from timeline import MedicationTimeline
+from llm_replay import ReplayableGroq
+from response_cache import ResponseCache
+from catalog import Catalog, stamped
+from structured import StructuredOutput, StructuredOutputError, OrderExtraction, PrescriptionValidation, RefillAnalysis
+from sessions import ConversationStore, classify_follow_up, AWAITING_PROCUREMENT, AWAITING_PRESCRIPTION, PLACED, CLOSED
+from archive import Archive, ARCHIVE_ORDERS_DAYS, ARCHIVE_TRACES_DAYS
+from analytics import COVERING_INDEX
+import prompts
 load_dotenv()
 
 # Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME", "hackathon_db")
+# "background": refill analysis + emails run after the order response is sent; "inline": before it
+REFILL_MODE = os.getenv("REFILL_MODE", "background").lower()
+POST_COMMIT_WORKERS = int(os.getenv("POST_COMMIT_WORKERS", 2))
 
-client = MongoClient(MONGO_URL)
+# Constructing the client doesn't connect; the first query (or /health/ready) does
+client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
 db = client[DB_NAME]
 inventory_col = db["dataset2"]  # Inventory (from previous context)
 orders_col = db["connected_orders"]
 traces_col = db["agent_traces"]
 users_col = db["users"]
+procurement_col = db["procurement_jobs"]
+refill_alerts_col = db["refill_alerts"]
+low_stock_col = db["low_stock_view"]
+timeline_col = db["medication_timeline"]
+sessions_col = db["conversation_sessions"]
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+procurement_queue = ProcurementQueue(procurement_col)
+low_stock_view = LowStockView(low_stock_col)
+medication_timeline = MedicationTimeline(timeline_col)
+catalog = Catalog(inventory_col)
+conversation_sessions = ConversationStore(sessions_col)
+# Orders/traces past their horizon live in monthly partitions; reads that reach back that far go through these
+orders_archive = Archive(db, orders_col, "purchased_at", ARCHIVE_ORDERS_DAYS,
+                         [[("patient.id", 1), ("purchased_at", -1)], COVERING_INDEX])
+traces_archive = Archive(db, traces_col, "timestamp", ARCHIVE_TRACES_DAYS,
+                         [[("timestamp", -1)], [("patient_id", 1), ("timestamp", -1)], [("session_id", 1)]])
+# Admin read endpoints cached in k.py; every writer below invalidates the collections it touches
+response_cache = ResponseCache()
+
+def _make_groq():
+    # Imported on first LLM call: the SDK's pydantic models dominate backend import time
+    from groq import Groq
+    return Groq(api_key=GROQ_API_KEY)
+
+# Wrapped so LLM_MODE=record/replay can capture or serve completions offline (see llm_replay.py)
+groq_client = ReplayableGroq(_make_groq)
+# Parse/validate/repair for every JSON answer; repairs re-ask the small model
+structured = StructuredOutput(groq_client)
+
+def normalize_order(output: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Always returns an "items" list; the first item is mirrored at the top level
+    so single-medicine callers keep reading order["medicine_name"].
+    """
+    raw_items = output.get("items")
+    if not isinstance(raw_items, list) or not raw_items:
+        raw_items = [output]
+    items = []
+    for raw in raw_items:
+        if not isinstance(raw, dict):
+            continue
+        items.append({
+            "medicine_name": raw.get("medicine_name"),
+            "quantity": raw.get("quantity") or 1,
+            "dosage_frequency": raw.get("dosage_frequency"),
+            "symptom": raw.get("symptom"),
+        })
+    if not items:
+        items = [{"medicine_name": None, "quantity": 1, "dosage_frequency": "As directed", "symptom": None}]
+    return {**items[0], "detected_language": output.get("detected_language"), "items": items}
 
 class BaseAgent:
     def __init__(self, name: str):
@@ -39,6 +101,7 @@ class BaseAgent:
             "output": output_data
         }
         traces_col.insert_one(trace_doc)
+        response_cache.invalidate("traces")
         print(f"[{self.agent_name}]({patient_id}) {reasoning} -> {decision}")
         return trace_doc
 
@@ -48,46 +111,12 @@ class OrderingAgent(BaseAgent):
 
     @traceable(name="OrderingAgent")
     def run(self, session_id: str, patient_id: str, text: str) -> Dict[str, Any]:
-        prompt = f"""
-        You are a Pharmacy Ordering AI. The user might speak in English, Hindi, Telugu, or a mix of these.
-        Extract order details from the user's text.
-        Text: "{text}"
-        
-        Return ONLY valid JSON with:
-        {{
-            "medicine_name": "string",
-            "quantity": number,
-            "dosage_frequency": "string",
-            "detected_language": "string",
-            "symptom": "string"
-        }}
-        If details are missing, make a best guess or use null. Ensure the medicine name is translated/normalized to English if spoken in another language.
-        """
-        
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
-        
-        # Extract JSON from potential markdown blocks
-        content = completion.choices[0].message.content
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        try:
-            output = json.loads(content)
-        except json.JSONDecodeError:
-            # Fallback for messy output
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                output = json.loads(json_match.group(0))
-            else:
-                output = {"medicine_name": None, "quantity": 1, "dosage_frequency": "As directed"}
+        prompt = prompts.ordering_prompt(text)
 
+        # A response that can't be repaired falls back to an empty order (normalize_order fills the defaults)
+        output = structured.complete(self.agent_name, OrderExtraction, "llama-3.3-70b-versatile", prompt,
+                                     prompts.ordering_max_tokens(text), default=OrderExtraction(items=[]))
+        output = normalize_order(output.model_dump())
         self.log_trace(session_id, patient_id, text, "Extracted structured data from natural text using Llama 3.3.", "Extracted", output)
         return output
 
@@ -95,105 +124,142 @@ class SafetyAgent(BaseAgent):
     def __init__(self):
         super().__init__("Safety & Policy Agent")
 
-    @traceable(name="SafetyAgent")
-    def run(self, session_id: str, patient_id: str, order_data: Dict[str, Any], prescription_data: Optional[str] = None) -> Dict[str, Any]:
+    def _lookup_products(self, names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Case-insensitive substring match for several medicine names against the in-process catalog."""
+        return self._with_fresh_stock({n: item.to_dict() if item else None for n, item in catalog.find_many(names).items()})
+
+    def _with_fresh_stock(self, products: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Optional[Dict[str, Any]]]:
+        # The in-stock decision reads dataset2, not the snapshot (other processes' writes reach it only on reload)
+        matched = [p for p in products.values() if p]
+        if matched:
+            stock = catalog.fresh_stock(p["_id"] for p in matched)
+            for p in matched:
+                p["stock"] = stock.get(p["_id"], 0)
+        return products
+
+    def _match_symptom(self, symptom: str) -> Optional[Dict[str, Any]]:
+        # Symptom Fallback Logic: Ask LLM to pick the best product for the symptom
+        print(f"DEBUG: Using Expert LLM to match symptom '{symptom}' to inventory...")
+        # A sample of inventory to help the LLM decide; descriptions are only fetched here
+        sample_products = catalog.descriptions(catalog.sample(prompts.SYMPTOM_PRODUCTS))
+        
+        prompt = prompts.symptom_prompt(symptom, sample_products)
+        completion = groq_client.chat.completions.create(
+            model="llama-3.1-8b-instant",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=prompts.MAX_OUTPUT_TOKENS["symptom"]
+        )
+        match_name = completion.choices[0].message.content.strip().strip('"')
+        
+        if match_name and match_name != "None":
+            product = catalog.find(match_name)
+            if product:
+                print(f"DEBUG: LLM Found diagnostic match: {match_name}")
+                return self._with_fresh_stock({match_name: product.to_dict()})[match_name]
+        return None
+
+    def _check(self, order_data: Dict[str, Any], product: Optional[Dict[str, Any]], prescription_data: Optional[str]) -> Tuple[Dict[str, Any], str]:
+        """Policy decision for one order line whose inventory lookup has already been done."""
         try:
             medicine_name = order_data.get("medicine_name")
             symptom = order_data.get("symptom")
 
-            product = None
-            if medicine_name:
-                # Substring scan
-                for item in inventory_col.find():
-                    if medicine_name.lower() in item.get("product name", "").lower():
-                        product = item
-                        break
-            
-            # Symptom Fallback Logic: Ask LLM to pick the best product for the symptom
             if not product and symptom:
-                print(f"DEBUG: Using Expert LLM to match symptom '{symptom}' to inventory...")
-                # Fetch a sample of inventory to help the LLM decide
-                sample_products = list(inventory_col.find({}, {"product name": 1, "medication description": 1, "indications": 1}).limit(20))
-                
-                prompt = f"""
-                As an Expert Pharmacist, match the user's symptom to the best medicine in our inventory.
-                Symptom: "{symptom}"
-                Available Products: {json.dumps(sample_products, default=str)}
-                
-                Return ONLY the exact "product name" of the best match, or "None" if no good match exists.
-                """
-                completion = groq_client.chat.completions.create(
-                    model="llama-3.1-8b-instant",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                match_name = completion.choices[0].message.content.strip().strip('"')
-                
-                if match_name and match_name != "None":
-                    product = inventory_col.find_one({"product name": match_name})
-                    if product:
-                        medicine_name = match_name
-                        print(f"DEBUG: LLM Found diagnostic match: {medicine_name}")
+                product = self._match_symptom(symptom)
+                if product:
+                    medicine_name = product.get("product name")
 
             if not medicine_name and not product:
-                 return {"approved": False, "reason": "I couldn't identify a specific medicine. Could you please tell me which one you usually take, or describe your symptoms more specifically?", "procurement_available": False}
-            
-            if not product:
+                reasoning = "Could not identify a medicine or matching symptom."
+                result = {"approved": False, "reason": "I couldn't identify a specific medicine. Could you please tell me which one you usually take, or describe your symptoms more specifically?", "procurement_available": False}
+            elif not product:
                 reasoning = f"Medicine '{medicine_name}' not found locally."
                 result = {"approved": False, "reason": reasoning, "procurement_available": True}
             elif product.get("stock", 0) <= 0:
                 reasoning = f"Medicine '{medicine_name}' is out of stock locally."
-                result = {"approved": False, "reason": reasoning, "procurement_available": True}
+                result = {"approved": False, "reason": reasoning, "procurement_available": True, "product": product}
             elif product.get("prescription_required") == "Yes":
                 if prescription_data:
                     reasoning = f"Validating prescription for '{medicine_name}'."
                     # Autonomous LLM Validation
-                    prompt = f"""
-                    You are a strict Pharmacy AI. The user is ordering '{medicine_name}'.
-                    They have provided the following prescription text:
-                    "{prescription_data}"
+                    prompt = prompts.prescription_prompt(medicine_name, prescription_data)
+                    validation = structured.complete(self.agent_name, PrescriptionValidation, "llama-3.1-8b-instant", prompt,
+                                                     prompts.MAX_OUTPUT_TOKENS["prescription"])
                     
-                    Does this prescription validly cover or mention '{medicine_name}' or a direct medical synonym/symptom for it?
-                    Return ONLY a JSON object:
-                    {{
-                        "is_valid": boolean,
-                        "explanation": "string explaining why it is valid or invalid"
-                    }}
-                    """
-                    completion = groq_client.chat.completions.create(
-                        model="llama-3.1-8b-instant",
-                        messages=[{"role": "user", "content": prompt}],
-                        response_format={"type": "json_object"}
-                    )
-                    validation = json.loads(completion.choices[0].message.content)
-                    
-                    if validation.get("is_valid"):
-                        reasoning = f"Prescription validated: {validation.get('explanation')}"
+                    if validation.is_valid:
+                        reasoning = f"Prescription validated: {validation.explanation}"
                         result = {"approved": True, "product": product}
                     else:
-                        reasoning = f"Prescription rejected: {validation.get('explanation')}"
-                        result = {"approved": False, "reason": f"I cannot approve this order based on the provided prescription. {validation.get('explanation')}"}
+                        reasoning = f"Prescription rejected: {validation.explanation}"
+                        result = {"approved": False, "reason": f"I cannot approve this order based on the provided prescription. {validation.explanation}"}
                 else:
                     reasoning = f"Medicine '{medicine_name}' requires a prescription."
-                    result = {"approved": False, "reason": reasoning, "prescription_needed": True}
+                    result = {"approved": False, "reason": reasoning, "prescription_needed": True, "product": product}
             else:
                 reasoning = f"Medicine '{medicine_name}' is available locally without a prescription."
                 result = {"approved": True, "product": product}
+        except StructuredOutputError as e:
+            print(f"Safety Check Error: {e}")
+            # Still held for a prescription (a new upload re-checks it), but the user is told why this one failed
+            result = {"approved": False, "reason": "I couldn't verify the prescription automatically. Please try again or upload a clearer prescription.",
+                      "prescription_needed": True, "prescription_unreadable": True, "product": product}
+            reasoning = "Prescription validation response unusable"
         except Exception as e:
             print(f"Safety Check Error: {e}")
             result = {"approved": False, "reason": "Expert suggestion: Not found in inventory.", "procurement_available": True}
             reasoning = "Fallback due to system error"
-            
+        return result, reasoning
+
+    @traceable(name="SafetyAgent")
+    def run(self, session_id: str, patient_id: str, order_data: Dict[str, Any], prescription_data: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            medicine_name = order_data.get("medicine_name")
+            product = self._lookup_products([medicine_name]).get(medicine_name) if medicine_name else None
+        except Exception as e:
+            print(f"Safety Lookup Error: {e}")
+            product = None
+        result, reasoning = self._check(order_data, product, prescription_data)
         self.log_trace(session_id, patient_id, {"order": order_data, "prescription": prescription_data}, reasoning, "Decision Made", result)
         return result
 
+    @traceable(name="SafetyAgent.batch")
+    def run_batch(self, session_id: str, patient_id: str, items: List[Dict[str, Any]], prescription_data: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Checks every order line with a single inventory query and a single trace."""
+        try:
+            products = self._lookup_products([i.get("medicine_name") for i in items])
+        except Exception as e:
+            print(f"Safety Lookup Error: {e}")
+            products = {}
+        results, reasons = [], []
+        for item in items:
+            result, reasoning = self._check(item, products.get(item.get("medicine_name")), prescription_data)
+            results.append(result)
+            reasons.append(reasoning)
+        self.log_trace(session_id, patient_id, {"items": items, "prescription": prescription_data}, " | ".join(reasons), f"{sum(r['approved'] for r in results)}/{len(results)} Approved", results)
+        return results
+
+    @traceable(name="SafetyAgent.recheck")
+    def recheck(self, session_id: str, patient_id: str, lines: List[Tuple[Dict[str, Any], Dict[str, Any]]], prescription_data: str) -> List[Dict[str, Any]]:
+        """Prescription follow-up: re-decides lines held for a prescription, reusing their resolved products."""
+        results, reasons = [], []
+        for item, verdict in lines:
+            result, reasoning = self._check(item, verdict.get("product"), prescription_data)
+            results.append(result)
+            reasons.append(reasoning)
+        self.log_trace(session_id, patient_id, {"items": [item for item, _ in lines], "prescription": prescription_data}, " | ".join(reasons), f"{sum(r['approved'] for r in results)}/{len(results)} Approved", results)
+        return results
+
 class RefillAgent(BaseAgent):
     def __init__(self):
         super().__init__("Predictive Refill Agent")
 
     @traceable(name="RefillAgent")
     def run(self, session_id: str, patient_id: str) -> List[Dict[str, Any]]:
-        # Fetch last orders for patient
-        history = list(orders_col.find({"patient.id": patient_id}).sort("purchase_date", -1).limit(5))
+        # Latest medications from the per-patient timeline (typed dates + supply on hand)
+        history = medication_timeline.for_patient(patient_id, limit=5)
+        if not history:
+            # Timeline not backfilled yet (see migrate_timeline.py)
+            history = orders_archive.find({"patient.id": patient_id}, [("purchased_at", -1), ("purchase_date", -1)], limit=5)
         
         alerts = []
         if not history:
@@ -201,31 +267,20 @@ class RefillAgent(BaseAgent):
             return alerts
 
         for order in history:
-            # Simple logic: if dosage is "twice a day" and qty is 30, it lasts 15 days.
-            # We'll use LLM to estimate refill need based on history.
-            prompt = f"""
-            Analyze this pharmacy order history and determine if a refill is needed soon.
-            Order: {json.dumps(order, default=str)}
-            Current Date: {datetime.date.today()}
-            
-            Return JSON:
-            {{
-                "needs_refill": boolean,
-                "days_until_refill": number,
-                "reason": "string"
-            }}
-            """
-            completion = groq_client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"}
-            )
-            analysis = json.loads(completion.choices[0].message.content)
-            if analysis["needs_refill"]:
+            # Only whitelisted facts (dates, dose, supply) go to the LLM, not the whole order document
+            prompt = prompts.refill_prompt(order, datetime.date.today())
+            try:
+                analysis = structured.complete(self.agent_name, RefillAnalysis, "llama-3.1-8b-instant", prompt,
+                                               prompts.MAX_OUTPUT_TOKENS["refill"])
+            except StructuredOutputError as e:
+                # One unusable answer skips that medication, not the whole analysis
+                print(f"⚠️ [REFILL] Skipping {order.get('_id')}: {e}")
+                continue
+            if analysis.needs_refill:
                 alerts.append({
-                    "medicine": order.get("product", {}).get("name"),
-                    "days": analysis["days_until_refill"],
-                    "reason": f"Proactive check: {analysis['reason']}"
+                    "medicine": order.get("product_name") or order.get("product", {}).get("name"),
+                    "days": analysis.days_until_refill,
+                    "reason": f"Proactive check: {analysis.reason}"
                 })
         
         self.log_trace(session_id, patient_id, patient_id, f"Expert Refill Analysis: Found {len(alerts)} items requiring attention soon.", "Analysis Complete", alerts)
@@ -247,34 +302,33 @@ class ActionAgent(BaseAgent):
         super().__init__("Action Agent")
 
     @traceable(name="ActionAgent")
-    def run(self, session_id: str, patient_id: str, order_data: Dict[str, Any], product: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    def run(self, session_id: str, patient_id: str, order_data: Dict[str, Any], product: Optional[Dict[str, Any]], procurement_job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         # Handle external procurement case
         if not product:
-            # Trigger external warehouse webhook (mock)
-            result = {"status": "Procurement Triggered", "source": "Partner Shop"}
-            self.log_trace(session_id, order_data, f"Medicine '{order_data.get('medicine_name')}' not found locally. Triggered external procurement.", "External Success", result)
+            # Queue for the partner-shop worker pool (batched per SKU into one purchase order)
+            if procurement_job:
+                job = procurement_job
+            else:
+                job = procurement_queue.enqueue(session_id, patient_id, order_data)
+            result = {"status": "Procurement Queued", "source": "Partner Shop", "job_id": str(job["_id"])}
+            self.log_trace(session_id, patient_id, order_data, f"Medicine '{order_data.get('medicine_name')}' not available locally. Queued external procurement job.", "External Queued", result)
             return result
 
         # 1. Insert order locally
-        merged_doc = {
-            "patient": {"id": patient_id},
-            "purchase_date": datetime.datetime.utcnow().isoformat(),
-            "product": {
-                "product_id": product.get("product id"),
-                "name": product.get("product name"),
-                "price": product.get("price rec")
-            },
-            "quantity": order_data.get("quantity", 1),
-            "total_price": float(product.get("price rec", 0)) * order_data.get("quantity", 1),
-            "dosage_frequency": order_data.get("dosage_frequency")
-        }
+        merged_doc = self._order_doc(patient_id, order_data, product)
         orders_col.insert_one(merged_doc)
+        medication_timeline.record_order(merged_doc)
         
-        # 2. Decrease stock
-        inventory_col.update_one(
+        # 2. Decrease stock (and keep the low-stock view in step)
+        updated = inventory_col.find_one_and_update(
             {"_id": product["_id"]},
-            {"$inc": {"stock": -(order_data.get("quantity", 1))}}
+            stamped({"$inc": {"stock": -(order_data.get("quantity", 1))}}),
+            projection=LOW_STOCK_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
+        low_stock_view.record(updated)
+        catalog.record_stock(updated)
+        response_cache.invalidate("orders", "inventory")
         
         # 3. Trigger Mock Webhook
         webhook_res = {"status": "success", "webhook_url": "https://webhook.site/mock-pharmacy-action"}
@@ -283,65 +337,479 @@ class ActionAgent(BaseAgent):
         self.log_trace(session_id, patient_id, order_data, "Executed DB updates and triggered webhook.", "Success", result)
         return result
 
+    @traceable(name="ActionAgent.batch")
+    def run_batch(self, session_id: str, patient_id: str, lines: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Commits several approved (order_data, product) lines: stock is reserved per product, then one
+        insert_many and one trace. Lines whose stock ran out since the safety check are not ordered;
+        their indexes into `lines` come back in "unreserved".
+        """
+        # 1. Reserve stock: every line of a product at once, line by line if the total doesn't fit
+        by_product: Dict[Any, List[int]] = {}
+        for i, (_, product) in enumerate(lines):
+            by_product.setdefault(product["_id"], []).append(i)
+        quantity = lambda i: lines[i][0].get("quantity", 1)
+        reserved, updated = [], {}
+        for product_id, indexes in by_product.items():
+            doc = self._reserve(product_id, sum(quantity(i) for i in indexes))
+            if doc is not None:
+                reserved += indexes
+                updated[product_id] = doc
+                continue
+            for i in indexes:
+                doc = self._reserve(product_id, quantity(i))
+                if doc is not None:
+                    reserved.append(i)
+                    updated[product_id] = doc
+        reserved.sort()
+        unreserved = [i for i in range(len(lines)) if i not in reserved]
+        low_stock_view.record_many(list(updated.values()))
+        for doc in updated.values():
+            catalog.record_stock(doc)
+
+        # 2. Insert the reserved orders
+        merged_docs = [self._order_doc(patient_id, *lines[i]) for i in reserved]
+        if merged_docs:
+            orders_col.insert_many(merged_docs)
+            medication_timeline.record_orders(merged_docs)
+        response_cache.invalidate("orders", "inventory")
+
+        result = {"status": "Order Processed" if merged_docs else "Insufficient Stock",
+                  "order_ids": [str(d["_id"]) for d in merged_docs], "unreserved": unreserved}
+        self.log_trace(session_id, patient_id, [order_data for order_data, _ in lines],
+                       f"Reserved stock for {len(reserved)} of {len(lines)} order lines and inserted them in one batch.",
+                       "Success" if not unreserved else "Partial", result)
+        return result
+
+    def _reserve(self, product_id: Any, quantity: int) -> Optional[Dict[str, Any]]:
+        """Takes `quantity` units if that many are in stock; the low-stock fields after, or None."""
+        return inventory_col.find_one_and_update(
+            {"_id": product_id, "stock": {"$gte": quantity}},
+            stamped({"$inc": {"stock": -quantity}}),
+            projection=LOW_STOCK_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    @traceable(name="ActionAgent.amend")
+    def amend(self, session_id: str, patient_id: str, order_id: str, product: Dict[str, Any], quantity: int) -> Dict[str, Any]:
+        """Changes the quantity of an order placed earlier in the conversation; stock moves by the difference."""
+        order = orders_col.find_one({"_id": ObjectId(order_id), "patient.id": patient_id})
+        if not order:
+            result = {"status": "Order Not Found", "order_id": order_id}
+            self.log_trace(session_id, patient_id, {"order_id": order_id, "quantity": quantity}, "Order to amend not found.", "Skipped", result)
+            return result
+        delta = quantity - (order.get("quantity") or 1)
+
+        # Only take more stock if it's there; giving stock back always succeeds
+        stock_filter = {"_id": product["_id"], "stock": {"$gte": delta}} if delta > 0 else {"_id": product["_id"]}
+        updated = inventory_col.find_one_and_update(
+            stock_filter,
+            stamped({"$inc": {"stock": -delta}}),
+            projection=LOW_STOCK_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            result = {"status": "Insufficient Stock", "order_id": order_id, "quantity": order.get("quantity")}
+            self.log_trace(session_id, patient_id, {"order_id": order_id, "quantity": quantity}, f"Not enough stock to add {delta} units.", "Rejected", result)
+            return result
+
+        price = (order.get("product") or {}).get("price") or 0
+        orders_archive.update({"_id": order["_id"]}, {"quantity": quantity, "total_price": float(price) * quantity})
+        medication_timeline.adjust_quantity(patient_id, order.get("product") or {}, delta)
+        low_stock_view.record(updated)
+        catalog.record_stock(updated)
+        response_cache.invalidate("orders", "inventory")
+
+        result = {"status": "Order Updated", "order_id": order_id, "quantity": quantity}
+        self.log_trace(session_id, patient_id, {"order_id": order_id, "quantity": quantity}, f"Changed quantity by {delta:+d} and adjusted stock.", "Success", result)
+        return result
+
+    def _order_doc(self, patient_id: str, order_data: Dict[str, Any], product: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.datetime.utcnow()
+        return {
+            "patient": {"id": patient_id},
+            "purchase_date": now.isoformat(),
+            "purchased_at": now,
+            "product": {
+                "product_id": product.get("product id"),
+                "name": product.get("product name"),
+                "price": product.get("price rec")
+            },
+            "quantity": order_data.get("quantity", 1),
+            "total_price": float(product.get("price rec", 0)) * order_data.get("quantity", 1),
+            "dosage_frequency": order_data.get("dosage_frequency")
+        }
+
 class Orchestrator:
     def __init__(self):
         self.ordering = OrderingAgent()
         self.safety = SafetyAgent()
         self.refill = RefillAgent()
         self.action = ActionAgent()
+        self.post_commit = ThreadPoolExecutor(max_workers=POST_COMMIT_WORKERS, thread_name_prefix="post-commit")
+
+    def run_refill_analysis(self, session_id: str, patient_id: str) -> List[Dict[str, Any]]:
+        """Runs the refill agent and stores its alerts for the dashboard."""
+        alerts = self.refill.run(session_id, patient_id)
+        refill_alerts_col.update_one(
+            {"patient_id": patient_id},
+            {"$set": {"patient_id": patient_id, "session_id": session_id, "alerts": alerts, "analyzed_at": datetime.datetime.utcnow()}},
+            upsert=True
+        )
+        return alerts
+
+    def _post_commit_task(self, session_id: str, patient_id: str):
+        try:
+            self.run_refill_analysis(session_id, patient_id)
+        except Exception as e:
+            print(f"Post-commit Refill Error ({patient_id}): {e}")
+
+    def get_stored_refill_alerts(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        return refill_alerts_col.find_one({"patient_id": patient_id}, {"_id": 0})
+
+    def _session_traces(self, session_id: str, agent_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        try:
+            query = {"session_id": session_id}
+            if agent_name:
+                query["agent_name"] = agent_name
+            traces = list(traces_col.find(query).sort("timestamp", 1))
+            for t in traces: t["_id"] = str(t["_id"])
+            return traces
+        except:
+            return []
 
     @traceable(name="Medicine Order Process")
-    def process_chat_order(self, session_id: str, patient_id: str, text: str, prescription_data: Optional[str] = None) -> Dict[str, Any]:
+    def process_chat_order(self, session_id: str, patient_id: str, text: str, prescription_data: Optional[str] = None, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        final_result = None
+        for event, payload in self.stream_chat_order(session_id, patient_id, text, prescription_data, conversation_id):
+            if event == "final":
+                final_result = payload
+        return final_result
+
+    @traceable(name="Medicine Order Stream")
+    def stream_chat_order(self, session_id: str, patient_id: str, text: str, prescription_data: Optional[str] = None, conversation_id: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Runs the agent chain and yields (event, payload) as each stage completes:
+        extraction, safety, action, confirmation, refill and finally "final" with the
+        same payload process_chat_order returns. With a conversation_id, a follow-up to
+        the previous turn is applied to its stored state instead (see sessions.py).
+        """
         try:
+            session = conversation_sessions.get(conversation_id, patient_id) if conversation_id else None
+            follow_up = classify_follow_up(text, session, prescription_data)
+            if follow_up:
+                yield from self._stream_follow_up(session_id, patient_id, conversation_id, session, *follow_up)
+                return
+
             # 1. Extraction
             order_details = self.ordering.run(session_id, patient_id, text)
+            yield "extraction", {"order": order_details, "traces": self._session_traces(session_id, self.ordering.agent_name)}
+
+            if len(order_details.get("items", [])) > 1:
+                yield from self._stream_multi_item(session_id, patient_id, order_details, prescription_data, conversation_id)
+                return
             
             # 2. Safety & Policy
             safety_result = self.safety.run(session_id, patient_id, order_details, prescription_data)
-            
-            # 1.5 Fetch traces safely
-            try:
-                internal_traces = list(traces_col.find({"session_id": session_id}).sort("timestamp", 1))
-                for t in internal_traces: t["_id"] = str(t["_id"])
-            except:
-                internal_traces = []
-
-            if not safety_result["approved"]:
-                med_name = order_details.get("medicine_name") or "this item"
-                if safety_result.get("procurement_available"):
-                    msg = f"We don't have '{med_name}' in our local inventory at the moment. However, as your expert pharmacist, I can procure it for you from one of our partner shops! Shall I proceed with the external order?"
-                elif safety_result.get("prescription_needed"):
-                    msg = f"I've found '{med_name}', but it requires a prescription which I don't see on file. Please upload it to continue."
-                else:
-                    msg = safety_result["reason"]
-                
-                return {
-                    "success": False,
-                    "message": msg,
-                    "traces": internal_traces
-                }
-            
-            # 3. Fulfillment (If approved)
-            action_result = self.action.run(session_id, patient_id, order_details, safety_result.get("product"))
-            
-            # 4. Refill Check
-            refill_alerts = self.refill.run(session_id, patient_id)
-            
-            final_result = {
-                "success": True,
-                "message": f"✅ Available! Order placed successfully for {order_details.get('medicine_name', 'your medicine')}.",
-                "order": order_details,
-                "refill_alerts": refill_alerts,
-                "action": action_result,
-                "traces": internal_traces
-            }
-            return final_result
+            yield from self._stream_decision(session_id, patient_id, order_details, safety_result, conversation_id)
         except Exception as e:
             print(f"Orchestrator Error: {e}")
             import traceback
             print(traceback.format_exc())
-            return {
+            yield "final", {
                 "success": False,
                 "message": "I encountered an issue processing your order. However, if the item is unavailable, I can usually procure it from a partner shop. Please try again or specify the medicine more clearly.",
+                # A transient failure (LLM timeout, DB blip): an Idempotency-Key retry must run again
+                "retryable": True,
                 "traces": []
             }
+
+    def _stream_decision(self, session_id: str, patient_id: str, order_details: Dict[str, Any], safety_result: Dict[str, Any], conversation_id: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Single-item chain from the safety verdict on: offer/refuse, or place the order and check refills."""
+        # 1.5 Fetch traces safely
+        internal_traces = self._session_traces(session_id)
+        yield "safety", {
+            "approved": safety_result["approved"],
+            "reason": safety_result.get("reason"),
+            "traces": [t for t in internal_traces if t.get("agent_name") == self.safety.agent_name]
+        }
+
+        if not safety_result["approved"]:
+            med_name = order_details.get("medicine_name") or "this item"
+            procurement_job_id = None
+            stage = CLOSED
+            if safety_result.get("procurement_available"):
+                msg = f"We don't have '{med_name}' in our local inventory at the moment. However, as your expert pharmacist, I can procure it for you from one of our partner shops! Shall I proceed with the external order?"
+                if order_details.get("medicine_name") or safety_result.get("product"):
+                    job = procurement_queue.propose(session_id, patient_id, order_details, safety_result.get("product"))
+                    procurement_job_id = str(job["_id"])
+                    stage = AWAITING_PROCUREMENT
+            elif safety_result.get("prescription_needed"):
+                msg = (safety_result["reason"] if safety_result.get("prescription_unreadable") else
+                       f"I've found '{med_name}', but it requires a prescription which I don't see on file. Please upload it to continue.")
+                stage = AWAITING_PRESCRIPTION
+            else:
+                msg = safety_result["reason"]
+            self._remember(conversation_id, patient_id, stage, order_details, [safety_result],
+                           procurement_job_ids=[procurement_job_id] if procurement_job_id else [])
+            
+            yield "final", {
+                "success": False,
+                "message": msg,
+                "procurement_job_id": procurement_job_id,
+                "traces": internal_traces
+            }
+            return
+        
+        # 3. Fulfillment (If approved)
+        action_result = self.action.run(session_id, patient_id, order_details, safety_result.get("product"))
+        self._remember(conversation_id, patient_id, PLACED, order_details, [safety_result], order_ids=[action_result.get("order_id")])
+        message = f"✅ Available! Order placed successfully for {order_details.get('medicine_name', 'your medicine')}."
+        yield "action", {"action": action_result, "traces": self._session_traces(session_id, self.action.agent_name)}
+        yield "confirmation", {"success": True, "message": message, "order": order_details, "action": action_result}
+        
+        # 4. Refill Check
+        refill_alerts, refill_deferred = yield from self._refill_stage(session_id, patient_id)
+        
+        yield "final", {
+            "success": True,
+            "message": message,
+            "order": order_details,
+            "refill_alerts": refill_alerts,
+            "refill_deferred": refill_deferred,
+            "action": action_result,
+            "traces": internal_traces
+        }
+
+    def _remember(self, conversation_id: Optional[str], patient_id: str, stage: str, order_details: Dict[str, Any], verdicts: List[Dict[str, Any]], **extra: Any):
+        """Keeps what this turn resolved so the next one can build on it."""
+        if not conversation_id:
+            return
+        extra.setdefault("procurement_job_ids", [])
+        extra.setdefault("order_ids", [])
+        conversation_sessions.save(conversation_id, patient_id, stage=stage, order=order_details, verdicts=verdicts, **extra)
+
+    def _merge_held_outcome(self, conversation_id: str, patient_id: str, session: Dict[str, Any], held: List[int], results: List[Dict[str, Any]]):
+        """
+        The re-decided held lines were remembered on their own; put the rest of the conversation back:
+        the other lines, their verdicts and any partner offer still awaiting a yes.
+        """
+        saved = conversation_sessions.get(conversation_id, patient_id) or {}
+        verdicts = list(session["verdicts"])
+        for i, result in zip(held, results):
+            verdicts[i] = result
+        procurement_job_ids = list(dict.fromkeys(session["procurement_job_ids"] + saved.get("procurement_job_ids", [])))
+        order_ids = list(dict.fromkeys(session["order_ids"] + saved.get("order_ids", [])))
+        if procurement_job_ids:
+            stage = AWAITING_PROCUREMENT
+        elif any(v.get("prescription_needed") for v in verdicts):
+            stage = AWAITING_PRESCRIPTION
+        else:
+            stage = saved.get("stage", session["stage"])
+        self._remember(conversation_id, patient_id, stage, session["order"], verdicts,
+                       procurement_job_ids=procurement_job_ids, order_ids=order_ids)
+
+    def _stream_follow_up(self, session_id: str, patient_id: str, conversation_id: str, session: Dict[str, Any], kind: str, arg: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Applies a follow-up turn to the stored conversation state; no extraction and no fresh safety run."""
+        print(f"DEBUG: Follow-up '{kind}' in conversation {conversation_id} (stage {session['stage']})")
+        order_details, verdicts = session["order"], session["verdicts"]
+
+        if kind == "prescription":
+            held = [i for i, v in enumerate(verdicts) if v.get("prescription_needed")]
+            lines = [(order_details["items"][i], verdicts[i]) for i in held]
+            results = self.safety.recheck(session_id, patient_id, lines, arg)
+            items = [item for item, _ in lines]
+            if len(items) == 1:
+                yield from self._stream_decision(session_id, patient_id, normalize_order({"items": items}), results[0], conversation_id)
+            else:
+                yield from self._stream_multi_item(session_id, patient_id, normalize_order({"items": items}), arg, conversation_id, safety_results=results)
+            self._merge_held_outcome(conversation_id, patient_id, session, held, results)
+            return
+
+        if kind == "confirm":
+            confirmed = [r for r in (self.confirm_procurement(job_id) for job_id in session["procurement_job_ids"]) if r]
+            self._remember(conversation_id, patient_id, CLOSED, order_details, verdicts)
+            yield "final", {
+                "success": bool(confirmed),
+                "message": "\n".join(r["message"] for r in confirmed) or "That partner order has already been placed.",
+                "action": confirmed[0]["action"] if confirmed else None,
+                "follow_up": kind,
+                "traces": self._session_traces(session_id)
+            }
+            return
+
+        if kind == "decline":
+            self._remember(conversation_id, patient_id, CLOSED, order_details, verdicts)
+            yield "final", {"success": True, "message": "No problem, I won't place that order. Is there anything else I can help you with?", "follow_up": kind, "traces": []}
+            return
+
+        # kind == "quantity": single-item conversation
+        item, verdict = order_details["items"][0], verdicts[0]
+        name = (verdict.get("product") or {}).get("product name") or item.get("medicine_name") or "your medicine"
+        previous = item.get("quantity") or 1
+        updated_order = normalize_order({**order_details, "items": [{**item, "quantity": arg}]})
+        stage, extra = session["stage"], {"procurement_job_ids": session["procurement_job_ids"], "order_ids": session["order_ids"]}
+        action_result = None
+        success = True
+        if stage == PLACED:
+            action_result = self.action.amend(session_id, patient_id, session["order_ids"][0], verdict["product"], arg)
+            yield "action", {"action": action_result, "traces": self._session_traces(session_id, self.action.agent_name)}
+            if action_result["status"] == "Order Updated":
+                message = f"✅ Updated! Your order for {name} is now x{arg}."
+            else:
+                success = False
+                updated_order = order_details
+                message = (f"Sorry, we don't have enough stock for {arg}; your order for {name} stays at x{previous}."
+                           if action_result["status"] == "Insufficient Stock" else "I couldn't find that order anymore. Please place it again.")
+        elif stage == AWAITING_PROCUREMENT:
+            for job_id in session["procurement_job_ids"]:
+                procurement_queue.set_quantity(job_id, arg)
+            message = f"Got it, {arg} of '{name}'. Shall I proceed with the external order?"
+        else:
+            message = f"Got it, {arg} of '{name}'. It requires a prescription, please upload it to continue."
+        self._remember(conversation_id, patient_id, stage, updated_order, verdicts, **extra)
+        yield "final", {
+            "success": success,
+            "message": message,
+            "order": updated_order,
+            "action": action_result,
+            "procurement_job_ids": extra["procurement_job_ids"] if stage == AWAITING_PROCUREMENT else [],
+            "follow_up": kind,
+            "traces": self._session_traces(session_id)
+        }
+
+    def _refill_stage(self, session_id: str, patient_id: str):
+        # Deferred past the response unless REFILL_MODE=inline
+        refill_deferred = REFILL_MODE != "inline"
+        if refill_deferred:
+            self.post_commit.submit(self._post_commit_task, session_id, patient_id)
+            refill_alerts = []
+            yield "refill", {"refill_alerts": refill_alerts, "deferred": True}
+        else:
+            refill_alerts = self.run_refill_analysis(session_id, patient_id)
+            yield "refill", {"refill_alerts": refill_alerts, "traces": self._session_traces(session_id, self.refill.agent_name)}
+        return refill_alerts, refill_deferred
+
+    def _stream_multi_item(self, session_id: str, patient_id: str, order_details: Dict[str, Any], prescription_data: Optional[str] = None,
+                           conversation_id: Optional[str] = None, safety_results: Optional[List[Dict[str, Any]]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Multi-line variant of the chain: one batched safety pass and one batched commit."""
+        items = order_details["items"]
+
+        # 2. Safety & Policy (one inventory query for all lines), unless a follow-up already re-decided them
+        if safety_results is None:
+            safety_results = self.safety.run_batch(session_id, patient_id, items, prescription_data)
+        internal_traces = self._session_traces(session_id)
+        yield "safety", {
+            "approved": any(r["approved"] for r in safety_results),
+            "items": [{"medicine_name": i.get("medicine_name"), "approved": r["approved"], "reason": r.get("reason")} for i, r in zip(items, safety_results)],
+            "traces": [t for t in internal_traces if t.get("agent_name") == self.safety.agent_name]
+        }
+
+        approved = [(item, r["product"]) for item, r in zip(items, safety_results) if r["approved"]]
+        summary, procurement_job_ids, notes = [], [], []
+        for item, r in zip(items, safety_results):
+            line = {"medicine_name": item.get("medicine_name"), "quantity": item.get("quantity"), "approved": r["approved"], "reason": r.get("reason")}
+            if not r["approved"]:
+                med_name = item.get("medicine_name") or "one item"
+                if r.get("procurement_available") and (item.get("medicine_name") or r.get("product")):
+                    job = procurement_queue.propose(session_id, patient_id, item, r.get("product"))
+                    line["procurement_job_id"] = str(job["_id"])
+                    procurement_job_ids.append(line["procurement_job_id"])
+                    notes.append(f"'{med_name}' isn't in our local inventory, but I can procure it from a partner shop.")
+                elif r.get("prescription_unreadable"):
+                    notes.append(f"'{med_name}': {r['reason']}")
+                elif r.get("prescription_needed"):
+                    notes.append(f"'{med_name}' requires a prescription which I don't see on file.")
+                else:
+                    notes.append(r.get("reason") or f"I couldn't approve '{med_name}'.")
+            summary.append(line)
+
+        # 3. Fulfillment (stock reserved per product, one insert_many)
+        action_result = None
+        if approved:
+            action_result = self.action.run_batch(session_id, patient_id, approved)
+            yield "action", {"action": action_result, "traces": self._session_traces(session_id, self.action.agent_name)}
+            # Lines the stock didn't cover: sold since the safety check, or several lines for one product
+            approved_at = [i for i, r in enumerate(safety_results) if r["approved"]]
+            for k in action_result.get("unreserved", []):
+                i = approved_at[k]
+                med_name = items[i].get("medicine_name") or "one item"
+                reason = f"Not enough '{med_name}' left in stock for {items[i].get('quantity', 1)} units."
+                safety_results[i] = {**safety_results[i], "approved": False, "reason": reason}
+                summary[i].update(approved=False, reason=reason)
+                notes.append(reason)
+            approved = [(item, r["product"]) for item, r in zip(items, safety_results) if r["approved"]]
+        if approved:
+            placed = ", ".join(f"{p.get('product name')} x{item.get('quantity', 1)}" for item, p in approved)
+            message = f"✅ Available! Order placed successfully for {placed}."
+        else:
+            message = "I couldn't place any of these items right now."
+        if notes:
+            message += " " + " ".join(notes)
+        if procurement_job_ids:
+            message += " Shall I proceed with the external order?"
+
+        if procurement_job_ids:
+            stage = AWAITING_PROCUREMENT
+        elif any(r.get("prescription_needed") for r in safety_results):
+            stage = AWAITING_PRESCRIPTION
+        else:
+            stage = PLACED if approved else CLOSED
+        self._remember(conversation_id, patient_id, stage, order_details, safety_results, procurement_job_ids=procurement_job_ids,
+                       order_ids=(action_result or {}).get("order_ids", []))
+
+        if not approved:
+            yield "final", {
+                "success": False,
+                "message": message,
+                "items": summary,
+                "procurement_job_ids": procurement_job_ids,
+                "traces": internal_traces
+            }
+            return
+
+        yield "confirmation", {"success": True, "message": message, "order": order_details, "items": summary, "action": action_result}
+
+        # 4. Refill Check
+        refill_alerts, refill_deferred = yield from self._refill_stage(session_id, patient_id)
+
+        yield "final", {
+            "success": True,
+            "message": message,
+            "order": order_details,
+            "items": summary,
+            "procurement_job_ids": procurement_job_ids,
+            "refill_alerts": refill_alerts,
+            "refill_deferred": refill_deferred,
+            "action": action_result,
+            "traces": internal_traces
+        }
+
+    @traceable(name="Batch Order Process")
+    def process_batch_order(self, session_id: str, patient_id: str, items: List[Dict[str, Any]], prescription_data: Optional[str] = None) -> Dict[str, Any]:
+        """Structured multi-line order (e.g. a clinic list): skips extraction, shares one safety and one commit pass."""
+        order_details = normalize_order({"items": items})
+        final_result = None
+        try:
+            for event, payload in self._stream_multi_item(session_id, patient_id, order_details, prescription_data):
+                if event == "final":
+                    final_result = payload
+        except Exception as e:
+            print(f"Orchestrator Error: {e}")
+            import traceback
+            print(traceback.format_exc())
+            final_result = {"success": False, "message": "I encountered an issue processing this batch order. Please try again.", "retryable": True, "traces": []}
+        return final_result
+
+    @traceable(name="Procurement Confirmation")
+    def confirm_procurement(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Patient said yes to "Shall I proceed?": release the proposed job to the worker pool."""
+        job = procurement_queue.confirm(job_id)
+        if not job:
+            return None
+        action_result = self.action.run(job["session_id"], job["patient_id"], job["order"], None, procurement_job=job)
+        return {
+            "success": True,
+            "message": f"📦 Great! I've placed an order for {job.get('medicine_name') or 'your medicine'} with our partner shops. I'll let you know once it's on its way.",
+            "action": action_result
+        }
@@ -0,0 +1,258 @@
+"""
+Server-side sales analytics over connected_orders, computed with aggregation pipelines.
+
+Reports read `purchased_at` (stamped on every order by ActionAgent / the /orders
+handlers, and on imported history by migrate_timeline.py). Per-product reports can
+run either on the raw orders or on the `daily_sales` rollup (one document per
+day and product), which a background thread refreshes every ANALYTICS_ROLLUP_SECONDS.
+The rollup only serves whole days before its last refresh; the rest of a window
+(today, and anything newer than the refresh) is read from the raw orders.
+Raw reads also cover the archived monthly partitions (archive.py) their window overlaps.
+"""
+import os
+import datetime
+import threading
+from typing import Iterable, List, Optional, Dict, Any
+from pymongo import ASCENDING
+
+# 0 disables the rollup thread; reports then always aggregate the raw orders
+ANALYTICS_ROLLUP_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_SECONDS", 300))
+# Each refresh recomputes this many trailing days; older days change only through an order
+# edit or delete, and the /orders handlers recompute those days themselves (refresh_days)
+ANALYTICS_ROLLUP_DAYS = int(os.getenv("ANALYTICS_ROLLUP_DAYS", 3))
+
+PERIODS = ("day", "week", "month", "year")
+AGE_BOUNDARIES = [0, 18, 30, 45, 60, 75, 200]
+
+# Covers every field the pipelines read, so the $match + $project stages never fetch documents
+COVERING_INDEX = [
+    ("purchased_at", ASCENDING),
+    ("product.product_id", ASCENDING),
+    ("product.name", ASCENDING),
+    ("quantity", ASCENDING),
+    ("total_price", ASCENDING),
+    ("patient.age", ASCENDING),
+    ("patient.gender", ASCENDING),
+]
+
+# Normalized line shape shared by the raw-order and rollup sources
+RAW_LINE = {
+    "_id": 0,
+    "at": "$purchased_at",
+    "product_id": "$product.product_id",
+    "name": "$product.name",
+    "units": {"$ifNull": ["$quantity", 0]},
+    "revenue": {"$ifNull": ["$total_price", 0]},
+    "orders": {"$literal": 1},
+}
+ROLLUP_LINE = {"_id": 0, "at": "$_id.day", "product_id": "$_id.product_id", "name": 1, "units": 1, "revenue": 1, "orders": 1}
+
+
+def day_of(at: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(at.year, at.month, at.day)
+
+
+class SalesAnalytics:
+    def __init__(self, orders_col, rollup_col, archive=None):
+        self.orders_col = orders_col
+        self.rollup_col = rollup_col
+        self.archive = archive
+        self._indexes_ready = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self.rollup_refreshed_at: Optional[datetime.datetime] = None
+
+    def ensure_indexes(self):
+        if not self._indexes_ready:
+            self.orders_col.create_index(COVERING_INDEX, name="analytics_covering")
+            self.rollup_col.create_index([("_id.day", ASCENDING)])
+            self._indexes_ready = True
+
+    # Sources
+    def _raw(self, match: Dict[str, Any], project: Dict[str, Any], start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+        stages = [{"$match": match}, {"$project": project}]
+        if self.archive is not None:
+            stages += self.archive.union_stages(list(stages), start, end)
+        return stages
+
+    def _lines(self, start: datetime.datetime, end: datetime.datetime, use_rollup: bool):
+        raw = lambda since: self._raw({"purchased_at": {"$gte": since, "$lt": end}}, RAW_LINE, since, end)
+        if not use_rollup or self.rollup_refreshed_at is None:
+            return self.orders_col, raw(start)
+        # Rollup days are complete only before the day its last refresh started in
+        cutoff = day_of(self.rollup_refreshed_at)
+        if start >= cutoff:
+            return self.orders_col, raw(start)
+        stages = [{"$match": {"_id.day": {"$gte": day_of(start), "$lt": min(end, cutoff)}}}, {"$project": ROLLUP_LINE}]
+        if end > cutoff:
+            stages.append({"$unionWith": {"coll": self.orders_col.name, "pipeline": raw(cutoff)}})
+        return self.rollup_col, stages
+
+    # Reports
+    def revenue(self, start: datetime.datetime, end: datetime.datetime, period: str = "month", limit: int = 10, use_rollup: bool = True) -> Dict[str, Any]:
+        """Revenue per period, overall and for each period's top products."""
+        col, stages = self._lines(start, end, use_rollup)
+        bucket = {"$dateTrunc": {"date": "$at", "unit": period}}
+        pipeline = stages + [
+            {"$group": {
+                "_id": {"period": bucket, "product_id": "$product_id"},
+                "name": {"$first": "$name"},
+                "units": {"$sum": "$units"},
+                "revenue": {"$sum": "$revenue"},
+                "orders": {"$sum": "$orders"},
+            }},
+            {"$sort": {"revenue": -1}},
+            {"$group": {
+                "_id": "$_id.period",
+                "revenue": {"$sum": "$revenue"},
+                "units": {"$sum": "$units"},
+                "orders": {"$sum": "$orders"},
+                "products": {"$push": {"product_id": "$_id.product_id", "name": "$name", "units": "$units", "revenue": "$revenue"}},
+            }},
+            {"$project": {"_id": 0, "period": "$_id", "revenue": 1, "units": 1, "orders": 1, "products": {"$slice": ["$products", limit]}}},
+            {"$sort": {"period": 1}},
+        ]
+        periods = list(col.aggregate(pipeline))
+        return {"period": period, "start": start, "end": end, "periods": periods}
+
+    def top_movers(self, days: int = 30, limit: int = 10, use_rollup: bool = True) -> Dict[str, Any]:
+        """Products whose units sold changed most between the last `days` and the `days` before."""
+        end = datetime.datetime.utcnow()
+        split = end - datetime.timedelta(days=days)
+        col, stages = self._lines(split - datetime.timedelta(days=days), end, use_rollup)
+        pipeline = stages + [
+            {"$group": {
+                "_id": "$product_id",
+                "name": {"$first": "$name"},
+                "current": {"$sum": {"$cond": [{"$gte": ["$at", split]}, "$units", 0]}},
+                "previous": {"$sum": {"$cond": [{"$lt": ["$at", split]}, "$units", 0]}},
+            }},
+            {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "current": 1, "previous": 1, "change": {"$subtract": ["$current", "$previous"]}}},
+            {"$facet": {
+                "rising": [{"$match": {"change": {"$gt": 0}}}, {"$sort": {"change": -1}}, {"$limit": limit}],
+                "falling": [{"$match": {"change": {"$lt": 0}}}, {"$sort": {"change": 1}}, {"$limit": limit}],
+            }},
+        ]
+        result = next(col.aggregate(pipeline), {"rising": [], "falling": []})
+        return {"days": days, **result}
+
+    def demographics(self, start: datetime.datetime, end: datetime.datetime) -> Dict[str, Any]:
+        """Average order value by age group and by gender (needs the raw orders: rollups are per product)."""
+        line = {"$ifNull": ["$total_price", 0]}
+        project = {"_id": 0, "age": "$patient.age", "gender": {"$ifNull": ["$patient.gender", "unknown"]}, "total": line}
+        pipeline = self._raw({"purchased_at": {"$gte": start, "$lt": end}}, project, start, end) + [
+            {"$facet": {
+                "by_age_group": [
+                    {"$bucket": {
+                        "groupBy": "$age",
+                        "boundaries": AGE_BOUNDARIES,
+                        "default": "unknown",
+                        "output": {"orders": {"$sum": 1}, "revenue": {"$sum": "$total"}, "avg_order_value": {"$avg": "$total"}},
+                    }},
+                ],
+                "by_gender": [
+                    {"$group": {"_id": "$gender", "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}, "avg_order_value": {"$avg": "$total"}}},
+                    {"$sort": {"_id": 1}},
+                ],
+                "overall": [
+                    {"$group": {"_id": None, "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}, "avg_order_value": {"$avg": "$total"}}},
+                    {"$project": {"_id": 0}},
+                ],
+            }},
+        ]
+        result = next(self.orders_col.aggregate(pipeline), {})
+        age_groups = []
+        for row in result.get("by_age_group", []):
+            low = row.pop("_id")
+            if low == "unknown":
+                row["age_group"] = "unknown"
+            else:
+                high = AGE_BOUNDARIES[AGE_BOUNDARIES.index(low) + 1]
+                row["age_group"] = f"{low}-{high - 1}" if high < AGE_BOUNDARIES[-1] else f"{low}+"
+            age_groups.append(row)
+        genders = [{"gender": row.pop("_id"), **row} for row in result.get("by_gender", [])]
+        overall = (result.get("overall") or [{"orders": 0, "revenue": 0, "avg_order_value": None}])[0]
+        return {"start": start, "end": end, "overall": overall, "by_age_group": age_groups, "by_gender": genders}
+
+    def velocity(self, days: int = 30, limit: int = 100, use_rollup: bool = True) -> List[Dict[str, Any]]:
+        """Units sold per day for each SKU over the trailing window, fastest first."""
+        end = datetime.datetime.utcnow()
+        col, stages = self._lines(end - datetime.timedelta(days=days), end, use_rollup)
+        pipeline = stages + [
+            {"$group": {
+                "_id": "$product_id",
+                "name": {"$first": "$name"},
+                "units": {"$sum": "$units"},
+                "orders": {"$sum": "$orders"},
+                "first_sale": {"$min": "$at"},
+                "last_sale": {"$max": "$at"},
+            }},
+            {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "units": 1, "orders": 1, "first_sale": 1, "last_sale": 1,
+                          "units_per_day": {"$round": [{"$divide": ["$units", days]}, 3]}}},
+            {"$sort": {"units_per_day": -1}},
+            {"$limit": limit},
+        ]
+        return list(col.aggregate(pipeline))
+
+    # Rollups
+    def refresh_rollups(self, days: Optional[int] = ANALYTICS_ROLLUP_DAYS) -> int:
+        """Recompute daily_sales for the trailing `days` (None: all history) and $merge it in place."""
+        with self._refresh_lock:
+            return self._refresh_rollups(days)
+
+    def refresh_days(self, times: Iterable[Optional[datetime.datetime]]):
+        """Recomputes the daily_sales rows of the days these order times fall on (an order there was edited or deleted)."""
+        days = sorted({day_of(at) for at in times if isinstance(at, datetime.datetime)})
+        with self._refresh_lock:
+            stamp = datetime.datetime.utcnow()
+            for day in days:
+                self._recompute(day, day + datetime.timedelta(days=1), stamp)
+
+    def _refresh_rollups(self, days: Optional[int]) -> int:
+        started = datetime.datetime.utcnow()
+        self._recompute(None if days is None else day_of(started) - datetime.timedelta(days=days), None, started)
+        self.rollup_refreshed_at = started
+        return self.rollup_col.estimated_document_count()
+
+    def _recompute(self, start: Optional[datetime.datetime], end: Optional[datetime.datetime], stamp: datetime.datetime):
+        """Rebuilds the rollup rows of the days in [start, end) (None: unbounded) and $merges them in place."""
+        window = {op: at for op, at in (("$gte", start), ("$lt", end)) if at is not None}
+        pipeline = self._raw({"purchased_at": window or {"$ne": None}}, RAW_LINE, start, end) + [
+            {"$group": {
+                "_id": {"day": {"$dateTrunc": {"date": "$at", "unit": "day"}}, "product_id": "$product_id"},
+                "name": {"$first": "$name"},
+                "units": {"$sum": "$units"},
+                "revenue": {"$sum": "$revenue"},
+                "orders": {"$sum": "$orders"},
+            }},
+            {"$set": {"refreshed_at": stamp}},
+            {"$merge": {"into": self.rollup_col.name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        self.orders_col.aggregate(pipeline)
+        # Recomputed days whose product no longer sold anything (deleted or edited orders) weren't rewritten
+        self.rollup_col.delete_many({**({"_id.day": window} if window else {}), "refreshed_at": {"$ne": stamp}})
+
+    def start(self, interval: float = ANALYTICS_ROLLUP_SECONDS):
+        if interval <= 0 or self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._rollup_loop, args=(interval,), name="analytics-rollup", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _rollup_loop(self, interval: float):
+        # First pass covers all history so the rollup can serve any date range
+        days = None
+        while not self._stop.is_set():
+            try:
+                self.refresh_rollups(days)
+                days = ANALYTICS_ROLLUP_DAYS
+            except Exception as e:
+                print(f"⚠️ [ANALYTICS] Rollup refresh failed: {e}")
+            self._stop.wait(interval)
@@ -0,0 +1,360 @@
+"""
+Time-partitioned archival for append-mostly collections (connected_orders, agent_traces).
+
+Documents older than a horizon move out of the hot collection into one archive
+collection per month (`connected_orders_archive_2024_03`, ...), registered in
+`archive_partitions`. The hot collection stays small enough to live in RAM; reads that
+reach past the horizon are unioned across the hot collection and the partitions that
+overlap the query's time window:
+
+    archive.find(query, sort, limit)      # newest-first reads stop at the first partition they can't need
+    archive.union_stages(stages, start)   # $unionWith stages for aggregations over a window
+    archive.update(query, fields)         # edits: the hot copy, or an archived one moved back to hot
+    archive.delete(query)                 # deletes from the hot collection and every partition
+
+Edits and deletes of archived collections go through update()/delete(): a pass claims
+each batch in the hot collection (ARCHIVE_CLAIM), and an edit clears the claim, so a
+document edited or deleted while it is being copied stays as the edit left it.
+
+    ARCHIVE_ORDERS_DAYS=365       orders purchased before this many days ago are archived
+    ARCHIVE_TRACES_DAYS=30        same for agent traces
+    ARCHIVE_INTERVAL_SECONDS=86400  how often the background pass runs (0 disables it)
+"""
+import os
+import time
+import heapq
+import datetime
+import threading
+from collections import defaultdict
+from typing import List, Optional, Dict, Any, Tuple
+from bson import ObjectId
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+ARCHIVE_ORDERS_DAYS = int(os.getenv("ARCHIVE_ORDERS_DAYS", 365))
+ARCHIVE_TRACES_DAYS = int(os.getenv("ARCHIVE_TRACES_DAYS", 30))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 86400))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 1000))
+# How long a worker trusts its list of partitions before re-reading archive_partitions
+ARCHIVE_PARTITION_TTL = float(os.getenv("ARCHIVE_PARTITION_TTL", 60))
+# A claim older than this belongs to a pass that died; another pass may take the batch over
+ARCHIVE_CLAIM_SECONDS = float(os.getenv("ARCHIVE_CLAIM_SECONDS", 600))
+
+# Set on hot documents while a pass copies them: {"token": pass id, "at": claim time}
+ARCHIVE_CLAIM = "_archive_claim"
+
+
+def month_start(at: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(at.year, at.month, 1)
+
+
+def next_month(month: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def time_window(query: Dict[str, Any], time_field: str) -> Tuple[Optional[datetime.datetime], Optional[datetime.datetime]]:
+    """[start, end) bounds a query puts on the time field (None: unbounded)."""
+    condition = query.get(time_field)
+    if isinstance(condition, datetime.datetime):
+        return condition, condition + datetime.timedelta(microseconds=1)
+    if not isinstance(condition, dict):
+        return None, None
+    start = condition.get("$gte", condition.get("$gt"))
+    end = condition.get("$lt")
+    if "$lte" in condition:
+        end = condition["$lte"] + datetime.timedelta(microseconds=1)
+    return start, end
+
+
+class Archive:
+    def __init__(self, db, source_col, time_field: str, horizon_days: int, indexes: List[List[Tuple[str, int]]], partitions_col=None):
+        self.db = db
+        self.source_col = source_col
+        self.time_field = time_field
+        self.horizon_days = horizon_days
+        self.indexes = indexes
+        self.partitions_col = partitions_col if partitions_col is not None else db["archive_partitions"]
+        self._partitions: List[Tuple[datetime.datetime, str]] = []
+        self._partitions_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.counters = {"reads": 0, "hot_only": 0, "partition_reads": 0, "read_ms": 0.0, "archived": 0}
+
+    def partition_name(self, month: datetime.datetime) -> str:
+        return f"{self.source_col.name}_archive_{month.year}_{month.month:02d}"
+
+    def ensure_indexes(self):
+        self.source_col.create_index([(self.time_field, ASCENDING)])
+        self.partitions_col.create_index([("source", ASCENDING), ("month", ASCENDING)])
+        for _, name in self.partitions(refresh=True):
+            self._create_partition_indexes(self.db[name])
+
+    def _create_partition_indexes(self, col):
+        for keys in self.indexes:
+            col.create_index(keys)
+
+    def partitions(self, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                   newest_first: bool = True, refresh: bool = False) -> List[Tuple[datetime.datetime, str]]:
+        """(month, collection name) of the partitions overlapping [start, end)."""
+        if refresh or time.monotonic() - self._partitions_loaded_at > ARCHIVE_PARTITION_TTL:
+            loaded = [(p["month"], p["_id"]) for p in self.partitions_col.find({"source": self.source_col.name}).sort("month", ASCENDING)]
+            with self._lock:
+                self._partitions = loaded
+                self._partitions_loaded_at = time.monotonic()
+        selected = [(month, name) for month, name in self._partitions
+                    if (start is None or next_month(month) > start) and (end is None or month < end)]
+        return selected[::-1] if newest_first else selected
+
+    def _partition(self, month: datetime.datetime):
+        name = self.partition_name(month)
+        if all(existing != name for _, existing in self._partitions):
+            col = self.db[name]
+            self._create_partition_indexes(col)
+            self.partitions_col.update_one(
+                {"_id": name},
+                {"$setOnInsert": {"source": self.source_col.name, "month": month, "created_at": datetime.datetime.utcnow()}},
+                upsert=True,
+            )
+            with self._lock:
+                self._partitions = sorted(self._partitions + [(month, name)])
+        return self.db[name]
+
+    # Moving documents
+    def run(self, now: Optional[datetime.datetime] = None, batch: int = ARCHIVE_BATCH) -> Dict[str, Any]:
+        """Moves every document older than the horizon into its monthly partition."""
+        started = time.perf_counter()
+        cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=self.horizon_days)
+        before = self.collection_stats(self.source_col.name)
+        self.partitions(refresh=True)
+        token = ObjectId()
+        ours = {f"{ARCHIVE_CLAIM}.token": token}
+        moved = 0
+        touched = set()
+        while True:
+            claimed_at = datetime.datetime.utcnow()
+            free = {"$or": [{ARCHIVE_CLAIM: {"$exists": False}},
+                            {f"{ARCHIVE_CLAIM}.at": {"$lt": claimed_at - datetime.timedelta(seconds=ARCHIVE_CLAIM_SECONDS)}}]}
+            ids = [d["_id"] for d in self.source_col.find({self.time_field: {"$lt": cutoff}, **free}, {"_id": 1})
+                   .sort(self.time_field, ASCENDING).limit(batch)]
+            if not ids:
+                break
+            # Claim first, then read: what gets copied is the version the claim is on
+            self.source_col.update_many({"_id": {"$in": ids}, **free},
+                                        {"$set": {ARCHIVE_CLAIM: {"token": token, "at": claimed_at}}})
+            docs = list(self.source_col.find({"_id": {"$in": ids}, **ours}))
+            by_month = defaultdict(list)
+            for doc in docs:
+                doc.pop(ARCHIVE_CLAIM)
+                by_month[month_start(doc[self.time_field])].append(doc)
+            homes = {}
+            for month, group in by_month.items():
+                partition = self._partition(month)
+                # Replaced, not inserted: a copy left by a pass that died may predate an edit, and the claimed version wins
+                partition.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in group], ordered=False)
+                touched.add(partition.name)
+                homes.update((doc["_id"], partition) for doc in group)
+            moved += self._release(homes, ours)
+        self.counters["archived"] += moved
+        self.last_run = {
+            "collection": self.source_col.name,
+            "cutoff": cutoff,
+            "moved": moved,
+            "partitions": sorted(touched),
+            "seconds": round(time.perf_counter() - started, 2),
+            "before": before,
+            "after": self.collection_stats(self.source_col.name),
+        }
+        return self.last_run
+
+    def _release(self, homes: Dict[Any, Any], ours: Dict[str, Any]) -> int:
+        """
+        Deletes the copied documents from the hot collection if they still carry this pass's
+        claim; the partition copy of any other one (edited or deleted since the claim) goes.
+        """
+        ids = list(homes)
+        # Deleted only once every copy is written, so a failure leaves documents readable in one place or both
+        unchanged = [d["_id"] for d in self.source_col.find({"_id": {"$in": ids}, **ours}, {"_id": 1})]
+        deleted = self.source_col.delete_many({"_id": {"$in": unchanged}, **ours}).deleted_count
+        gone = set(unchanged)
+        if deleted < len(unchanged):
+            # Edited between the check and the delete: still hot, so not archived
+            gone -= {d["_id"] for d in self.source_col.find({"_id": {"$in": unchanged}}, {"_id": 1})}
+        stale = defaultdict(list)
+        for _id in ids:
+            if _id not in gone:
+                stale[homes[_id].name].append(_id)
+        for name, stale_ids in stale.items():
+            self.db[name].delete_many({"_id": {"$in": stale_ids}})
+        return len(gone)
+
+    # Editing
+    def update(self, query: Dict[str, Any], fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        $set `fields` on the document matching `query`; an archived one moves back to the
+        hot collection (its time may have changed month) and the next pass files it again.
+        Returns the document as it was, or None.
+        """
+        previous = self.source_col.find_one_and_update(query, {"$set": fields, "$unset": {ARCHIVE_CLAIM: ""}})
+        if previous is not None:
+            previous.pop(ARCHIVE_CLAIM, None)
+            return previous
+        for _, name in self.partitions(refresh=True):
+            archived = self.db[name].find_one(query)
+            if archived is None:
+                continue
+            try:
+                self.source_col.insert_one({**archived, **fields})
+            except DuplicateKeyError:
+                # A concurrent edit brought it back first
+                self.source_col.update_one({"_id": archived["_id"]}, {"$set": fields})
+            self.db[name].delete_one({"_id": archived["_id"]})
+            return archived
+        return None
+
+    def delete(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Deletes the document matching `query` wherever it is; returns it, or None."""
+        deleted = self.source_col.find_one_and_delete(query)
+        # A pass may hold a copy in a partition too, so every location is checked
+        for _, name in self.partitions(refresh=True):
+            archived = self.db[name].find_one_and_delete(query)
+            deleted = deleted or archived
+        if deleted is not None:
+            deleted.pop(ARCHIVE_CLAIM, None)
+        return deleted
+
+    # Reading
+    def find(self, query: Dict[str, Any], sort: Optional[List[Tuple[str, int]]] = None, limit: int = 0,
+             projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Hot collection plus the partitions the query's time window overlaps, merged in
+        `sort` order. When the sort leads with the time field and a limit is set, partitions
+        are read in that order and the walk stops once no further partition can contribute.
+        """
+        started = time.perf_counter()
+        start, end = time_window(query, self.time_field)
+        descending = bool(sort) and sort[0] == (self.time_field, -1)
+        ascending = bool(sort) and sort[0] == (self.time_field, 1)
+
+        def read(col):
+            cursor = col.find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            docs = list(cursor)
+            for doc in docs:
+                doc.pop(ARCHIVE_CLAIM, None)
+            return docs
+
+        # Documents without the time field are never archived, so they only come from the hot collection
+        results = [read(self.source_col)]
+        merged = results[0]
+        read_partitions = 0
+        for month, name in self.partitions(start, end, newest_first=not ascending):
+            if limit and len(merged) >= limit:
+                boundary = merged[limit - 1].get(self.time_field)
+                if isinstance(boundary, datetime.datetime) and (
+                        (descending and boundary >= next_month(month)) or (ascending and boundary < month)):
+                    break
+            results.append(read(self.db[name]))
+            read_partitions += 1
+            merged = self._merge(results, descending, ascending)
+            if limit:
+                merged = merged[:limit]
+
+        self.counters["reads"] += 1
+        self.counters["hot_only"] += read_partitions == 0
+        self.counters["partition_reads"] += read_partitions
+        self.counters["read_ms"] += (time.perf_counter() - started) * 1000
+        return merged[:limit] if limit else merged
+
+    def _merge(self, results: List[List[Dict[str, Any]]], descending: bool, ascending: bool) -> List[Dict[str, Any]]:
+        # Missing times sort last on a descending read and first on an ascending one, as in Mongo
+        def key(doc):
+            at = doc.get(self.time_field)
+            return at if isinstance(at, datetime.datetime) else datetime.datetime.min
+        merged = heapq.merge(*results, key=key, reverse=descending) if descending or ascending else (doc for docs in results for doc in docs)
+        # A document being archived is briefly in both places; the hot copy is read first
+        seen = set()
+        unique = []
+        for doc in merged:
+            if "_id" in doc and doc["_id"] in seen:
+                continue
+            seen.add(doc.get("_id"))
+            unique.append(doc)
+        return unique
+
+    def union_stages(self, stages: List[Dict[str, Any]], start: Optional[datetime.datetime] = None,
+                     end: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+        """$unionWith stages that run `stages` over every partition overlapping [start, end)."""
+        return [{"$unionWith": {"coll": name, "pipeline": stages}}
+                for _, name in self.partitions(start, end, newest_first=False)]
+
+    # Observability
+    def collection_stats(self, name: str) -> Dict[str, Any]:
+        try:
+            s = self.db.command("collStats", name)
+        except Exception:
+            return {"count": 0, "size": 0, "storage_size": 0, "index_size": 0}
+        return {"count": s.get("count", 0), "size": s.get("size", 0), "storage_size": s.get("storageSize", 0), "index_size": s.get("totalIndexSize", 0)}
+
+    def stats(self) -> Dict[str, Any]:
+        partitions = self.partitions(refresh=True)
+        archived = [self.collection_stats(name) for _, name in partitions]
+        reads = self.counters["reads"]
+        return {
+            "collection": self.source_col.name,
+            "horizon_days": self.horizon_days,
+            # Working set: the hot collection plus its indexes is what regular traffic keeps in RAM
+            "hot": self.collection_stats(self.source_col.name),
+            "archive": {
+                "partitions": len(partitions),
+                "count": sum(s["count"] for s in archived),
+                "size": sum(s["size"] for s in archived),
+                "index_size": sum(s["index_size"] for s in archived),
+            },
+            "reads": {
+                "total": reads,
+                "hot_only": self.counters["hot_only"],
+                "partition_reads": self.counters["partition_reads"],
+                "avg_ms": round(self.counters["read_ms"] / reads, 2) if reads else None,
+            },
+            "archived_total": self.counters["archived"],
+            "last_run": self.last_run,
+        }
+
+
+class ArchiveWorker:
+    """Runs every archive's pass on an interval in one background thread."""
+
+    def __init__(self, archives: List[Archive]):
+        self.archives = archives
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def run(self) -> List[Dict[str, Any]]:
+        return [archive.run() for archive in self.archives]
+
+    def start(self, interval: float = ARCHIVE_INTERVAL_SECONDS):
+        if interval <= 0 or self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="archive", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _loop(self, interval: float):
+        while not self._stop.is_set():
+            for archive in self.archives:
+                try:
+                    result = archive.run()
+                    if result["moved"]:
+                        print(f"🗄️ [ARCHIVE] Moved {result['moved']} {archive.source_col.name} documents into {', '.join(result['partitions'])}")
+                except Exception as e:
+                    print(f"⚠️ [ARCHIVE] {archive.source_col.name} pass failed: {e}")
+            self._stop.wait(interval)
@@ -0,0 +1,51 @@
+"""
+In-process benchmark of the full agent chain (Orchestrator.process_chat_order).
+Run it offline against recorded Groq completions:
+
+    LLM_MODE=record python bench_agents.py 5            # once, with GROQ_API_KEY, to capture fixtures
+    LLM_MODE=replay python bench_agents.py 50           # replay with recorded latency
+    LLM_MODE=replay LLM_REPLAY_LATENCY=zero python bench_agents.py 200
+    LLM_MODE=replay LLM_INJECT_LATENCY_MS=500 python bench_agents.py 50
+
+The committed fixtures/groq_replay.jsonl is synthetic: it replays with zero latency, so
+latency figures need LLM_INJECT_LATENCY_MS or a real recording. Replay is strict by
+default; a prompt built from data that differs from the fixtures (e.g. the symptom
+match's catalog sample) raises ReplayMissError instead of replaying another answer.
+
+Needs MONGO_URL (a local mongod is fine). Orders are placed for PAT_BENCH001.
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from agents import Orchestrator, groq_client
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+TEXTS = [
+    "I need Paracetamol for fever",
+    "Please send 2 packs of Aqualibra",
+    "I have a headache, what can I take?",
+]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+orchestrator = Orchestrator()
+
+def one(i):
+    start = time.perf_counter()
+    result = orchestrator.process_chat_order(str(ObjectId()), "PAT_BENCH001", TEXTS[i % len(TEXTS)])
+    return (time.perf_counter() - start) * 1000, bool(result and result.get("success"))
+
+print(f"--- Agent chain ({groq_client.mode}, replay latency={groq_client.replay_latency}, +{groq_client.inject_latency_ms:.0f}ms injected), {N} runs x{CONCURRENCY} ---")
+start = time.perf_counter()
+with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+    results = list(pool.map(one, range(N)))
+elapsed = time.perf_counter() - start
+orchestrator.post_commit.shutdown(wait=True)
+
+latencies = [r[0] for r in results]
+print(f"throughput={N / elapsed:.2f} req/s p50={percentile(latencies, 0.5):.0f}ms p95={percentile(latencies, 0.95):.0f}ms successes={sum(r[1] for r in results)}/{N}")
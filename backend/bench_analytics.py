@@ -0,0 +1,72 @@
+"""
+Times each sales analytics report over a year of orders, raw pipeline vs daily_sales rollup.
+Needs MONGO_URL; seeds scratch collections so connected_orders is untouched.
+
+    python bench_analytics.py [orders] [skus]
+"""
+import os
+import sys
+import time
+import random
+import datetime
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from analytics import SalesAnalytics
+
+load_dotenv()
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+SKUS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+RUNS = 5
+
+client = MongoClient(os.getenv("MONGO_URL"))
+db = client[os.getenv("DB_NAME", "hackathon_db")]
+orders_col = db["bench_analytics_orders"]
+rollup_col = db["bench_analytics_daily_sales"]
+orders_col.drop()
+rollup_col.drop()
+
+random.seed(3)
+now = datetime.datetime.utcnow()
+batch = []
+for i in range(ORDERS):
+    sku = int(random.paretovariate(1.2)) % SKUS
+    quantity = random.randint(1, 3)
+    price = 5 + sku % 40
+    batch.append({
+        "patient": {"id": f"PAT{random.randint(1, 5000):05d}", "age": random.randint(16, 90), "gender": random.choice(["M", "F"])},
+        "purchased_at": now - datetime.timedelta(minutes=random.randint(0, 365 * 24 * 60)),
+        "product": {"product_id": sku, "name": f"Product {sku}", "price": price},
+        "quantity": quantity,
+        "total_price": quantity * price,
+    })
+    if len(batch) == 10_000:
+        orders_col.insert_many(batch)
+        batch = []
+if batch:
+    orders_col.insert_many(batch)
+
+analytics = SalesAnalytics(orders_col, rollup_col)
+analytics.ensure_indexes()
+start = time.perf_counter()
+rows = analytics.refresh_rollups(days=None)
+print(f"--- {ORDERS} orders, {SKUS} SKUs; full rollup: {rows} rows in {(time.perf_counter() - start) * 1000:.0f}ms ---")
+
+year_ago = now - datetime.timedelta(days=365)
+reports = [
+    ("revenue by month", lambda rollup: analytics.revenue(year_ago, now, "month", use_rollup=rollup)),
+    ("top movers (30d)", lambda rollup: analytics.top_movers(30, use_rollup=rollup)),
+    ("velocity (90d)", lambda rollup: analytics.velocity(90, use_rollup=rollup)),
+    ("demographics", lambda rollup: analytics.demographics(year_ago, now)),
+]
+for label, report in reports:
+    for rollup in (False, True):
+        times = []
+        for _ in range(RUNS):
+            t = time.perf_counter()
+            report(rollup)
+            times.append((time.perf_counter() - t) * 1000)
+        print(f"{label:<18} {'rollup' if rollup else 'raw':<7} best={min(times):.0f}ms median={sorted(times)[RUNS // 2]:.0f}ms")
+
+orders_col.drop()
+rollup_col.drop()
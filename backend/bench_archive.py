@@ -0,0 +1,102 @@
+"""
+Working-set size and query latency of connected_orders before and after archival
+(archive.py): patient history, the dashboard's latest orders, and raw analytics windows
+inside and across the horizon. Needs MONGO_URL; seeds scratch collections so
+connected_orders is untouched.
+
+    python bench_archive.py [orders] [years] [horizon_days]
+"""
+import os
+import sys
+import time
+import random
+import datetime
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from analytics import SalesAnalytics, COVERING_INDEX
+from archive import Archive
+
+load_dotenv()
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+YEARS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+HORIZON_DAYS = int(sys.argv[3]) if len(sys.argv) > 3 else 365
+PATIENTS = 5000
+RUNS = 5
+
+client = MongoClient(os.getenv("MONGO_URL"))
+db = client[os.getenv("DB_NAME", "hackathon_db")]
+orders_col = db["bench_archive_orders"]
+rollup_col = db["bench_archive_daily_sales"]
+partitions_col = db["bench_archive_partitions"]
+
+
+def drop_all():
+    for p in partitions_col.find():
+        db[p["_id"]].drop()
+    for col in (orders_col, rollup_col, partitions_col):
+        col.drop()
+
+
+drop_all()
+random.seed(5)
+now = datetime.datetime.utcnow()
+batch = []
+for i in range(ORDERS):
+    sku = int(random.paretovariate(1.2)) % 2000
+    quantity = random.randint(1, 3)
+    batch.append({
+        "patient": {"id": f"PAT{random.randint(1, PATIENTS):05d}", "age": random.randint(16, 90), "gender": random.choice(["M", "F"])},
+        "purchased_at": now - datetime.timedelta(minutes=random.randint(0, YEARS * 365 * 24 * 60)),
+        "product": {"product_id": sku, "name": f"Product {sku}", "price": 5 + sku % 40},
+        "quantity": quantity,
+        "total_price": quantity * (5 + sku % 40),
+    })
+    if len(batch) == 10_000:
+        orders_col.insert_many(batch)
+        batch = []
+if batch:
+    orders_col.insert_many(batch)
+
+archive = Archive(db, orders_col, "purchased_at", HORIZON_DAYS, [[("patient.id", 1), ("purchased_at", -1)], COVERING_INDEX], partitions_col)
+analytics = SalesAnalytics(orders_col, rollup_col, archive)
+orders_col.create_index([("patient.id", 1), ("purchased_at", -1)])
+analytics.ensure_indexes()
+archive.ensure_indexes()
+
+newest = [("purchased_at", -1)]
+queries = [
+    ("patient history (5)", lambda: archive.find({"patient.id": f"PAT{random.randint(1, PATIENTS):05d}"}, newest, 5)),
+    ("patient history (all)", lambda: archive.find({"patient.id": f"PAT{random.randint(1, PATIENTS):05d}"}, newest)),
+    ("latest 50 orders", lambda: archive.find({}, newest, 50)),
+    ("revenue 90d (raw)", lambda: analytics.revenue(now - datetime.timedelta(days=90), now, use_rollup=False)),
+    ("revenue 2y (raw)", lambda: analytics.revenue(now - datetime.timedelta(days=730), now, use_rollup=False)),
+]
+
+
+def working_set(label):
+    s = archive.stats()
+    hot, cold = s["hot"], s["archive"]
+    print(f"{label}: hot {hot['count']} docs, {(hot['size'] + hot['index_size']) / 2**20:.1f} MiB incl. indexes; "
+          f"archived {cold['count']} docs in {cold['partitions']} partitions")
+
+
+def timings(label):
+    for name, query in queries:
+        times = []
+        for _ in range(RUNS):
+            t = time.perf_counter()
+            query()
+            times.append((time.perf_counter() - t) * 1000)
+        print(f"  {label:<7} {name:<22} best={min(times):.1f}ms median={sorted(times)[RUNS // 2]:.1f}ms")
+
+
+print(f"--- {ORDERS} orders over {YEARS} years, horizon {HORIZON_DAYS} days ---")
+working_set("before")
+timings("before")
+result = archive.run()
+print(f"archived {result['moved']} orders in {result['seconds']}s")
+working_set("after")
+timings("after")
+
+drop_all()
@@ -0,0 +1,83 @@
+"""
+Memory and lookup speed of the compact catalog (catalog.py) against full inventory dicts.
+Runs offline on synthetic dataset2-shaped documents:
+
+    python bench_catalog.py            # 100k SKUs
+    python bench_catalog.py 500000
+"""
+import re
+import sys
+import time
+import random
+import tracemalloc
+from bson import ObjectId
+from catalog import Catalog, CatalogItem
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+LOOKUPS = 2000
+WORDS = ["Paracetamol", "Ibuprofen", "Omega-3", "Vitamin", "Kapseln", "Tabletten", "Spray", "Salbe", "Augentropfen", "Retard", "forte", "akut"]
+
+def make_doc(i):
+    name = f"{random.choice(WORDS)} {random.choice(WORDS)} {i} {random.choice([100, 200, 400, 500])} mg"
+    return {
+        "_id": ObjectId(),
+        "product id": 100000 + i,
+        "product name": name,
+        "pzn": str(1000000 + i).zfill(8),
+        "price rec": round(random.uniform(2, 80), 2),
+        "package size": f"{random.choice([10, 20, 50, 100])} St",
+        "descriptions": "Anwendung: " + " ".join(random.choice(WORDS) for _ in range(60)),
+        "stock": random.randint(0, 200),
+        "prescription_required": "Yes" if random.random() < 0.2 else "No",
+    }
+
+def make_docs():
+    # Same seed every time, so both representations hold the same products
+    random.seed(7)
+    return (make_doc(i) for i in range(N))
+
+class FakeCollection:
+    """Just enough of a pymongo collection for Catalog.load(); documents are built as the cursor is read."""
+    def find(self, query, projection):
+        return ({k: v for k, v in d.items() if k == "_id" or k in projection} for d in make_docs())
+
+def measure(build):
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+def load_catalog():
+    catalog = Catalog(FakeCollection())
+    catalog.load()
+    return catalog
+
+full, full_bytes = measure(lambda: list(make_docs()))
+catalog, catalog_bytes = measure(load_catalog)
+per_100k = 100_000 / N
+print(f"--- {N} SKUs ---")
+print(f"full documents:  {full_bytes / 1e6 * per_100k:.1f} MB per 100k SKUs")
+print(f"compact catalog: {catalog_bytes / 1e6 * per_100k:.1f} MB per 100k SKUs (records + id/name indexes)")
+
+exact = [d["product name"] for d in random.sample(full, LOOKUPS)]
+partial = [name.rsplit(" ", 2)[0] for name in exact[:200]]
+
+def dict_path(names):
+    # What SafetyAgent did per lookup: regex over every document's name, then pick the first substring match
+    patterns = [re.compile(re.escape(n), re.IGNORECASE) for n in names]
+    candidates = [d for d in full if any(p.search(d.get("product name", "")) for p in patterns)]
+    return {n: next((c for c in candidates if n.lower() in c.get("product name", "").lower()), None) for n in names}
+
+def timed(label, fn, names):
+    start = time.perf_counter()
+    for n in names:
+        fn([n])
+    per_lookup = (time.perf_counter() - start) * 1e6 / len(names)
+    print(f"{label:<34} {per_lookup:>10.1f} µs/lookup")
+
+timed("dict scan, exact name", dict_path, exact[:50])
+timed("catalog, exact name", catalog.find_many, exact)
+timed("dict scan, partial name", dict_path, partial[:50])
+timed("catalog, partial name", catalog.find_many, partial)
+assert all(isinstance(catalog.find(n), CatalogItem) for n in exact[:10])
@@ -0,0 +1,70 @@
+"""
+/chat-order latency benchmark against a running backend.
+Start the server once with REFILL_MODE=inline and once with REFILL_MODE=background
+and compare the p95 numbers:
+
+    python bench_chat_order.py [requests] [label]
+
+With a third argument "batch" it instead compares per-item throughput of N
+single-item /orders/batch calls against one N-item call:
+
+    python bench_chat_order.py 10 batch-test batch
+"""
+import sys
+import time
+import requests
+
+BASE = 'http://localhost:8002'
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+LABEL = sys.argv[2] if len(sys.argv) > 2 else "current"
+
+TEXTS = [
+    "I need Paracetamol for fever",
+    "Please send 2 packs of Aqualibra",
+    "I have a headache, what can I take?",
+]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def bench_batch():
+    items = [{'medicine_name': name, 'quantity': 1} for name in ("Paracetamol", "Aqualibra", "Ibuprofen")]
+    lines = [items[i % len(items)] for i in range(N)]
+
+    start = time.perf_counter()
+    for line in lines:
+        requests.post(f'{BASE}/orders/batch', json={'patient_id': 'PAT_BENCH001', 'items': [line]}, timeout=90)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    requests.post(f'{BASE}/orders/batch', json={'patient_id': 'PAT_BENCH001', 'items': lines}, timeout=90)
+    batched = time.perf_counter() - start
+
+    print(f"--- /orders/batch per-item throughput ({LABEL}), {N} items ---")
+    print(f"one item per call: {N / single:.1f} items/s | {N} items in one call: {N / batched:.1f} items/s ({single / batched:.1f}x)")
+
+if len(sys.argv) > 3 and sys.argv[3] == "batch":
+    bench_batch()
+    sys.exit(0)
+
+latencies = []
+errors = 0
+print(f"--- /chat-order latency ({LABEL}), {N} requests ---")
+for i in range(N):
+    payload = {'patient_id': 'PAT_BENCH001', 'text': TEXTS[i % len(TEXTS)]}
+    start = time.perf_counter()
+    try:
+        r = requests.post(f'{BASE}/chat-order', json=payload, timeout=90)
+        if r.status_code != 200:
+            errors += 1
+    except Exception as e:
+        print(f"❌ ERROR: {e}")
+        errors += 1
+        continue
+    latencies.append((time.perf_counter() - start) * 1000)
+
+if latencies:
+    print(f"p50={percentile(latencies, 0.5):.0f}ms p95={percentile(latencies, 0.95):.0f}ms max={max(latencies):.0f}ms errors={errors}")
+else:
+    print("❌ No successful requests")
@@ -0,0 +1,67 @@
+"""
+Procurement worker pool benchmark against a local partner-webhook stub.
+Needs MONGO_URL; uses a scratch collection so real jobs are untouched.
+
+    python bench_procurement.py [jobs] [skus] [workers]
+"""
+import os
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from procurement import ProcurementQueue, PartnerDispatcher, ProcurementWorkerPool
+
+load_dotenv()
+
+JOBS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+SKUS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+STUB_DELAY = float(os.getenv("STUB_DELAY", 0.02))
+
+received = []
+
+class PartnerStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        received.append(json.loads(body))
+        time.sleep(STUB_DELAY)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"accepted": true}')
+
+    def log_message(self, *args):
+        pass
+
+stub = ThreadingHTTPServer(("127.0.0.1", 0), PartnerStub)
+threading.Thread(target=stub.serve_forever, daemon=True).start()
+stub_url = f"http://127.0.0.1:{stub.server_address[1]}/po"
+
+client = MongoClient(os.getenv("MONGO_URL"))
+col = client[os.getenv("DB_NAME", "hackathon_db")]["procurement_jobs_bench"]
+col.delete_many({})
+
+queue = ProcurementQueue(col)
+pool = ProcurementWorkerPool(queue, PartnerDispatcher([stub_url]), workers=WORKERS)
+
+print(f"Enqueuing {JOBS} jobs over {SKUS} SKUs, {WORKERS} workers, stub delay {STUB_DELAY}s...")
+for i in range(JOBS):
+    queue.enqueue(f"bench-{i}", f"PAT_BENCH{i % 50}", {"medicine_name": f"Bench Medicine {i % SKUS}", "quantity": 1})
+
+start = time.time()
+pool.start()
+while col.count_documents({"status": {"$in": ["queued", "in_progress"]}}) > 0:
+    time.sleep(0.05)
+elapsed = time.time() - start
+pool.stop()
+
+stats = pool.stats()
+print(f"Ordered {stats['jobs_ordered']} jobs in {elapsed:.2f}s -> {stats['jobs_ordered'] / elapsed:.1f} jobs/s")
+print(f"Purchase orders sent to stub: {len(received)} (avg {JOBS / max(len(received), 1):.1f} jobs per PO)")
+print(f"End-to-end latency (queued -> ordered): p50={stats['latency_ms_p50']}ms p95={stats['latency_ms_p95']}ms")
+
+col.drop()
+stub.shutdown()
@@ -0,0 +1,215 @@
+"""
+Input tokens per /chat-order before and after prompt compaction (prompts.py).
+
+With recorded fixtures (LLM_MODE=record, see llm_replay.py; a small set is committed in
+fixtures/) every recorded prompt, old or compact, is parsed back into its inputs and
+rebuilt both ways; recorded usage.prompt_tokens (absent from synthetic fixtures) is shown
+next to the estimate to check the estimator, and ordering answers are checked against max_tokens.
+Without fixtures, a built-in scenario set (real products from ../dataset2.xlsx) is used.
+
+    python bench_prompts.py [fixtures.jsonl]
+"""
+import os
+import re
+import sys
+import json
+import datetime
+from collections import defaultdict
+import prompts
+from llm_replay import LLM_FIXTURES
+
+FIXTURES = sys.argv[1] if len(sys.argv) > 1 else LLM_FIXTURES
+TODAY = datetime.date.today()
+
+
+# The prompts as the agents built them before prompts.py
+def legacy_ordering(text):
+    return f"""
+        You are a Pharmacy Ordering AI. The user might speak in English, Hindi, Telugu, or a mix of these.
+        Extract order details from the user's text.
+        Text: "{text}"
+
+        Return ONLY valid JSON with one entry in "items" per medicine the user asks for:
+        {{
+            "items": [
+                {{
+                    "medicine_name": "string",
+                    "quantity": number,
+                    "dosage_frequency": "string",
+                    "symptom": "string"
+                }}
+            ],
+            "detected_language": "string"
+        }}
+        If details are missing, make a best guess or use null. Ensure the medicine name is translated/normalized to English if spoken in another language.
+        """
+
+def legacy_symptom(symptom, products):
+    return f"""
+        As an Expert Pharmacist, match the user's symptom to the best medicine in our inventory.
+        Symptom: "{symptom}"
+        Available Products: {json.dumps(products, default=str)}
+
+        Return ONLY the exact "product name" of the best match, or "None" if no good match exists.
+        """
+
+def legacy_prescription(medicine_name, prescription_data):
+    return f"""
+                    You are a strict Pharmacy AI. The user is ordering '{medicine_name}'.
+                    They have provided the following prescription text:
+                    "{prescription_data}"
+
+                    Does this prescription validly cover or mention '{medicine_name}' or a direct medical synonym/symptom for it?
+                    Return ONLY a JSON object:
+                    {{
+                        "is_valid": boolean,
+                        "explanation": "string explaining why it is valid or invalid"
+                    }}
+                    """
+
+def legacy_refill(order):
+    return f"""
+            Analyze this pharmacy order history and determine if a refill is needed soon.
+            Order: {json.dumps(order, default=str)}
+            Current Date: {TODAY}
+
+            Return JSON:
+            {{
+                "needs_refill": boolean,
+                "days_until_refill": number,
+                "reason": "string"
+            }}
+            """
+
+
+# Recorded prompt, old or compact -> (kind, prompt before prompts.py, compact prompt)
+def rebuild(prompt):
+    if "Pharmacy Ordering AI" in prompt:
+        text = re.search(r'Text: "(.*)"\n', prompt, re.DOTALL).group(1)
+        return "ordering", legacy_ordering(text), prompts.ordering_prompt(text)
+    if "match the user's symptom" in prompt:
+        symptom = re.search(r'Symptom: "(.*?)"\n', prompt).group(1)
+        listed = re.search(r"Available Products: (.*)\n", prompt)
+        if listed:
+            products = json.loads(listed.group(1))
+        else:
+            # Compact recordings list "- name: description"; the old prompt sent name and _id
+            lines = re.search(r"Products \(name: description\):\n(.*?)\nReturn", prompt, re.DOTALL).group(1).splitlines()
+            products = [dict(zip(("product name", "descriptions"), line[2:].split(": ", 1))) for line in lines]
+        sample = [{"_id": f"65f0c0ffee{i:014d}", "product name": p["product name"]} for i, p in enumerate(products)]
+        return "symptom", legacy_symptom(symptom, sample), prompts.symptom_prompt(symptom, products)
+    if "strict Pharmacy AI" in prompt:
+        medicine = re.search(r"ordering '(.*?)'\.", prompt).group(1)
+        prescription = re.search(r'[Pp]rescription text:\s*"(.*)"\s*\n', prompt, re.DOTALL).group(1)
+        return "prescription", legacy_prescription(medicine, prescription), prompts.prescription_prompt(medicine, prescription)
+    if "refill is needed soon" in prompt:
+        order = json.loads(re.search(r"Order: (.*)\n", prompt).group(1))
+        return "refill", legacy_refill(order), prompts.refill_prompt(order, TODAY)
+    if "needs a refill soon" in prompt:
+        # Compact recordings only carry the whitelisted facts; the old prompt sent the whole order
+        # (ids, patient, product description), so "before" here is a lower bound
+        facts = json.loads(re.search(r"Medication: (.*)\n", prompt).group(1))
+        order = {"patient": {"id": "PAT001"}, "product": {"name": facts.get("medicine")}, "purchase_date": facts.get("last_purchase"),
+                 "quantity": facts.get("last_qty"), "dosage_frequency": facts.get("dosage")}
+        return "refill", legacy_refill(order), prompt
+    return None, None, None
+
+
+def from_fixtures(path):
+    calls, ordering = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            recorded = record["messages"][-1]["content"]
+            try:
+                kind, before, after = rebuild(recorded)
+            except (AttributeError, json.JSONDecodeError):
+                kind, before, after = None, None, None
+            if kind:
+                calls.append((kind, before, after, (record.get("usage") or {}).get("prompt_tokens")))
+            if kind == "ordering":
+                ordering.append((re.search(r'Text: "(.*)"\n', recorded, re.DOTALL).group(1), record))
+    return calls, ordering
+
+
+def from_scenarios():
+    try:
+        import pandas as pd
+        df = pd.read_excel(os.path.join(os.path.dirname(__file__), "..", "dataset2.xlsx"))
+        products = df.to_dict("records")
+    except Exception as e:
+        print(f"(dataset2.xlsx unavailable: {e}; using placeholder products)")
+        products = [{"product id": i, "product name": f"Product {i}", "descriptions": "Lorem ipsum " * 30} for i in range(20)]
+    for i, p in enumerate(products):
+        p["_id"] = f"65f0c0ffee{i:014d}"
+        p.update({"stock": 20, "prescription_required": "No"})
+    product = products[0]
+    order = {
+        "_id": "65f0c0ffee0000000000beef",
+        "patient": {"id": "PAT001", "age": 54, "gender": "F"},
+        "purchase_date": "2025-01-10T09:12:44.123456",
+        "purchased_at": datetime.datetime(2025, 1, 10, 9, 12, 44),
+        "product": {"product_id": product["product id"], "name": product["product name"], "pzn": product.get("pzn"),
+                    "price": product.get("price rec"), "package_size": product.get("package size"), "description": product.get("descriptions")},
+        "quantity": 2,
+        "total_price": 33.9,
+        "dosage_frequency": "twice daily",
+    }
+    # The old projection asked for "medication description"/"indications", which dataset2 doesn't have;
+    # the compact prompt carries a clipped "descriptions" instead
+    legacy_sample = [{"_id": p["_id"], "product name": p["product name"]} for p in products[:20]]
+    symptom_sample = [{"product name": p["product name"], "descriptions": p.get("descriptions")} for p in products[:20]]
+    calls = []
+    for text in ["I need Paracetamol for fever", "Please send 2 packs of NORSAN Omega-3 Total and some eye drops", "mujhe sar dard ke liye kuch chahiye"]:
+        calls.append(("ordering", legacy_ordering(text), prompts.ordering_prompt(text), None))
+    calls.append(("symptom", legacy_symptom("headache", legacy_sample), prompts.symptom_prompt("headache", symptom_sample), None))
+    rx = "Dr. Weber, 12.01.2025. Rp: Mucosolvan 1x täglich Retardkapseln, 20 St. Diagnose: akute Bronchitis."
+    calls.append(("prescription", legacy_prescription(product["product name"], rx), prompts.prescription_prompt(product["product name"], rx), None))
+    for _ in range(5):
+        calls.append(("refill", legacy_refill(order), prompts.refill_prompt(order, TODAY), None))
+    return calls
+
+
+if os.path.exists(FIXTURES):
+    print(f"--- Prompt tokens from {FIXTURES} ---")
+    calls, ordering = from_fixtures(FIXTURES)
+else:
+    print(f"--- No fixtures at {FIXTURES}; built-in scenarios (3 chat orders, 1 symptom match, 1 prescription, 5 refill checks) ---")
+    calls, ordering = from_scenarios(), []
+
+totals = defaultdict(lambda: {"calls": 0, "before": 0, "after": 0, "recorded": 0, "over_budget": 0})
+for kind, before, after, recorded in calls:
+    t = totals[kind]
+    t["calls"] += 1
+    t["before"] += prompts.estimate_tokens(before)
+    t["after"] += prompts.estimate_tokens(after)
+    t["recorded"] += recorded or 0
+    t["over_budget"] += prompts.estimate_tokens(after) > prompts.BUDGETS[kind]
+
+print(f"{'agent call':<14}{'calls':>6}{'before/call':>13}{'after/call':>12}{'saved':>8}{'recorded/call':>15}{'budget':>8}")
+for kind, t in totals.items():
+    recorded = f"{t['recorded'] / t['calls']:.0f}" if t["recorded"] else "-"
+    print(f"{kind:<14}{t['calls']:>6}{t['before'] / t['calls']:>13.0f}{t['after'] / t['calls']:>12.0f}"
+          f"{1 - t['after'] / t['before']:>8.0%}{recorded:>15}{prompts.BUDGETS[kind]:>8}"
+          + (f"  ({t['over_budget']} over budget)" if t["over_budget"] else ""))
+
+# Every /chat-order makes exactly one ordering call; the rest are averaged over them
+orders = totals["ordering"]["calls"] or 1
+before = sum(t["before"] for t in totals.values()) / orders
+after = sum(t["after"] for t in totals.values()) / orders
+print(f"\nInput tokens per /chat-order (incl. background refill checks): {before:.0f} -> {after:.0f} ({1 - after / before:.0%} fewer)")
+
+# Ordering answers against max_tokens: a fixed cap truncates long lists, the sized one follows the item count
+if ordering:
+    print(f"\n{'ordering answer':<44}{'items':>6}{'completion':>12}{'fixed cap':>11}{'sized cap':>11}")
+    for text, record in ordering:
+        # Synthetic fixtures have no usage: the completion size is estimated from the answer
+        completion = (record.get("usage") or {}).get("completion_tokens") or prompts.estimate_tokens(record["content"])
+        fixed, sized = prompts.MAX_OUTPUT_TOKENS["ordering"], prompts.ordering_max_tokens(text)
+        flag = lambda cap: f"{cap}{'!' if completion > cap else ' '}"
+        print(f"{prompts.clip(text, 12):<44}{len(json.loads(record['content']).get('items') or []):>6}{completion:>12}{flag(fixed):>11}{flag(sized):>11}")
+    print("(! = the answer would have been cut off)")
+    if any(record.get("synthetic") for _, record in ordering):
+        print("(synthetic fixtures: hand-written answers, completion sizes estimated, not measured)")
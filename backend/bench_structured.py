@@ -0,0 +1,101 @@
+"""
+Legacy JSON handling in the agents vs the structured-output layer (structured.py), on a
+corpus of answer shapes seen from the Llama models: clean, fenced, prose-wrapped,
+numeric strings, wrong types, truncated by max_tokens and not JSON at all.
+Re-asks are answered by a canned client, so this runs offline.
+
+    python bench_structured.py [rounds]
+"""
+import re
+import sys
+import json
+import time
+from types import SimpleNamespace
+from structured import StructuredOutput, StructuredOutputError, OrderExtraction, PrescriptionValidation, RefillAnalysis
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+# (agent, schema, answer, what a re-ask returns)
+CORPUS = [
+    ("ordering", OrderExtraction, '{"items":[{"medicine_name":"Paracetamol","quantity":2,"dosage_frequency":"twice daily","symptom":"fever"}],"detected_language":"en"}', None),
+    ("ordering", OrderExtraction, '```json\n{"items":[{"medicine_name":"Ibuprofen","quantity":"1"}],"detected_language":"hi"}\n```', None),
+    ("ordering", OrderExtraction, 'Here is the order: {"medicine_name":"Omega-3","quantity":null}', None),
+    ("ordering", OrderExtraction, '{"items":[{"medicine_name":"Eye drops","quantity":"two packs"}]}', None),
+    ("ordering", OrderExtraction, '{"items":[{"medicine_name":"Cetirizine","quantity":1,"dosage_fre', '{"items":[{"medicine_name":"Cetirizine","quantity":1}]}'),
+    ("prescription", PrescriptionValidation, '{"is_valid":true,"explanation":"Mucosolvan is prescribed."}', None),
+    ("prescription", PrescriptionValidation, '{"is_valid":"yes","explanation":"Matches."}', None),
+    ("prescription", PrescriptionValidation, '{"valid":true,"explanation":"Matches."}', '{"is_valid":true}'),
+    ("prescription", PrescriptionValidation, 'The prescription is valid.', '{"is_valid":true,"explanation":"Valid."}'),
+    ("refill", RefillAnalysis, '{"needs_refill":true,"days_until_refill":3,"reason":"Runs out soon"}', None),
+    ("refill", RefillAnalysis, '{"needs_refill":false,"days_until_refill":"N/A","reason":"Enough supply"}', None),
+    ("refill", RefillAnalysis, '{"needs_refill":"unknown","days_until_refill":10,"reason":"Unclear dose"}', '{"needs_refill":false}'),
+    ("refill", RefillAnalysis, '{"needs_refill":true,"days_until_refill":2,"reason":"Last bought 28 days ago, 30', '{"needs_refill":true}'),
+]
+
+
+# The parsing each agent did before structured.py (an exception there failed the request/analysis)
+def legacy(agent, content):
+    if agent == "ordering":
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        try:
+            output = json.loads(content)
+        except json.JSONDecodeError:
+            json_match = re.search(r'\{.*\}', content, re.DOTALL)
+            if json_match:
+                output = json.loads(json_match.group(0))
+            else:
+                output = {"medicine_name": None, "quantity": 1, "dosage_frequency": "As directed"}
+        items = output.get("items") or [output]
+        # ActionAgent multiplies price by quantity
+        return [16.95 * (i.get("quantity") or 1) for i in items]
+    if agent == "prescription":
+        return bool(json.loads(content).get("is_valid"))
+    analysis = json.loads(content)
+    return analysis["needs_refill"] and int(analysis["days_until_refill"])
+
+
+class CannedClient:
+    def __init__(self):
+        self.answer = None
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))])
+
+
+legacy_failed = 0
+start = time.perf_counter()
+for _ in range(ROUNDS):
+    for agent, _schema, answer, _reask in CORPUS:
+        try:
+            legacy(agent, answer)
+        except Exception:
+            legacy_failed += 1
+legacy_us = (time.perf_counter() - start) * 1e6 / (ROUNDS * len(CORPUS))
+
+client = CannedClient()
+layer = StructuredOutput(client)
+failed = 0
+start = time.perf_counter()
+for _ in range(ROUNDS):
+    for agent, schema, answer, reask in CORPUS:
+        client.answer = reask or "{}"
+        try:
+            layer.parse(agent, "bench", schema, answer, "task")
+        except StructuredOutputError:
+            failed += 1
+structured_us = (time.perf_counter() - start) * 1e6 / (ROUNDS * len(CORPUS))
+
+total = ROUNDS * len(CORPUS)
+print(f"--- {len(CORPUS)} answer shapes x {ROUNDS} ---")
+print(f"legacy:     {legacy_failed / total:>6.1%} of calls failed their request/analysis   {legacy_us:.1f} µs/parse")
+print(f"structured: {failed / total:>6.1%} failed, {client.calls / total:.1%} needed a re-ask round-trip   {structured_us:.1f} µs/parse (excl. re-ask latency)")
+for agent, models in layer.stats().items():
+    c = models["bench"]
+    print(f"  {agent:<13} fast={c['fast_path'] / ROUNDS:.0f} local={c['repaired_locally'] / ROUNDS:.0f} "
+          f"reasked={c['reasked'] / ROUNDS:.0f} failed={c['failed'] / ROUNDS:.0f}")
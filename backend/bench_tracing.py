@@ -0,0 +1,75 @@
+"""
+Per-request overhead of the tracing layer (tracing.py) on an agent-shaped call tree:
+one root span with four agent spans carrying order dicts and an inventory document.
+Runs offline; the file exporter writes to a temp file.
+
+    python bench_tracing.py [requests]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracing
+from tracing import traceable, FileExporter
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+PRODUCT = {
+    "_id": "65f0c0ffee0000000000abcd",
+    "product id": 16066,
+    "product name": "Panthenol Spray, 46,3 mg/g Schaum zur Anwendung auf der Haut",
+    "pzn": "04020784",
+    "price rec": 16.95,
+    "descriptions": "Schaumspray zur Anwendung auf der Haut. " * 40,
+    "stock": 12,
+}
+
+class Agent:
+    @traceable(name="OrderingAgent")
+    def extract(self, session_id, patient_id, text):
+        return {"medicine_name": "Panthenol", "quantity": 2, "dosage_frequency": "twice daily", "items": [{"medicine_name": "Panthenol"}]}
+
+    @traceable(name="SafetyAgent")
+    def check(self, session_id, patient_id, order_data, prescription_data=None):
+        return {"approved": True, "product": PRODUCT}
+
+    @traceable(name="ActionAgent")
+    def act(self, session_id, patient_id, order_data, product):
+        return {"status": "Order Processed", "order_id": "65f0c0ffee0000000000beef"}
+
+    @traceable(name="RefillAgent")
+    def refill(self, session_id, patient_id):
+        return [{"medicine": "Panthenol", "days": 3, "reason": "Runs out soon"}]
+
+    @traceable(name="Medicine Order Process")
+    def process(self, session_id, patient_id, text, prescription_data=None):
+        order = self.extract(session_id, patient_id, text)
+        safety = self.check(session_id, patient_id, order, prescription_data)
+        action = self.act(session_id, patient_id, order, safety["product"])
+        return {"success": True, "action": action, "refill_alerts": self.refill(session_id, patient_id)}
+
+agent = Agent()
+
+def run(label, exporters, sample_rate):
+    q = tracing.export_queue
+    q.exporter_names = exporters
+    q.exporters = None
+    tracing.TRACE_SAMPLE_RATE = sample_rate
+    before = dict(q.counters)
+    start = time.perf_counter()
+    for i in range(N):
+        agent.process("S1", "PAT001", "I need Panthenol, my email is jane@example.com", "Rx: Panthenol")
+    per_request_us = (time.perf_counter() - start) * 1e6 / N
+    q.flush(timeout=60)
+    kept = q.counters["kept"] - before["kept"]
+    dropped = q.counters["dropped"] - before["dropped"]
+    print(f"{label:<28} {per_request_us:>8.1f} µs/request  kept={kept} dropped={dropped}")
+    return per_request_us
+
+with tempfile.TemporaryDirectory() as tmp:
+    tracing.EXPORTERS["file"] = lambda: FileExporter(os.path.join(tmp, "runs.jsonl"))
+    print(f"--- {N} requests, 5 spans each ---")
+    baseline = run("tracing off", [], 1.0)
+    for label, rate in (("file exporter, keep all", 1.0), ("file exporter, 10% sampled", 0.1), ("file exporter, 1% sampled", 0.01)):
+        cost = run(label, ["file"], rate)
+        print(f"{'':<28} +{cost - baseline:.1f} µs/request over tracing off")
@@ -0,0 +1,282 @@
+import os
+import re
+import time
+import bisect
+import threading
+from typing import List, Optional, Dict, Any, Iterable
+from bson import Timestamp
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+# Stock is kept current by this process's writers; reload periodically to pick up other writers (seed_stock.py)
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", 300))
+CATALOG_DESCRIPTION_CACHE = int(os.getenv("CATALOG_DESCRIPTION_CACHE", 512))
+# Products per /catalog/changes page
+CATALOG_SYNC_PAGE = int(os.getenv("CATALOG_SYNC_PAGE", 500))
+# $currentDate stamps a write before it commits, so a write stamped earlier can become visible after a
+# later one. /catalog/changes only hands out stamps older than this; keep it above app/mongod clock skew.
+CATALOG_SYNC_LAG_SECONDS = int(os.getenv("CATALOG_SYNC_LAG_SECONDS", 5))
+
+# Only the fields the agents decide on; long free text stays in Mongo
+PROJECTION = {"product id": 1, "product name": 1, "pzn": 1, "price rec": 1, "package size": 1, "stock": 1, "prescription_required": 1}
+DESCRIPTION_PROJECTION = {"product name": 1, "descriptions": 1, "medication description": 1, "indications": 1}
+# Every dataset2 write sets this to a server timestamp (see stamped()); clients sync by it
+VERSION_FIELD = "catalog_version"
+# Exact-code lookups (barcode scanners): code type -> dataset2 field
+CODE_FIELDS = {"pzn": "pzn", "product_id": "product id"}
+
+
+def normalize_code(value: Any) -> Optional[str]:
+    """
+    Canonical form of a PZN / product id. dataset2 stores PZNs as numbers, so
+    "04020784" from a scanner (Code 39 adds a leading "-", labels may add "PZN")
+    and 4020784 from the spreadsheet are the same code.
+    """
+    if value is None:
+        return None
+    text = str(value).strip().upper()
+    if text.endswith(".0"):
+        text = text[:-2]
+    text = re.sub(r"^(PZN)?[\s:-]*", "", text)
+    if not text.isdigit():
+        return None
+    return text.lstrip("0") or "0"
+
+
+def stamped(update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Adds the catalog version stamp to a dataset2 update. $currentDate with a BSON
+    timestamp is set by the server in the same write, unique and increasing on a
+    mongod, so no counter round-trip is needed.
+    """
+    return {**update, "$currentDate": {**update.get("$currentDate", {}), VERSION_FIELD: {"$type": "timestamp"}}}
+
+
+# seconds << 20 | increment stays below 2**53, so browsers can hold versions as plain numbers
+# (assumes fewer than ~1M dataset2 writes within one second)
+_INC_BITS = 20
+
+
+def version_of(stamp: Optional[Timestamp]) -> int:
+    """BSON timestamp as the integer version clients see."""
+    return (stamp.time << _INC_BITS) | min(stamp.inc, (1 << _INC_BITS) - 1) if stamp else 0
+
+
+def to_stamp(version: int) -> Timestamp:
+    return Timestamp(version >> _INC_BITS, version & ((1 << _INC_BITS) - 1))
+
+
+def code_variants(code: str) -> List[Any]:
+    """Stored representations a canonical code may have in dataset2 (number, zero-padded PZN-8 string, plain string)."""
+    return list(dict.fromkeys([int(code), code, code.zfill(8)]))
+
+
+class CatalogItem:
+    __slots__ = ("_id", "product_id", "name", "pzn", "price", "package_size", "stock", "prescription_required")
+
+    def __init__(self, doc: Dict[str, Any]):
+        self._id = doc["_id"]
+        self.product_id = doc.get("product id")
+        self.name = doc.get("product name") or ""
+        self.pzn = doc.get("pzn")
+        self.price = doc.get("price rec")
+        self.package_size = doc.get("package size")
+        self.stock = doc.get("stock", 0)
+        self.prescription_required = doc.get("prescription_required") == "Yes"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact inventory document, using dataset2 field names."""
+        return {
+            "_id": self._id,
+            "product id": self.product_id,
+            "product name": self.name,
+            "pzn": self.pzn,
+            "price rec": self.price,
+            "package size": self.package_size,
+            "stock": self.stock,
+            "prescription_required": "Yes" if self.prescription_required else "No",
+        }
+
+
+class Catalog:
+    """
+    In-process copy of dataset2 as slotted records, loaded with one projected
+    query. Descriptions are fetched per product only when a prompt needs them.
+    """
+
+    def __init__(self, inventory_col, refresh_seconds: float = CATALOG_REFRESH_SECONDS):
+        self.inventory_col = inventory_col
+        self.refresh_seconds = refresh_seconds
+        self.items: List[CatalogItem] = []
+        self._by_id: Dict[Any, CatalogItem] = {}
+        self._by_name: Dict[str, CatalogItem] = {}
+        self._by_code: Dict[str, Dict[str, CatalogItem]] = {kind: {} for kind in CODE_FIELDS}
+        # Lower-cased names joined by newlines, so substring search is one str.find instead of a Python loop
+        self._haystack = ""
+        self._starts: List[int] = []
+        self._descriptions: Dict[Any, Dict[str, Any]] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def load(self) -> int:
+        items = [CatalogItem(doc) for doc in self.inventory_col.find({}, PROJECTION)]
+        by_name, starts, offset = {}, [], 0
+        by_code = {kind: {} for kind in CODE_FIELDS}
+        for item in items:
+            name = item.name.lower().replace("\n", " ")
+            by_name.setdefault(name, item)
+            starts.append(offset)
+            offset += len(name) + 1
+            for kind, code in (("pzn", item.pzn), ("product_id", item.product_id)):
+                code = normalize_code(code)
+                if code is not None:
+                    by_code[kind].setdefault(code, item)
+        with self._lock:
+            self.items = items
+            self._by_id = {item._id: item for item in items}
+            self._by_name = by_name
+            self._by_code = by_code
+            self._haystack = "\n".join(item.name.lower().replace("\n", " ") for item in items)
+            self._starts = starts
+            self._loaded_at = time.monotonic()
+        return len(items)
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            # Nothing to serve yet: the first caller loads, concurrent ones wait for it
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self.load()
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._reload_lock.acquire(blocking=False):
+            # Stale: one background reload while every caller keeps using the current snapshot
+            threading.Thread(target=self._reload, name="catalog-reload", daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"⚠️ [CATALOG] Reload failed, keeping the current snapshot: {e}")
+        finally:
+            self._reload_lock.release()
+
+    def fresh_stock(self, ids: Iterable[Any]) -> Dict[Any, int]:
+        """Current stock for a few products straight from dataset2 (the snapshot may be up to refresh_seconds old for other writers)."""
+        docs = list(self.inventory_col.find({"_id": {"$in": list(ids)}}, {"stock": 1}))
+        for doc in docs:
+            self.record_stock(doc)
+        return {doc["_id"]: doc.get("stock", 0) for doc in docs}
+
+    def get(self, _id) -> Optional[CatalogItem]:
+        self._ensure_fresh()
+        return self._by_id.get(_id)
+
+    def find(self, name: str) -> Optional[CatalogItem]:
+        """Same matching as the old regex query: exact name first, else the first product containing it."""
+        self._ensure_fresh()
+        needle = name.strip().lower()
+        if not needle or "\n" in needle:
+            return None
+        item = self._by_name.get(needle)
+        if item is not None:
+            return item
+        items, haystack, starts = self.items, self._haystack, self._starts
+        pos = haystack.find(needle)
+        if pos < 0:
+            return None
+        return items[bisect.bisect_right(starts, pos) - 1]
+
+    def ensure_indexes(self):
+        """Unique indexes behind the code lookups; a duplicated code only downgrades its index to non-unique."""
+        for field in CODE_FIELDS.values():
+            try:
+                self.inventory_col.create_index([(field, ASCENDING)], unique=True, partialFilterExpression={field: {"$exists": True}})
+            except OperationFailure as e:
+                print(f"⚠️ [CATALOG] '{field}' is not unique in dataset2 ({e.code}); using a non-unique index")
+                self.inventory_col.create_index([(field, ASCENDING)])
+
+    def ensure_versions(self) -> int:
+        """Index the version stamp and stamp products no writer has touched yet (first start after upgrading)."""
+        self.inventory_col.create_index([(VERSION_FIELD, ASCENDING)])
+        return self.inventory_col.update_many({VERSION_FIELD: {"$exists": False}}, stamped({})).modified_count
+
+    def changes(self, since: int = 0, limit: int = CATALOG_SYNC_PAGE) -> Dict[str, Any]:
+        """
+        Products written after version `since`, oldest first. Pass the returned
+        version back to get the next page; "reset" tells the client to drop its copy
+        (the server's catalog is older than the client's version, e.g. a restored DB).
+        Writes from the last CATALOG_SYNC_LAG_SECONDS are held back until they have settled.
+        A first sync (since=0) pages through the whole catalog.
+        """
+        projection = {**PROJECTION, VERSION_FIELD: 1}
+        # Writes still inside the lag may not all be visible yet; the next sync picks them up
+        settled = Timestamp(int(time.time()) - CATALOG_SYNC_LAG_SECONDS, 0)
+        window = {"$gt": to_stamp(since), "$lt": settled}
+        docs = list(self.inventory_col.find({VERSION_FIELD: window}, projection).sort(VERSION_FIELD, ASCENDING).limit(limit))
+        if limit and len(docs) == limit:
+            # One update_many can give many products the same stamp; never split them across pages
+            last = docs[-1][VERSION_FIELD]
+            seen = {d["_id"] for d in docs if d[VERSION_FIELD] == last}
+            docs += [d for d in self.inventory_col.find({VERSION_FIELD: last}, projection) if d["_id"] not in seen]
+        elif not docs and since:
+            latest = self.inventory_col.find_one({}, {VERSION_FIELD: 1}, sort=[(VERSION_FIELD, DESCENDING)])
+            if latest is None or version_of(latest.get(VERSION_FIELD)) < since:
+                return {**self.changes(0, limit), "reset": True}
+        changes = [{**CatalogItem(d).to_dict(), "_id": str(d["_id"]), "version": version_of(d.get(VERSION_FIELD))} for d in docs]
+        return {
+            "version": changes[-1]["version"] if changes else since,
+            "changes": changes,
+            "has_more": bool(limit) and len(docs) >= limit,
+            "reset": False,
+        }
+
+    def by_code(self, kind: str, code: Any) -> Optional[CatalogItem]:
+        """O(1) exact lookup of a PZN or product id; never a fuzzy match."""
+        return self.lookup_codes(kind, [code]).get(code)
+
+    def lookup_codes(self, kind: str, codes: Iterable[Any]) -> Dict[Any, Optional[CatalogItem]]:
+        """
+        Resolves many codes from the in-process index. Codes it doesn't know (added
+        by another writer since the last refresh) are looked up in one indexed $in query.
+        """
+        self._ensure_fresh()
+        index = self._by_code[kind]
+        found: Dict[Any, Optional[CatalogItem]] = {}
+        missing: Dict[str, List[Any]] = {}
+        for code in codes:
+            canonical = normalize_code(code)
+            found[code] = index.get(canonical) if canonical is not None else None
+            if found[code] is None and canonical is not None:
+                missing.setdefault(canonical, []).append(code)
+        if missing:
+            field = CODE_FIELDS[kind]
+            variants = [v for canonical in missing for v in code_variants(canonical)]
+            for doc in self.inventory_col.find({field: {"$in": variants}}, PROJECTION):
+                item = CatalogItem(doc)
+                for code in missing.pop(normalize_code(doc.get(field)), []):
+                    found[code] = item
+        return found
+
+    def find_many(self, names: Iterable[str]) -> Dict[str, Optional[CatalogItem]]:
+        return {n: self.find(n) for n in dict.fromkeys(names) if n}
+
+    def sample(self, n: int) -> List[CatalogItem]:
+        self._ensure_fresh()
+        return self.items[:n]
+
+    def record_stock(self, doc: Optional[Dict[str, Any]]):
+        """Apply an inventory document (needs _id and stock) returned by a stock write."""
+        if doc and doc["_id"] in self._by_id:
+            self._by_id[doc["_id"]].stock = doc.get("stock", 0)
+
+    def descriptions(self, items: List[CatalogItem]) -> List[Dict[str, Any]]:
+        """Description fields for a handful of products, from cache or one $in query."""
+        missing = [item._id for item in items if item._id not in self._descriptions]
+        if missing:
+            docs = self.inventory_col.find({"_id": {"$in": missing}}, DESCRIPTION_PROJECTION)
+            with self._lock:
+                if len(self._descriptions) + len(missing) > CATALOG_DESCRIPTION_CACHE:
+                    self._descriptions.clear()
+                for doc in docs:
+                    self._descriptions[doc.pop("_id")] = doc
+        return [self._descriptions.get(item._id, {"product name": item.name}) for item in items]
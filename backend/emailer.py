@@ -1,7 +1,4 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 def send_refill_email(to_email: str, patient_username: str, alerts: list):
     """
@@ -45,7 +42,11 @@ def send_refill_email(to_email: str, patient_username: str, alerts: list):
         print("="*50 + "\n")
         return {"status": "mock", "message": "Email printed to console (SMTP not configured)"}
 
-    # Real SMTP Mode
+    # Real SMTP Mode (imported here so mock mode and app startup never load smtplib)
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+
     msg = MIMEMultipart("alternative")
     msg["Subject"] = "RxGenie Action Required: Proactive Refill Alert"
     msg["From"] = f"RxGenie Pharmacist <{sender_email}>"
@@ -0,0 +1,157 @@
+import os
+import time
+import json
+import uuid
+import hashlib
+import datetime
+import threading
+from typing import Callable, Dict, Any, Optional, Tuple
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# How long a completed response is replayed for the same Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+# An in-flight request older than this is assumed dead (process restarted) and may be taken over
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", 120))
+# How long a duplicate waits for the original before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 60))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", 0.25))
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body."""
+
+
+class IdempotencyInProgress(Exception):
+    """The original request is still running after IDEMPOTENCY_WAIT_SECONDS."""
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Idempotency-Key records in a Mongo collection: one document per (scope, key),
+    guarded by a unique index and expired by a TTL index. The first request claims
+    the key and runs; duplicates wait for its stored response.
+    """
+
+    def __init__(self, keys_col):
+        self.keys_col = keys_col
+        self.owner = uuid.uuid4().hex
+        self._indexes_ready = False
+        self._events: Dict[Tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        if not self._indexes_ready:
+            self.keys_col.create_index([("scope", ASCENDING), ("key", ASCENDING)], unique=True)
+            self.keys_col.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+
+    def run(self, scope: str, key: str, payload: Any, compute: Callable[[], Any], keep: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        Returns (response, replayed). compute() runs at most once per key while the record lives.
+        A response keep() rejects (a transient failure) is returned but not stored, so a retry runs again.
+        """
+        claimed, response = self.acquire(scope, key, payload)
+        if not claimed:
+            return response, True
+        return self._execute(scope, key, compute, keep), False
+
+    def acquire(self, scope: str, key: str, payload: Any) -> Tuple[bool, Any]:
+        """(True, None) once this caller owns the key and must complete() or release() it; (False, stored response) for a duplicate."""
+        self.ensure_indexes()
+        digest = fingerprint(payload)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            if self._claim(scope, key, digest):
+                return True, None
+
+            record = self.keys_col.find_one({"scope": scope, "key": key})
+            if record is None:
+                # Owner failed and released the key between our insert and read; try again
+                continue
+            if record["fingerprint"] != digest:
+                raise IdempotencyConflict(f"Idempotency-Key '{key}' was already used with a different request body")
+            if record["status"] == COMPLETED:
+                return False, record["response"]
+            if record["lease_until"] < datetime.datetime.utcnow() and self._take_over(record):
+                print(f"♻️ [IDEMPOTENCY] Took over abandoned request {scope}:{key}")
+                return True, None
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress(f"Request with Idempotency-Key '{key}' is still being processed")
+            self._wait(scope, key, min(IDEMPOTENCY_POLL_SECONDS * 4, max(0.0, deadline - time.monotonic())))
+
+    def _claim(self, scope: str, key: str, digest: str) -> bool:
+        now = datetime.datetime.utcnow()
+        try:
+            self.keys_col.insert_one({
+                "scope": scope,
+                "key": key,
+                "fingerprint": digest,
+                "status": IN_PROGRESS,
+                "owner": self.owner,
+                "created_at": now,
+                "lease_until": now + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+                "expires_at": now + datetime.timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            })
+        except DuplicateKeyError:
+            return False
+        with self._lock:
+            self._events[(scope, key)] = threading.Event()
+        return True
+
+    def _take_over(self, record: Dict[str, Any]) -> bool:
+        now = datetime.datetime.utcnow()
+        taken = self.keys_col.find_one_and_update(
+            {"_id": record["_id"], "status": IN_PROGRESS, "lease_until": record["lease_until"]},
+            {"$set": {"owner": self.owner, "lease_until": now + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+            return_document=ReturnDocument.AFTER
+        )
+        return taken is not None
+
+    def _execute(self, scope: str, key: str, compute: Callable[[], Any], keep: Optional[Callable[[Any], bool]] = None) -> Any:
+        try:
+            response = compute()
+        except BaseException:
+            # Failed requests aren't remembered: the client's retry runs again
+            self.release(scope, key)
+            raise
+        if keep is not None and not keep(response):
+            self.release(scope, key)
+        else:
+            self.complete(scope, key, response)
+        return response
+
+    def complete(self, scope: str, key: str, response: Any):
+        now = datetime.datetime.utcnow()
+        self.keys_col.update_one(
+            {"scope": scope, "key": key, "owner": self.owner},
+            {"$set": {"status": COMPLETED, "response": response, "completed_at": now,
+                      "expires_at": now + datetime.timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)}}
+        )
+        self._notify(scope, key)
+
+    def release(self, scope: str, key: str):
+        self.keys_col.delete_one({"scope": scope, "key": key, "owner": self.owner})
+        self._notify(scope, key)
+
+    def _wait(self, scope: str, key: str, timeout: float):
+        # Same-process duplicates wake as soon as the owner finishes; others poll Mongo
+        with self._lock:
+            event = self._events.get((scope, key))
+        if event is not None:
+            event.wait(timeout)
+        else:
+            time.sleep(min(IDEMPOTENCY_POLL_SECONDS, timeout))
+
+    def _notify(self, scope: str, key: str):
+        with self._lock:
+            event = self._events.pop((scope, key), None)
+        if event is not None:
+            event.set()
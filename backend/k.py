@@ -1,14 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pymongo import MongoClient
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from bson import ObjectId
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import os
+import json
+import time
+import queue
+import asyncio
+import datetime
+import threading
 from dotenv import load_dotenv
-from agents import Orchestrator
+from agents import Orchestrator, procurement_queue, low_stock_view, medication_timeline, response_cache, catalog, structured, conversation_sessions, orders_archive, traces_archive, client, db as agents_db
+from procurement import ProcurementWorkerPool
+from low_stock import PROJECTION as LOW_STOCK_PROJECTION
+from timeline import parse_purchase_date, product_key
+from static_files import StaticBundle
+from catalog import CATALOG_SYNC_PAGE, VERSION_FIELD, version_of
+import tracing
+from idempotency import IdempotencyStore, IdempotencyConflict, IdempotencyInProgress
+from analytics import SalesAnalytics, PERIODS, ANALYTICS_ROLLUP_DAYS
+from restock import RestockPlanner, METHODS as RESTOCK_METHODS, RESTOCK_METHOD, RESTOCK_HISTORY_DAYS
+from archive import ArchiveWorker
 
 load_dotenv()
 
@@ -22,26 +38,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME", "hackathon_db")
-
-try:
-    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-    # Trigger a connection check
-    client.admin.command('ping')
-    print("✅ Successfully connected to MongoDB")
-except Exception as e:
-    print(f"❌ MongoDB Connection Error: {e}")
-    print(f"Check if MONGO_URL is set correctly in Render/local .env")
-    client = None
-
-db = client[DB_NAME] if client else None
-orders_col = db["connected_orders"] if db is not None else None
-inventory_col = db["dataset2"] if db is not None else None
-traces_col = db["agent_traces"] if db is not None else None
-users_col = db["users"] if db is not None else None
+# Upper bound on codes per POST /products/lookup (a scanned delivery or basket)
+PRODUCT_LOOKUP_MAX_CODES = int(os.getenv("PRODUCT_LOOKUP_MAX_CODES", 1000))
+# Low-stock SSE: how often an idle stream checks the in-process feed, and re-reads the shared view
+LOW_STOCK_POLL_SECONDS = float(os.getenv("LOW_STOCK_POLL_SECONDS", 0.5))
+LOW_STOCK_RESYNC_SECONDS = float(os.getenv("LOW_STOCK_RESYNC_SECONDS", 30))
+
+# Share the agents' MongoClient instead of opening a second pool. No ping here:
+# connectivity is checked by the /health/ready readiness probe, so a cold start
+# serves requests as soon as the app is imported.
+db = agents_db
+orders_col = db["connected_orders"]
+inventory_col = db["dataset2"]
+traces_col = db["agent_traces"]
+users_col = db["users"]
 
 orchestrator = Orchestrator()
+procurement_pool = ProcurementWorkerPool(procurement_queue)
+sales_analytics = SalesAnalytics(orders_col, db["daily_sales"], orders_archive)
+restock_planner = RestockPlanner(orders_col, inventory_col, db["restock_plan"], orders_archive)
+archive_worker = ArchiveWorker([orders_archive, traces_archive])
+idempotency = IdempotencyStore(db["idempotency_keys"])
+
+def warm_up():
+    try:
+        client.admin.command('ping')
+        print("✅ Successfully connected to MongoDB")
+        procurement_pool.start()
+        low_stock_view.ensure_indexes()
+        catalog.ensure_indexes()
+        stamped_count = catalog.ensure_versions()
+        if stamped_count:
+            print(f"🏷️ Stamped {stamped_count} products with a catalog version")
+        medication_timeline.ensure_indexes()
+        orders_col.create_index([("patient.id", 1), ("purchased_at", -1)])
+        sales_analytics.ensure_indexes()
+        idempotency.ensure_indexes()
+        conversation_sessions.ensure_indexes()
+        orders_archive.ensure_indexes()
+        traces_archive.ensure_indexes()
+        sales_analytics.start()
+        archive_worker.start()
+        if low_stock_view.is_empty():
+            print(f"📉 Built low-stock view with {low_stock_view.rebuild(inventory_col)} items")
+            response_cache.invalidate("inventory")
+        print(f"📦 Loaded {catalog.load()} catalog items")
+    except Exception as e:
+        print(f"❌ MongoDB Connection Error: {e}")
+        print(f"Check if MONGO_URL is set correctly in Render/local .env")
+
+@app.on_event("startup")
+def start_background_services():
+    # Index builds and worker start-up run off the startup path so the port opens immediately
+    threading.Thread(target=warm_up, daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_services():
+    procurement_pool.stop()
+    sales_analytics.stop()
+    archive_worker.stop()
+    orchestrator.post_commit.shutdown(wait=True)
+    tracing.flush()
 
 # =============================
 # Pydantic Models
@@ -78,6 +136,22 @@ class ChatOrderRequest(BaseModel):
     patient_id: str
     text: str
     prescription_data: Optional[str] = None
+    # Returned by the previous turn; follow-ups ("yes", "make it 3") reuse its state
+    conversation_id: Optional[str] = None
+
+class ProductLookupRequest(BaseModel):
+    pzns: List[Union[str, int]] = []
+    product_ids: List[Union[str, int]] = []
+
+class BatchOrderItem(BaseModel):
+    medicine_name: str
+    quantity: int = 1
+    dosage_frequency: Optional[str] = None
+
+class BatchOrderRequest(BaseModel):
+    patient_id: str
+    items: List[BatchOrderItem]
+    prescription_data: Optional[str] = None
 
 # =============================
 # Auth Endpoints
@@ -125,69 +199,374 @@ async def update_email(request: Dict[str, str]):
 # Agentic AI APIs
 # =============================
 
+# Ensure result is JSON serializable (handle ObjectIds or complex types)
+def clean_data(obj):
+    if isinstance(obj, list): return [clean_data(x) for x in obj]
+    if isinstance(obj, dict): return {k: clean_data(v) for k, v in obj.items()}
+    if isinstance(obj, ObjectId): return str(obj)
+    return obj
+
+def keep_response(response) -> bool:
+    # Orchestrator error payloads are transient failures: the key is released so a retry runs again
+    return not (isinstance(response, dict) and response.get("retryable"))
+
+def acquire_idempotency(scope: str, key: str, payload: Dict):
+    try:
+        return idempotency.acquire(scope, key, payload)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def run_idempotent(scope: str, key: Optional[str], payload: Dict, compute):
+    """Runs compute() once per Idempotency-Key; retries with the same key get the stored response."""
+    if not key:
+        return compute()
+    try:
+        response, replayed = idempotency.run(scope, key, payload, compute, keep_response)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return JSONResponse(content=response, headers={"Idempotent-Replayed": "true" if replayed else "false"})
+
 @app.post("/chat-order")
-async def chat_order(request: ChatOrderRequest):
+def chat_order(request: ChatOrderRequest, idempotency_key: Optional[str] = Header(None)):
+    def place():
+        session_id = str(ObjectId())
+        conversation_id = request.conversation_id or str(ObjectId())
+        try:
+            result = orchestrator.process_chat_order(session_id, request.patient_id, request.text, request.prescription_data, conversation_id)
+            return jsonable_encoder(clean_data({**result, "conversation_id": conversation_id}))
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=str(e))
+    return run_idempotent("chat-order", idempotency_key, request.dict(), place)
+
+@app.post("/chat-order/stream")
+def chat_order_stream(request: ChatOrderRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Server-Sent Events variant of /chat-order: one event per agent stage, "final" last.
+    Shares /chat-order's Idempotency-Key scope, so a retry on either endpoint replays the other's result.
+    """
+    claimed = True
+    if idempotency_key:
+        claimed, stored = acquire_idempotency("chat-order", idempotency_key, request.dict())
+    if not claimed:
+        def replay():
+            yield f"event: session\ndata: {json.dumps({'conversation_id': stored.get('conversation_id'), 'replayed': True})}\n\n"
+            yield f"event: final\ndata: {json.dumps(stored, default=str)}\n\n"
+        return StreamingResponse(replay(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "Idempotent-Replayed": "true"})
+
     session_id = str(ObjectId())
-    try:
-        result = orchestrator.process_chat_order(session_id, request.patient_id, request.text, request.prescription_data)
-        
-        # Ensure result is JSON serializable (handle ObjectIds or complex types)
-        def clean_data(obj):
-            if isinstance(obj, list): return [clean_data(x) for x in obj]
-            if isinstance(obj, dict): return {k: clean_data(v) for k, v in obj.items()}
-            if isinstance(obj, ObjectId): return str(obj)
-            return obj
-
-        return clean_data(result)
-    except Exception as e:
-        import traceback
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
+    conversation_id = request.conversation_id or str(ObjectId())
+    events = orchestrator.stream_chat_order(session_id, request.patient_id, request.text, request.prescription_data, conversation_id)
+
+    def finish(final):
+        if not idempotency_key:
+            return
+        response = jsonable_encoder(clean_data({**final, "conversation_id": conversation_id})) if final else None
+        if response is not None and keep_response(response):
+            idempotency.complete("chat-order", idempotency_key, response)
+        else:
+            idempotency.release("chat-order", idempotency_key)
+
+    def drain():
+        # The client went away mid-order: finish the chain so the key's retry replays it instead of ordering twice
+        final = None
+        try:
+            for event, payload in events:
+                if event == "final":
+                    final = payload
+        finally:
+            finish(final)
+
+    def event_stream():
+        final = None
+        try:
+            yield f"event: session\ndata: {json.dumps({'session_id': session_id, 'conversation_id': conversation_id})}\n\n"
+            for event, payload in events:
+                if event == "final":
+                    final = payload
+                yield f"event: {event}\ndata: {json.dumps(clean_data(payload), default=str)}\n\n"
+        except GeneratorExit:
+            if final is None and idempotency_key:
+                threading.Thread(target=drain, name="chat-order-drain", daemon=True).start()
+                return
+            finish(final)
+            raise
+        except BaseException:
+            finish(None)
+            raise
+        finish(final)
+
+    # StreamingResponse iterates sync generators in the threadpool, so the blocking agent calls don't stall the loop
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Idempotent-Replayed": "false"})
+
+@app.post("/procurement/{job_id}/confirm")
+def confirm_procurement(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    result = orchestrator.confirm_procurement(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No procurement offer awaiting confirmation with this id")
+    return result
+
+@app.get("/procurement/{job_id}")
+def get_procurement_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    job = procurement_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Procurement job not found")
+    job["_id"] = str(job["_id"])
+    return job
+
+@app.get("/admin/procurement/stats")
+async def get_procurement_stats():
+    return procurement_pool.stats()
+
+@app.get("/admin/tracing/stats")
+async def get_tracing_stats():
+    return tracing.stats()
+
+@app.get("/admin/llm/parse-stats")
+async def get_llm_parse_stats():
+    return structured.stats()
+
+@app.get("/admin/sessions/stats")
+async def get_session_stats():
+    return conversation_sessions.stats()
+
+@app.get("/admin/archive/stats")
+def get_archive_stats():
+    """Hot vs archived size per collection (the working set), union-read latency and the last pass."""
+    return clean_data({"orders": orders_archive.stats(), "traces": traces_archive.stats()})
+
+@app.post("/admin/archive/run")
+def run_archive():
+    results = archive_worker.run()
+    response_cache.invalidate("orders", "traces")
+    return clean_data(results)
+
+@app.get("/admin/cache/stats")
+async def get_cache_stats():
+    return response_cache.stats()
 
 @app.get("/admin/traces")
-async def get_traces(patient_id: Optional[str] = None, limit: int = 10):
-    query = {}
-    if patient_id:
-        query = {"patient_id": patient_id}
-    traces = list(traces_col.find(query).sort("timestamp", -1).limit(limit))
-    for t in traces:
-        t["_id"] = str(t["_id"])
-    return traces
-
-@app.get("/admin/low-stock")
-async def get_low_stock(threshold: int = 5):
-    items = list(inventory_col.find({"stock": {"$lt": threshold}}))
+def get_traces(patient_id: Optional[str] = None, limit: int = 10):
+    def load():
+        query = {}
+        if patient_id:
+            query = {"patient_id": patient_id}
+        traces = traces_archive.find(query, [("timestamp", -1)], limit)
+        for t in traces:
+            t["_id"] = str(t["_id"])
+        return traces
+    return response_cache.get_or_compute("traces", {"patient_id": patient_id, "limit": limit}, ["traces"], load)
+
+def load_low_stock(threshold: int):
+    if threshold <= low_stock_view.max_threshold:
+        return low_stock_view.items(threshold)
+    items = list(inventory_col.find({"stock": {"$lt": threshold}}, LOW_STOCK_PROJECTION))
     for i in items:
         i["_id"] = str(i["_id"])
     return items
 
+@app.get("/admin/low-stock")
+def get_low_stock(threshold: int = 5):
+    return response_cache.get_or_compute("low-stock", {"threshold": threshold}, ["inventory"], lambda: load_low_stock(threshold))
+
+@app.get("/admin/low-stock/stream")
+async def stream_low_stock(request: Request, threshold: int = 5):
+    """
+    SSE feed: a snapshot first, then one event per stock change crossing the view.
+    Changes made by this process arrive immediately through the in-process feed. Writers in other
+    processes (seed_stock.py, other workers) only update the shared low_stock_view collection, so
+    every LOW_STOCK_RESYNC_SECONDS the stream re-reads it and sends the difference.
+    """
+    changes = low_stock_view.subscribe()
+
+    async def event_stream():
+        try:
+            items = await run_in_threadpool(load_low_stock, threshold)
+            known = {i["_id"]: i["stock"] for i in items}
+            yield f"event: snapshot\ndata: {json.dumps(items, default=str)}\n\n"
+            last_sent = last_resync = time.monotonic()
+            while not await request.is_disconnected():
+                try:
+                    change = changes.get_nowait()
+                except queue.Empty:
+                    now = time.monotonic()
+                    if now - last_resync >= LOW_STOCK_RESYNC_SECONDS:
+                        last_resync = now
+                        change = {"op": "resync"}
+                    elif now - last_sent >= 15:
+                        last_sent = now
+                        yield ": keepalive\n\n"
+                        continue
+                    else:
+                        await asyncio.sleep(LOW_STOCK_POLL_SECONDS)
+                        continue
+                last_sent = time.monotonic()
+                if change["op"] in ("reset", "resync"):
+                    items = await run_in_threadpool(load_low_stock, threshold)
+                    current = {i["_id"]: i for i in items}
+                    if change["op"] == "reset":
+                        yield f"event: snapshot\ndata: {json.dumps(items, default=str)}\n\n"
+                    else:
+                        for _id in known.keys() - current.keys():
+                            yield f"event: remove\ndata: {json.dumps({'_id': _id}, default=str)}\n\n"
+                        for _id, item in current.items():
+                            if known.get(_id) != item["stock"]:
+                                yield f"event: upsert\ndata: {json.dumps(item, default=str)}\n\n"
+                    known = {_id: i["stock"] for _id, i in current.items()}
+                    continue
+                item = change["item"]
+                op = change["op"] if change["op"] == "remove" or item["stock"] < threshold else "remove"
+                if op == "remove":
+                    known.pop(item["_id"], None)
+                else:
+                    known[item["_id"]] = item["stock"]
+                yield f"event: {op}\ndata: {json.dumps(item, default=str)}\n\n"
+        finally:
+            low_stock_view.unsubscribe(changes)
+
+    # An async generator: an open dashboard holds no threadpool thread between events
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/admin/refills")
-async def get_refills(patient_id: str):
+def get_refills(patient_id: str, refresh: bool = False):
+    # Serve the analysis stored by the post-commit stage; only re-run the LLM on request or first visit
+    if not refresh:
+        stored = orchestrator.get_stored_refill_alerts(patient_id)
+        if stored is not None:
+            return stored.get("alerts", [])
     session_id = str(ObjectId())
-    alerts = orchestrator.refill.run(session_id, patient_id)
-    return alerts
+    return orchestrator.run_refill_analysis(session_id, patient_id)
+
+def analytics_range(start: Optional[str], end: Optional[str], default_days: int = 365):
+    end_at = parse_purchase_date(end) if end else datetime.datetime.utcnow()
+    start_at = parse_purchase_date(start) if start else (end_at - datetime.timedelta(days=default_days) if end_at else None)
+    if not start_at or not end_at:
+        raise HTTPException(status_code=400, detail="start/end must be dates, e.g. 2025-01-31")
+    return start_at, end_at
+
+@app.get("/admin/analytics/revenue")
+def get_revenue_report(period: str = "month", start: Optional[str] = None, end: Optional[str] = None, limit: int = 10, fresh: bool = False):
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIODS)}")
+    start_at, end_at = analytics_range(start, end)
+    params = {"period": period, "start": start, "end": end, "limit": limit, "fresh": fresh}
+    return response_cache.get_or_compute("analytics/revenue", params, ["orders"],
+                                         lambda: sales_analytics.revenue(start_at, end_at, period, limit, use_rollup=not fresh))
+
+@app.get("/admin/analytics/top-movers")
+def get_top_movers(days: int = 30, limit: int = 10, fresh: bool = False):
+    return response_cache.get_or_compute("analytics/top-movers", {"days": days, "limit": limit, "fresh": fresh}, ["orders"],
+                                         lambda: sales_analytics.top_movers(days, limit, use_rollup=not fresh))
+
+@app.get("/admin/analytics/demographics")
+def get_demographics_report(start: Optional[str] = None, end: Optional[str] = None):
+    start_at, end_at = analytics_range(start, end)
+    return response_cache.get_or_compute("analytics/demographics", {"start": start, "end": end}, ["orders"],
+                                         lambda: sales_analytics.demographics(start_at, end_at))
+
+@app.get("/admin/analytics/velocity")
+def get_sales_velocity(days: int = 30, limit: int = 100, fresh: bool = False):
+    return response_cache.get_or_compute("analytics/velocity", {"days": days, "limit": limit, "fresh": fresh}, ["orders"],
+                                         lambda: sales_analytics.velocity(days, limit, use_rollup=not fresh))
+
+@app.post("/admin/analytics/rollups/refresh")
+def refresh_analytics_rollups(full: bool = False):
+    rows = sales_analytics.refresh_rollups(None if full else ANALYTICS_ROLLUP_DAYS)
+    response_cache.invalidate("orders")
+    return {"rollup_rows": rows, "refreshed_at": sales_analytics.rollup_refreshed_at}
+
+@app.get("/admin/restock-plan")
+def get_restock_plan(only_reorder: bool = True, limit: int = 200):
+    return restock_planner.plan(only_reorder, limit)
+
+@app.post("/admin/restock-plan/run")
+def run_restock_plan(method: str = RESTOCK_METHOD, history_days: int = Query(RESTOCK_HISTORY_DAYS, ge=1)):
+    if method not in RESTOCK_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(RESTOCK_METHODS)}")
+    return restock_planner.run(method, history_days)
+
+@app.get("/patients/{patient_id}/timeline")
+def get_patient_timeline(patient_id: str):
+    return medication_timeline.for_patient(patient_id)
+
+# Exact code lookups for barcode scanners: in-process index, no name matching and no LLM
+def product_by_code(kind: str, code: str):
+    item = catalog.by_code(kind, code)
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"No product with {kind} '{code}'")
+    return clean_data(item.to_dict())
+
+@app.get("/products/pzn/{pzn}")
+def get_product_by_pzn(pzn: str):
+    return product_by_code("pzn", pzn)
+
+@app.get("/products/id/{product_id}")
+def get_product_by_id(product_id: str):
+    return product_by_code("product_id", product_id)
+
+@app.post("/products/lookup")
+def lookup_products(request: ProductLookupRequest):
+    """Bulk PZN / product-id resolution; unknown codes map to null and are listed in "missing"."""
+    if len(request.pzns) + len(request.product_ids) > PRODUCT_LOOKUP_MAX_CODES:
+        raise HTTPException(status_code=413, detail=f"At most {PRODUCT_LOOKUP_MAX_CODES} codes per request")
+    result, missing, resolved = {}, [], 0
+    for kind, codes in (("pzn", request.pzns), ("product_id", request.product_ids)):
+        found = catalog.lookup_codes(kind, codes)
+        result[kind] = {str(code): clean_data(item.to_dict()) if item else None for code, item in found.items()}
+        missing += [{"type": kind, "code": str(code)} for code, item in found.items() if item is None]
+        resolved += sum(item is not None for item in found.values())
+    return {**result, "found": resolved, "missing": missing}
+
+@app.get("/catalog/changes")
+def get_catalog_changes(since: int = 0, limit: int = CATALOG_SYNC_PAGE):
+    """Delta sync for offline copies of the catalog: products changed after version `since`."""
+    if since < 0 or limit < 1:
+        raise HTTPException(status_code=400, detail="since must be >= 0 and limit >= 1")
+    return catalog.changes(since, min(limit, CATALOG_SYNC_PAGE))
 
 @app.get("/admin/database-snapshot")
-async def get_database_snapshot():
-    # Return limited raw snapshot of orders and inventory
-    ords = list(orders_col.find().sort("purchase_date", -1).limit(50))
-    inv = list(inventory_col.find().limit(100))
-    
-    for o in ords: o["_id"] = str(o["_id"])
-    for i in inv: i["_id"] = str(i["_id"])
-        
-    return {"orders": ords, "inventory": inv}
+def get_database_snapshot(include_inventory: bool = True):
+    """include_inventory=false for clients that keep the catalog via /catalog/changes."""
+    def load():
+        # Return limited raw snapshot of orders and inventory
+        ords = orders_archive.find({}, [("purchased_at", -1), ("purchase_date", -1)], 50)
+        inv = list(inventory_col.find().limit(100)) if include_inventory else []
+
+        for o in ords: o["_id"] = str(o["_id"])
+        for i in inv:
+            i["_id"] = str(i["_id"])
+            if VERSION_FIELD in i:
+                i[VERSION_FIELD] = version_of(i[VERSION_FIELD])
+
+        return {"orders": ords, "inventory": inv}
+    return response_cache.get_or_compute("database-snapshot", {"include_inventory": include_inventory}, ["orders", "inventory"], load)
 
 @app.get("/health/db")
-async def health_db():
+def health_db():
     try:
-        if client is None:
-             return {"status": "error", "reason": "MongoClient not initialized (check MONGO_URL ENV)"}
         client.admin.command('ping')
         return {"status": "connected", "database": DB_NAME}
     except Exception as e:
         return {"status": "error", "reason": str(e)}
 
+@app.get("/health/ready")
+def health_ready():
+    """Readiness probe: the DB check deferred from startup."""
+    status = health_db()
+    if status["status"] != "connected":
+        return JSONResponse(status_code=503, content=status)
+    return {"status": "ready", "database": DB_NAME}
+
 @app.get("/health/email")
 async def health_email():
     smtp_server = os.getenv("SMTP_SERVER")
@@ -203,53 +582,87 @@ def get_orders(patient_id: Optional[str] = None):
     query = {}
     if patient_id:
         query = {"patient.id": patient_id}
-    data = list(orders_col.find(query).sort("purchase_date", -1))
+    data = orders_archive.find(query, [("purchased_at", -1), ("purchase_date", -1)])
     for item in data:
         item["_id"] = str(item["_id"])
     return data
 
 
 @app.post("/orders")
-def add_order(order: Order):
-    orders_col.insert_one(order.dict())
-    return {"message": "Order added successfully"}
+def add_order(order: Order, idempotency_key: Optional[str] = Header(None)):
+    def insert():
+        doc = order.dict()
+        doc["purchased_at"] = parse_purchase_date(doc["purchase_date"])
+        orders_col.insert_one(doc)
+        medication_timeline.record_order(doc)
+        response_cache.invalidate("orders")
+        return {"message": "Order added successfully", "order_id": str(doc["_id"])}
+    return run_idempotent("orders", idempotency_key, order.dict(), insert)
+
+
+@app.post("/orders/batch")
+def add_batch_order(request: BatchOrderRequest):
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items in batch")
+    session_id = str(ObjectId())
+    result = orchestrator.process_batch_order(session_id, request.patient_id, [i.dict() for i in request.items], request.prescription_data)
+    return clean_data(result)
+
+
+def refresh_timeline(order: Optional[Dict]):
+    """Replays the patient's orders for this order's product after it was edited or deleted."""
+    patient_id = ((order or {}).get("patient") or {}).get("id")
+    if patient_id is None:
+        return
+    medication_timeline.recompute(patient_id, order.get("product") or {}, orders_archive.find({"patient.id": patient_id}))
 
 
 @app.delete("/orders/{id}")
 def delete_order(id: str):
-    orders_col.delete_one({"_id": ObjectId(id)})
+    # Archived orders are deleted from their partition
+    deleted = orders_archive.delete({"_id": ObjectId(id)})
+    refresh_timeline(deleted)
+    # The rollup's background refresh only revisits the trailing days
+    sales_analytics.refresh_days([(deleted or {}).get("purchased_at")])
+    response_cache.invalidate("orders")
     return {"message": "Order deleted successfully"}
 
 
 @app.put("/orders/{id}")
 def update_order(id: str, updated_data: Order):
-    orders_col.update_one(
-        {"_id": ObjectId(id)},
-        {"$set": updated_data.dict()}
-    )
+    doc = updated_data.dict()
+    doc["purchased_at"] = parse_purchase_date(doc["purchase_date"])
+    # An edited archived order returns to the hot collection; the next archive pass files it again
+    previous = orders_archive.update({"_id": ObjectId(id)}, doc)
+    # The edit may change quantity, date or product: recompute the old and the new timeline entry
+    refresh_timeline(previous)
+    if previous is None or product_key(previous.get("product") or {}) != product_key(doc["product"]) or (previous.get("patient") or {}).get("id") != doc["patient"]["id"]:
+        refresh_timeline(doc)
+    sales_analytics.refresh_days([(previous or {}).get("purchased_at"), doc["purchased_at"]])
+    response_cache.invalidate("orders")
     return {"message": "Order updated successfully"}
 
 # Serve Static Files (Frontend)
 # Ensure the path is correct relative to where k.py is run (usually from root)
 frontend_path = os.path.join(os.path.dirname(__file__), "..", "frontend", "dist")
+API_PREFIXES = ("auth", "chat", "admin", "orders", "health", "procurement", "patients", "products", "catalog")
 
 if os.path.exists(frontend_path):
-    app.mount("/assets", StaticFiles(directory=os.path.join(frontend_path, "assets")), name="assets")
+    static_bundle = StaticBundle(frontend_path)
 
     @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
-        # 1. Check if it's an API route (should have been handled, but for safety)
-        if full_path.startswith("auth") or full_path.startswith("chat") or full_path.startswith("admin") or full_path.startswith("orders") or full_path.startswith("health"):
-             raise HTTPException(status_code=404)
-        
-        # 2. Check if the file exists in the frontend dist directory
-        static_file_path = os.path.join(frontend_path, full_path)
-        if os.path.isfile(static_file_path):
-            return FileResponse(static_file_path)
-             
+    async def serve_frontend(full_path: str, request: Request):
+        # 1. Known build file (manifest lookup, no filesystem check per request)
+        entry = static_bundle.get(full_path)
+        if entry:
+            return static_bundle.response(request, entry)
+
+        # 2. Unknown API route (should have been handled, but for safety)
+        if full_path.startswith(API_PREFIXES) or full_path.startswith("assets/"):
+            raise HTTPException(status_code=404)
+
         # 3. Fallback to index.html for SPA routing
-        index_path = os.path.join(frontend_path, "index.html")
-        return FileResponse(index_path)
+        return static_bundle.response(request, static_bundle.get("index.html"))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,188 @@
+"""
+Record/replay layer for the Groq client used by the agents.
+
+    LLM_MODE=live      talk to Groq (default)
+    LLM_MODE=record    talk to Groq and append every prompt/response to LLM_FIXTURES
+    LLM_MODE=replay    serve responses from LLM_FIXTURES, no network or API key needed
+
+Replay options:
+    LLM_REPLAY_LATENCY=recorded|zero   sleep for the recorded Groq latency, or not at all
+    LLM_REPLAY_STRICT=1                (default) only replay a recording of the same prompt, up to
+                                       the ids and dates in it; unrecorded prompts raise ReplayMissError
+    LLM_REPLAY_STRICT=0                also answer an unrecorded prompt with a recording of the same
+                                       template (another prompt's answer: smoke runs only)
+
+Records marked "synthetic" (the committed fixtures/ set) were written by hand, not
+captured from Groq: they carry no latency_ms or usage, so they replay with zero latency.
+    LLM_INJECT_LATENCY_MS=300          extra delay per call in any mode, to model a slow provider
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Callable, Dict, Any, List
+
+LLM_MODE = os.getenv("LLM_MODE", "live").lower()
+LLM_FIXTURES = os.getenv("LLM_FIXTURES", os.path.join(os.path.dirname(__file__), "fixtures", "groq_replay.jsonl"))
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "recorded").lower()
+LLM_REPLAY_STRICT = os.getenv("LLM_REPLAY_STRICT", "1") == "1"
+LLM_INJECT_LATENCY_MS = float(os.getenv("LLM_INJECT_LATENCY_MS", 0))
+
+
+# Masked by loose_key(): ObjectIds and ISO dates/timestamps, which change from run to run
+VOLATILE = re.compile(r"\b[0-9a-f]{24}\b|\d{4}-\d{2}-\d{2}(?:[T ][\d:.]+)?")
+# Masked by template_key(): quoted user input such as the medicine being ordered
+QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+def request_key(kwargs: Dict[str, Any]) -> str:
+    payload = {
+        "model": kwargs.get("model"),
+        "messages": kwargs.get("messages"),
+        "response_format": kwargs.get("response_format"),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def loose_key(kwargs: Dict[str, Any]) -> str:
+    """request_key() with today's date and fresh ids masked out of the messages."""
+    messages = [{**m, "content": VOLATILE.sub("#", str(m.get("content")))} for m in kwargs.get("messages") or []]
+    return request_key({**kwargs, "messages": messages})
+
+
+def template_key(kwargs: Dict[str, Any]) -> str:
+    """Model plus the first line of the prompt, which names the agent's template."""
+    content = str(((kwargs.get("messages") or [{}])[-1]).get("content") or "").strip()
+    return f"{kwargs.get('model')}|{QUOTED.sub('#', content.splitlines()[0]) if content else ''}"
+
+
+def to_completion(record: Dict[str, Any]):
+    """Minimal stand-in for a Groq ChatCompletion: what the agents actually read."""
+    usage = record.get("usage") or {}
+    return SimpleNamespace(
+        model=record.get("model"),
+        choices=[SimpleNamespace(index=0, finish_reason="stop", message=SimpleNamespace(role="assistant", content=record["content"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+        ),
+    )
+
+
+class _Completions:
+    def __init__(self, owner: "ReplayableGroq"):
+        self.owner = owner
+
+    def create(self, **kwargs):
+        return self.owner.create(**kwargs)
+
+
+class ReplayableGroq:
+    """Drop-in for groq.Groq exposing chat.completions.create."""
+
+    def __init__(self, factory: Callable[[], Any], mode: str = LLM_MODE, fixtures_path: str = LLM_FIXTURES,
+                 replay_latency: str = LLM_REPLAY_LATENCY, strict: bool = LLM_REPLAY_STRICT,
+                 inject_latency_ms: float = LLM_INJECT_LATENCY_MS):
+        self.factory = factory
+        self.mode = mode
+        self.fixtures_path = fixtures_path
+        self.replay_latency = replay_latency
+        self.strict = strict
+        self.inject_latency_ms = inject_latency_ms
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self._client = None
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_loose: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_template: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        if mode == "replay":
+            self._load()
+
+    @property
+    def client(self):
+        # The real SDK client is only built when something actually goes to Groq
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.factory()
+        return self._client
+
+    def _load(self):
+        if not os.path.exists(self.fixtures_path):
+            raise FileNotFoundError(f"LLM_MODE=replay but no fixtures at {self.fixtures_path}; record some with LLM_MODE=record first")
+        with open(self.fixtures_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._by_key.setdefault(record["key"], []).append(record)
+                self._by_loose.setdefault(loose_key(record), []).append(record)
+                self._by_template.setdefault(template_key(record), []).append(record)
+        print(f"🎞️ [LLM REPLAY] Loaded {sum(len(v) for v in self._by_key.values())} recorded completions from {self.fixtures_path}")
+
+    def _next(self, bucket: str, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Repeated prompts cycle through their recordings in order
+        with self._lock:
+            i = self._cursor.get(bucket, 0)
+            self._cursor[bucket] = i + 1
+        return records[i % len(records)]
+
+    def _replay(self, kwargs: Dict[str, Any]):
+        key = request_key(kwargs)
+        loose, template = loose_key(kwargs), template_key(kwargs)
+        if key in self._by_key:
+            record = self._next(key, self._by_key[key])
+        elif loose in self._by_loose:
+            # Prompts embed today's date and fresh ids; the same prompt otherwise replays its own recording
+            record = self._next(f"loose:{loose}", self._by_loose[loose])
+        elif not self.strict and template in self._by_template:
+            # Picked by the prompt's hash, not a shared cursor, so concurrent runs replay the same answers
+            records = self._by_template[template]
+            record = records[int(key, 16) % len(records)]
+        else:
+            raise ReplayMissError(f"No recorded completion for model={kwargs.get('model')} key={key[:12]}")
+        if self.replay_latency == "recorded":
+            time.sleep(record.get("latency_ms", 0) / 1000)
+        return to_completion(record)
+
+    def _record(self, kwargs: Dict[str, Any]):
+        start = time.perf_counter()
+        completion = self.client.chat.completions.create(**kwargs)
+        latency_ms = (time.perf_counter() - start) * 1000
+        usage = getattr(completion, "usage", None)
+        record = {
+            "key": request_key(kwargs),
+            "model": kwargs.get("model"),
+            "messages": kwargs.get("messages"),
+            "response_format": kwargs.get("response_format"),
+            "content": completion.choices[0].message.content,
+            "latency_ms": round(latency_ms, 1),
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+                "total_tokens": getattr(usage, "total_tokens", None),
+            },
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(self.fixtures_path) or ".", exist_ok=True)
+            with open(self.fixtures_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        return completion
+
+    def create(self, **kwargs):
+        if self.inject_latency_ms:
+            time.sleep(self.inject_latency_ms / 1000)
+        if self.mode == "replay":
+            return self._replay(kwargs)
+        if self.mode == "record":
+            return self._record(kwargs)
+        return self.client.chat.completions.create(**kwargs)
@@ -0,0 +1,113 @@
+import os
+import queue
+import datetime
+import threading
+from typing import List, Optional, Dict, Any
+from pymongo import ASCENDING, ReplaceOne, DeleteOne
+
+# Items with stock below this are kept in the view; /admin/low-stock thresholds above it fall back to a scan
+LOW_STOCK_MAX_THRESHOLD = int(os.getenv("LOW_STOCK_MAX_THRESHOLD", 20))
+
+# Compact projection shared by the view, the endpoint and the change feed
+PROJECTION = {"product id": 1, "product name": 1, "pzn": 1, "stock": 1}
+
+
+def compact(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "_id": str(doc["_id"]),
+        "product id": doc.get("product id"),
+        "product name": doc.get("product name"),
+        "pzn": doc.get("pzn"),
+        "stock": doc.get("stock", 0),
+    }
+
+
+class LowStockView:
+    """
+    Materialized low-stock collection maintained by the stock writers, plus an
+    in-process change feed. Each write touches only the changed items.
+    """
+
+    def __init__(self, view_col, max_threshold: int = LOW_STOCK_MAX_THRESHOLD):
+        self.view_col = view_col
+        self.max_threshold = max_threshold
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        if not self._indexes_ready:
+            self.view_col.create_index([("stock", ASCENDING)])
+            self._indexes_ready = True
+
+    def record(self, doc: Optional[Dict[str, Any]]):
+        """Apply one inventory document (needs _id and stock) after its stock changed."""
+        if not doc:
+            return
+        self.record_many([doc])
+
+    def record_many(self, docs: List[Dict[str, Any]]):
+        now = datetime.datetime.utcnow()
+        ops, changes, above = [], [], {}
+        for doc in docs:
+            item = compact(doc)
+            if item["stock"] is not None and item["stock"] < self.max_threshold:
+                ops.append(ReplaceOne({"_id": doc["_id"]}, {**item, "_id": doc["_id"], "updated_at": now}, upsert=True))
+                changes.append({"op": "upsert", "item": item})
+            else:
+                above[doc["_id"]] = item
+
+        if above:
+            # Only items that were actually in the view produce a "remove" event
+            present = [d["_id"] for d in self.view_col.find({"_id": {"$in": list(above)}}, {"_id": 1})]
+            ops.extend(DeleteOne({"_id": _id}) for _id in present)
+            changes.extend({"op": "remove", "item": above[_id]} for _id in present)
+
+        if ops:
+            self.view_col.bulk_write(ops, ordered=False)
+        for change in changes:
+            self._publish(change)
+
+    def rebuild(self, inventory_col) -> int:
+        """Full recompute from the inventory. Only needed on first start or after out-of-band edits."""
+        self.ensure_indexes()
+        docs = list(inventory_col.find({"stock": {"$lt": self.max_threshold}}, PROJECTION))
+        now = datetime.datetime.utcnow()
+        self.view_col.delete_many({})
+        if docs:
+            self.view_col.insert_many([{**compact(d), "_id": d["_id"], "updated_at": now} for d in docs])
+        self._publish({"op": "reset"})
+        return len(docs)
+
+    def is_empty(self) -> bool:
+        return self.view_col.find_one({}, {"_id": 1}) is None
+
+    def items(self, threshold: int) -> List[Dict[str, Any]]:
+        items = list(self.view_col.find({"stock": {"$lt": threshold}}, {"updated_at": 0}).sort("stock", ASCENDING))
+        for i in items:
+            i["_id"] = str(i["_id"])
+        return items
+
+    # Change feed
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def _publish(self, change: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(change)
+            except queue.Full:
+                # Slow client: tell it to refetch the snapshot instead of blocking writers
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait({"op": "reset"})
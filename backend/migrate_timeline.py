@@ -0,0 +1,52 @@
+"""
+Backfill for the medication timeline:
+  1. stamps a typed `purchased_at` on every connected_orders document
+  2. rebuilds medication_timeline from the full order history, archived partitions included
+
+Safe to re-run; both steps overwrite what they computed before.
+"""
+from pymongo import MongoClient, UpdateOne
+import os
+import time
+from dotenv import load_dotenv
+from timeline import MedicationTimeline, parse_purchase_date
+from archive import Archive, ARCHIVE_ORDERS_DAYS
+
+load_dotenv()
+
+client = MongoClient(os.getenv('MONGO_URL'))
+db = client[os.getenv('DB_NAME', 'hackathon_db')]
+orders_col = db['connected_orders']
+timeline = MedicationTimeline(db['medication_timeline'])
+orders_archive = Archive(db, orders_col, "purchased_at", ARCHIVE_ORDERS_DAYS, [])
+
+BATCH_SIZE = 1000
+ORDER_FIELDS = {"patient.id": 1, "product.product_id": 1, "product.name": 1, "purchase_date": 1, "quantity": 1, "dosage_frequency": 1}
+
+
+def migrate():
+    started = time.time()
+    hot, ops, typed = 0, [], 0
+    # Archived orders were filed by purchased_at, so only the hot collection can lack it
+    for order in orders_col.find({}, ORDER_FIELDS):
+        hot += 1
+        purchased_at = parse_purchase_date(order.get("purchase_date"))
+        if purchased_at:
+            ops.append(UpdateOne({"_id": order["_id"]}, {"$set": {"purchased_at": purchased_at}}))
+            typed += 1
+        if len(ops) >= BATCH_SIZE:
+            orders_col.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        orders_col.bulk_write(ops, ordered=False)
+    print(f"Typed purchase dates on {typed}/{hot} orders.")
+
+    orders_col.create_index([("patient.id", 1), ("purchased_at", -1)])
+    timeline.ensure_indexes()
+    orders = orders_archive.find({}, projection=ORDER_FIELDS)
+    written = timeline.rebuild(orders)
+    print(f"Rebuilt {written} timeline entries in {time.time() - started:.2f}s.")
+
+
+if __name__ == "__main__":
+    migrate()
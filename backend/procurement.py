@@ -0,0 +1,332 @@
+import os
+import time
+import uuid
+import datetime
+import threading
+from typing import Callable, List, Optional, Dict, Any
+from bson import ObjectId
+from pymongo import ReturnDocument, ASCENDING
+
+# Configuration
+PARTNER_WEBHOOK_URLS = [u.strip() for u in os.getenv("PARTNER_WEBHOOK_URLS", "").split(",") if u.strip()]
+PROCUREMENT_WORKERS = int(os.getenv("PROCUREMENT_WORKERS", 2))
+PROCUREMENT_MAX_ATTEMPTS = int(os.getenv("PROCUREMENT_MAX_ATTEMPTS", 5))
+PROCUREMENT_HTTP_RETRIES = int(os.getenv("PROCUREMENT_HTTP_RETRIES", 2))
+PROCUREMENT_HTTP_TIMEOUT = float(os.getenv("PROCUREMENT_HTTP_TIMEOUT", 5))
+PROCUREMENT_LEASE_SECONDS = int(os.getenv("PROCUREMENT_LEASE_SECONDS", 60))
+PROCUREMENT_POLL_SECONDS = float(os.getenv("PROCUREMENT_POLL_SECONDS", 0.5))
+# How often a running pool returns jobs with an expired lease (a dead worker anywhere) to the queue
+PROCUREMENT_REQUEUE_SECONDS = float(os.getenv("PROCUREMENT_REQUEUE_SECONDS", PROCUREMENT_LEASE_SECONDS))
+
+# Job lifecycle: awaiting_confirmation -> queued -> in_progress -> ordered | failed
+AWAITING_CONFIRMATION = "awaiting_confirmation"
+QUEUED = "queued"
+IN_PROGRESS = "in_progress"
+ORDERED = "ordered"
+FAILED = "failed"
+
+
+class LeaseLostError(RuntimeError):
+    """The jobs being dispatched were requeued to another worker (lease expired)."""
+
+
+def sku_key(order_data: Dict[str, Any], product: Optional[Dict[str, Any]] = None) -> str:
+    """Jobs with the same key are merged into one purchase order."""
+    if product and product.get("product id") is not None:
+        return f"pid:{product.get('product id')}"
+    name = (order_data.get("medicine_name") or "").strip().lower()
+    return f"name:{' '.join(name.split())}"
+
+
+class ProcurementQueue:
+    """Durable procurement job queue stored in a Mongo collection."""
+
+    def __init__(self, jobs_col):
+        self.jobs_col = jobs_col
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        self.jobs_col.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING), ("created_at", ASCENDING)])
+        self.jobs_col.create_index([("status", ASCENDING), ("sku", ASCENDING)])
+        self.jobs_col.create_index("batch_id")
+        self._indexes_ready = True
+
+    def _new_job(self, session_id: str, patient_id: str, order_data: Dict[str, Any], product: Optional[Dict[str, Any]], status: str) -> Dict[str, Any]:
+        now = datetime.datetime.utcnow()
+        job = {
+            "session_id": session_id,
+            "patient_id": patient_id,
+            "sku": sku_key(order_data, product),
+            "medicine_name": (product or {}).get("product name") or order_data.get("medicine_name"),
+            "product_id": (product or {}).get("product id"),
+            "quantity": order_data.get("quantity") or 1,
+            "order": order_data,
+            "status": status,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+            "next_attempt_at": now,
+        }
+        if status == QUEUED:
+            job["queued_at"] = now
+        self.jobs_col.insert_one(job)
+        return job
+
+    def propose(self, session_id: str, patient_id: str, order_data: Dict[str, Any], product: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Record a procurement offer that waits for the patient's confirmation."""
+        return self._new_job(session_id, patient_id, order_data, product, AWAITING_CONFIRMATION)
+
+    def enqueue(self, session_id: str, patient_id: str, order_data: Dict[str, Any], product: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self._new_job(session_id, patient_id, order_data, product, QUEUED)
+
+    def confirm(self, job_id: str) -> Optional[Dict[str, Any]]:
+        now = datetime.datetime.utcnow()
+        return self.jobs_col.find_one_and_update(
+            {"_id": ObjectId(job_id), "status": AWAITING_CONFIRMATION},
+            {"$set": {"status": QUEUED, "queued_at": now, "next_attempt_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def set_quantity(self, job_id: str, quantity: int) -> Optional[Dict[str, Any]]:
+        """Changes an offer the patient hasn't confirmed yet."""
+        return self.jobs_col.find_one_and_update(
+            {"_id": ObjectId(job_id), "status": AWAITING_CONFIRMATION},
+            {"$set": {"quantity": quantity, "order.quantity": quantity, "updated_at": datetime.datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs_col.find_one({"_id": ObjectId(job_id)})
+
+    def claim_batch(self, worker_id: str) -> List[Dict[str, Any]]:
+        """Atomically claim the oldest due job plus every other queued job for the same SKU."""
+        now = datetime.datetime.utcnow()
+        batch_id = uuid.uuid4().hex
+        claim = {"$set": {"status": IN_PROGRESS, "batch_id": batch_id, "worker": worker_id, "claimed_at": now, "updated_at": now}}
+
+        first = self.jobs_col.find_one_and_update(
+            {"status": QUEUED, "next_attempt_at": {"$lte": now}},
+            claim,
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not first:
+            return []
+
+        self.jobs_col.update_many({"status": QUEUED, "sku": first["sku"], "next_attempt_at": {"$lte": now}}, claim)
+        return list(self.jobs_col.find({"batch_id": batch_id}).sort("created_at", ASCENDING))
+
+    def renew_lease(self, batch_id: str) -> int:
+        """Pushes the claim of a batch that is still being dispatched; 0 once it was requeued."""
+        now = datetime.datetime.utcnow()
+        return self.jobs_col.update_many(
+            {"batch_id": batch_id, "status": IN_PROGRESS},
+            {"$set": {"claimed_at": now, "updated_at": now}}
+        ).modified_count
+
+    def mark_ordered(self, jobs: List[Dict[str, Any]], purchase_order: Dict[str, Any], partner: str) -> int:
+        # Only the batch's current owner writes: a requeued job belongs to its new worker
+        now = datetime.datetime.utcnow()
+        return self.jobs_col.update_many(
+            {"batch_id": purchase_order["po_id"], "status": IN_PROGRESS},
+            {"$set": {"status": ORDERED, "partner": partner, "purchase_order_id": purchase_order["po_id"], "ordered_at": now, "updated_at": now}}
+        ).modified_count
+
+    def mark_failed(self, jobs: List[Dict[str, Any]], error: str):
+        """Requeue with exponential backoff, or give up after PROCUREMENT_MAX_ATTEMPTS."""
+        now = datetime.datetime.utcnow()
+        for job in jobs:
+            attempts = job.get("attempts", 0) + 1
+            update = {"attempts": attempts, "last_error": error, "updated_at": now}
+            if attempts >= PROCUREMENT_MAX_ATTEMPTS:
+                update["status"] = FAILED
+            else:
+                update["status"] = QUEUED
+                update["next_attempt_at"] = now + datetime.timedelta(seconds=min(2 ** attempts, 300))
+            self.jobs_col.update_one({"_id": job["_id"], "batch_id": job["batch_id"], "status": IN_PROGRESS},
+                                     {"$set": update, "$unset": {"batch_id": "", "worker": ""}})
+
+    def requeue_stale(self) -> int:
+        """Return jobs whose worker died mid-dispatch back to the queue."""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=PROCUREMENT_LEASE_SECONDS)
+        res = self.jobs_col.update_many(
+            {"status": IN_PROGRESS, "claimed_at": {"$lt": cutoff}},
+            {"$set": {"status": QUEUED, "updated_at": datetime.datetime.utcnow()}, "$unset": {"batch_id": "", "worker": ""}}
+        )
+        return res.modified_count
+
+
+def build_purchase_order(jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    first = jobs[0]
+    return {
+        "po_id": first["batch_id"],
+        "sku": first["sku"],
+        "product_id": first.get("product_id"),
+        "medicine_name": first.get("medicine_name"),
+        "quantity": sum(int(j.get("quantity") or 1) for j in jobs),
+        "lines": [
+            {"job_id": str(j["_id"]), "patient_id": j.get("patient_id"), "quantity": j.get("quantity") or 1}
+            for j in jobs
+        ],
+        "created_at": datetime.datetime.utcnow().isoformat()
+    }
+
+
+class PartnerDispatcher:
+    """Sends purchase orders to partner-shop webhooks over one pooled HTTP client."""
+
+    def __init__(self, webhook_urls: Optional[List[str]] = None, timeout: float = PROCUREMENT_HTTP_TIMEOUT, retries: int = PROCUREMENT_HTTP_RETRIES, pool_size: int = 10):
+        # httpx is imported here rather than at module load to keep backend import time down
+        import httpx
+        self.httpx = httpx
+        self.webhook_urls = PARTNER_WEBHOOK_URLS if webhook_urls is None else webhook_urls
+        self.retries = retries
+        self.http = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 2.0)),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def send(self, purchase_order: Dict[str, Any], renew_lease: Optional[Callable[[], bool]] = None) -> str:
+        """
+        Returns the partner URL that accepted the order. Raises if every partner failed.
+        renew_lease runs before every HTTP attempt, so the claim outlives any number of
+        partners and retries; LeaseLostError stops sending once the jobs were requeued.
+        """
+        # Mock Mode Fallback
+        if not self.webhook_urls:
+            print(f"📦 [MOCK PROCUREMENT] PO {purchase_order['po_id']}: {purchase_order['quantity']} x {purchase_order['medicine_name']} (PARTNER_WEBHOOK_URLS not set)")
+            return "mock"
+
+        last_error = None
+        for url in self.webhook_urls:
+            for attempt in range(self.retries + 1):
+                if renew_lease is not None and not renew_lease():
+                    raise LeaseLostError(f"PO {purchase_order['po_id']} was requeued before reaching {url}")
+                try:
+                    res = self.http.post(url, json=purchase_order)
+                    if res.status_code < 500:
+                        res.raise_for_status()
+                        return url
+                    last_error = f"{url} returned {res.status_code}"
+                except self.httpx.HTTPStatusError as e:
+                    # 4xx: this partner rejected the order, retrying won't help
+                    last_error = str(e)
+                    break
+                except self.httpx.HTTPError as e:
+                    last_error = f"{url}: {e}"
+                if attempt < self.retries:
+                    time.sleep(0.2 * (2 ** attempt))
+        raise RuntimeError(last_error or "No partner accepted the purchase order")
+
+    def close(self):
+        self.http.close()
+
+
+class ProcurementWorkerPool:
+    def __init__(self, queue: ProcurementQueue, dispatcher: Optional[PartnerDispatcher] = None, workers: int = PROCUREMENT_WORKERS):
+        self.queue = queue
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._requeued_at = 0.0
+        self._jobs_done = 0
+        self._batches_done = 0
+        self._failures = 0
+        self._latencies: List[float] = []
+
+    def start(self):
+        if self._threads:
+            return
+        if self.dispatcher is None:
+            self.dispatcher = PartnerDispatcher()
+        self.queue.ensure_indexes()
+        self.requeue_stale()
+        self._stop.clear()
+        self._started_at = time.time()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, args=(f"procurement-{i}",), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+            self.dispatcher = None
+
+    def requeue_stale(self, every: float = 0) -> int:
+        """queue.requeue_stale(), at most once per `every` seconds across this pool's workers."""
+        with self._lock:
+            if time.monotonic() - self._requeued_at < every:
+                return 0
+            self._requeued_at = time.monotonic()
+        requeued = self.queue.requeue_stale()
+        if requeued:
+            print(f"📦 Requeued {requeued} stale procurement jobs")
+        return requeued
+
+    def _loop(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                # Leases expire while the pool runs too (a worker in another process died mid-dispatch)
+                self.requeue_stale(PROCUREMENT_REQUEUE_SECONDS)
+                if not self.run_once(worker_id):
+                    self._stop.wait(PROCUREMENT_POLL_SECONDS)
+            except Exception as e:
+                print(f"Procurement Worker Error ({worker_id}): {e}")
+                self._stop.wait(PROCUREMENT_POLL_SECONDS)
+
+    def run_once(self, worker_id: str = "inline") -> bool:
+        jobs = self.queue.claim_batch(worker_id)
+        if not jobs:
+            return False
+
+        purchase_order = build_purchase_order(jobs)
+        try:
+            partner = self.dispatcher.send(purchase_order, lambda: self.queue.renew_lease(purchase_order["po_id"]) > 0)
+        except LeaseLostError as e:
+            # Another worker owns these jobs now; it sends and records the order
+            print(f"📦 [PROCUREMENT] {e}")
+            return True
+        except Exception as e:
+            self.queue.mark_failed(jobs, str(e))
+            with self._lock:
+                self._failures += len(jobs)
+            print(f"📦 [PROCUREMENT FAILED] PO {purchase_order['po_id']}: {e}")
+            return True
+
+        if self.queue.mark_ordered(jobs, purchase_order, partner) < len(jobs):
+            print(f"⚠️ [PROCUREMENT] PO {purchase_order['po_id']} sent, but some of its jobs were requeued meanwhile")
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            self._jobs_done += len(jobs)
+            self._batches_done += 1
+            for j in jobs:
+                start = j.get("queued_at") or j.get("created_at")
+                if start:
+                    self._latencies.append((now - start).total_seconds())
+            self._latencies = self._latencies[-1000:]
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.time() - self._started_at if self._started_at else 0
+            lat = sorted(self._latencies)
+            pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 1) if lat else None
+            return {
+                "workers": len(self._threads),
+                "jobs_ordered": self._jobs_done,
+                "purchase_orders": self._batches_done,
+                "jobs_failed_attempts": self._failures,
+                "jobs_per_second": round(self._jobs_done / elapsed, 2) if elapsed else 0,
+                "latency_ms_p50": pct(0.5),
+                "latency_ms_p95": pct(0.95),
+            }
@@ -0,0 +1,190 @@
+"""
+Prompt builders for the agents: per-agent field whitelists, compact encodings and
+hard per-call input budgets (estimated tokens).
+
+Only the variable parts (user text, prescription text, product list, order facts)
+are trimmed to fit a budget; the instructions and the answer format are never cut.
+"""
+import os
+import re
+import json
+import math
+import datetime
+from typing import List, Optional, Dict, Any
+from timeline import parse_purchase_date
+
+# Llama tokenizers average ~4 chars/token on English and ~3.3 on German product text; stay conservative
+CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", 3.3))
+
+BUDGETS = {
+    "ordering": int(os.getenv("PROMPT_BUDGET_ORDERING", 500)),
+    "symptom": int(os.getenv("PROMPT_BUDGET_SYMPTOM", 900)),
+    "prescription": int(os.getenv("PROMPT_BUDGET_PRESCRIPTION", 500)),
+    "refill": int(os.getenv("PROMPT_BUDGET_REFILL", 250)),
+}
+# Upper bound on completion tokens per call (passed as max_tokens)
+MAX_OUTPUT_TOKENS = {
+    "ordering": int(os.getenv("PROMPT_MAX_OUTPUT_ORDERING", 300)),
+    "symptom": int(os.getenv("PROMPT_MAX_OUTPUT_SYMPTOM", 40)),
+    "prescription": int(os.getenv("PROMPT_MAX_OUTPUT_PRESCRIPTION", 150)),
+    "refill": int(os.getenv("PROMPT_MAX_OUTPUT_REFILL", 120)),
+}
+# Ordering answers grow with the number of medicines (~35 tokens per item); max_tokens is sized per request
+ORDERING_OUTPUT_PER_ITEM = int(os.getenv("PROMPT_ORDERING_OUTPUT_PER_ITEM", 45))
+ORDERING_OUTPUT_CAP = int(os.getenv("PROMPT_ORDERING_OUTPUT_CAP", 2000))
+
+SYMPTOM_PRODUCTS = int(os.getenv("PROMPT_SYMPTOM_PRODUCTS", 20))
+SYMPTOM_DESCRIPTION_TOKENS = int(os.getenv("PROMPT_SYMPTOM_DESCRIPTION_TOKENS", 48))
+
+# Whitelists: what each agent's prompt may contain
+REFILL_TIMELINE_FIELDS = {
+    "product_name": "medicine",
+    "dosage_frequency": "dosage",
+    "last_purchase": "last_purchase",
+    "last_quantity": "last_qty",
+    "daily_dose": "units_per_day",
+    "runs_out_on": "runs_out_on",
+    "order_count": "orders",
+}
+SYMPTOM_DESCRIPTION_FIELDS = ("descriptions", "medication description", "indications")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def clip(text: Optional[str], max_tokens: int) -> str:
+    """Cut free text to roughly max_tokens, on a word boundary when possible."""
+    text = " ".join(str(text or "").split())
+    limit = max(0, int(max_tokens * CHARS_PER_TOKEN))
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut) + "…"
+
+
+def compact(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _date(value: Any) -> Optional[str]:
+    parsed = parse_purchase_date(value)
+    return parsed.date().isoformat() if parsed else None
+
+
+def _fit(template: str, budget: int, **variables: str) -> str:
+    """Fill the template, trimming the variables evenly until the estimate is within budget."""
+    fixed = estimate_tokens(template.format(**{k: "" for k in variables}))
+    room = max(0, budget - fixed)
+    uses = {k: max(1, template.count("{" + k + "}")) for k in variables}
+    sizes = {k: estimate_tokens(v) * uses[k] for k, v in variables.items()}
+    if sum(sizes.values()) > room:
+        share = room // max(1, len(variables))
+        # Variables smaller than their share give the rest to the others
+        small = {k: s for k, s in sizes.items() if s <= share}
+        spare = room - sum(small.values())
+        large = [k for k in variables if k not in small]
+        variables = {k: v if k in small else clip(v, spare // max(1, len(large)) // uses[k]) for k, v in variables.items()}
+    return template.format(**variables)
+
+
+# Ordering
+ORDERING_TEMPLATE = """You are a Pharmacy Ordering AI. The user may write in English, Hindi, Telugu or a mix.
+Extract the order from the text. Translate/normalize medicine names to English.
+Text: "{text}"
+Return ONLY JSON, one "items" entry per medicine requested, null for unknown fields:
+{{"items":[{{"medicine_name":str,"quantity":int,"dosage_frequency":str,"symptom":str}}],"detected_language":str}}"""
+
+
+def ordering_prompt(text: str) -> str:
+    return _fit(ORDERING_TEMPLATE, BUDGETS["ordering"], text=" ".join(str(text).split()))
+
+
+# Separators between medicines in a typed list ("a, b and c", one per line, Hindi "aur", German "und")
+ITEM_SEPARATORS = re.compile(r"[,;\n+]|\b(?:and|aur|und)\b", re.IGNORECASE)
+
+
+def ordering_items(text: str) -> int:
+    """Upper-bound guess of how many medicines a message lists."""
+    return len([part for part in ITEM_SEPARATORS.split(str(text)) if part.strip()]) or 1
+
+
+def ordering_max_tokens(text: str) -> int:
+    """max_tokens for the ordering call: the fixed cap, raised for long lists so the JSON isn't cut off."""
+    sized = 30 + ORDERING_OUTPUT_PER_ITEM * ordering_items(text)
+    return min(ORDERING_OUTPUT_CAP, max(MAX_OUTPUT_TOKENS["ordering"], sized))
+
+
+# Safety: symptom match
+SYMPTOM_TEMPLATE = """As an Expert Pharmacist, match the user's symptom to the best medicine in our inventory.
+Symptom: "{symptom}"
+Products (name: description):
+{products}
+Return ONLY the exact product name of the best match, or None if nothing fits."""
+
+
+def symptom_product_line(product: Dict[str, Any]) -> str:
+    description = next((product.get(f) for f in SYMPTOM_DESCRIPTION_FIELDS if product.get(f)), "")
+    line = f"- {product.get('product name')}"
+    if description:
+        line += f": {clip(description, SYMPTOM_DESCRIPTION_TOKENS)}"
+    return line
+
+
+def symptom_prompt(symptom: str, products: List[Dict[str, Any]]) -> str:
+    symptom = clip(symptom, 60)
+    room = BUDGETS["symptom"] - estimate_tokens(SYMPTOM_TEMPLATE.format(symptom=symptom, products=""))
+    lines = []
+    for product in products[:SYMPTOM_PRODUCTS]:
+        line = symptom_product_line(product)
+        cost = estimate_tokens(line) + 1
+        if cost > room:
+            break
+        lines.append(line)
+        room -= cost
+    return SYMPTOM_TEMPLATE.format(symptom=symptom, products="\n".join(lines))
+
+
+# Safety: prescription validation
+PRESCRIPTION_TEMPLATE = """You are a strict Pharmacy AI. The user is ordering '{medicine}'.
+Prescription text: "{prescription}"
+Does it validly cover '{medicine}' or a direct medical synonym/indication for it?
+Return ONLY JSON: {{"is_valid":bool,"explanation":str}}"""
+
+
+def prescription_prompt(medicine_name: str, prescription_data: str) -> str:
+    return _fit(PRESCRIPTION_TEMPLATE, BUDGETS["prescription"], medicine=clip(medicine_name, 40), prescription=" ".join(str(prescription_data).split()))
+
+
+# Refill
+REFILL_TEMPLATE = """Decide if this pharmacy customer needs a refill soon.
+Medication: {facts}
+Today: {today}
+Return ONLY JSON: {{"needs_refill":bool,"days_until_refill":int,"reason":str}}"""
+
+
+def refill_facts(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Whitelisted facts from a medication_timeline entry, or from a raw order before the backfill."""
+    if "product_key" in entry:
+        facts = {}
+        for field, label in REFILL_TIMELINE_FIELDS.items():
+            value = entry.get(field)
+            if value is None:
+                continue
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.date().isoformat() if isinstance(value, datetime.datetime) else value.isoformat()
+            elif isinstance(value, float):
+                value = round(value, 2)
+            facts[label] = value
+        return facts
+    facts = {
+        "medicine": (entry.get("product") or {}).get("name") or entry.get("product_name"),
+        "dosage": entry.get("dosage_frequency"),
+        "last_purchase": _date(entry.get("purchased_at") or entry.get("purchase_date")),
+        "last_qty": entry.get("quantity"),
+    }
+    return {k: v for k, v in facts.items() if v is not None}
+
+
+def refill_prompt(entry: Dict[str, Any], today: datetime.date) -> str:
+    return _fit(REFILL_TEMPLATE, BUDGETS["refill"], facts=compact(refill_facts(entry)), today=today.isoformat())
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+from typing import Callable, Iterable, Optional, Dict, Any, Tuple
+
+# How long a cached admin response may be served without a write invalidating it.
+# Writers in other processes (seed_stock.py, a second worker) can't invalidate us, so this bounds staleness.
+ADMIN_CACHE_TTL_SECONDS = float(os.getenv("ADMIN_CACHE_TTL_SECONDS", 30))
+ADMIN_CACHE_MAX_ENTRIES = int(os.getenv("ADMIN_CACHE_MAX_ENTRIES", 256))
+
+
+class ResponseCache:
+    """
+    In-process cache for read-heavy endpoint responses. Entries are keyed on
+    endpoint + query params and tagged with the collections they read
+    ("orders", "inventory", "traces"); writers call invalidate(tag).
+    """
+
+    def __init__(self, ttl_seconds: float = ADMIN_CACHE_TTL_SECONDS, max_entries: int = ADMIN_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple, Dict[str, Any]] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def key(endpoint: str, params: Optional[Dict[str, Any]] = None) -> Tuple:
+        return (endpoint,) + tuple(sorted((k, v) for k, v in (params or {}).items() if v is not None))
+
+    def get_or_compute(self, endpoint: str, params: Optional[Dict[str, Any]], tags: Iterable[str], compute: Callable[[], Any]) -> Any:
+        if self.ttl_seconds <= 0:
+            return compute()
+        key = self.key(endpoint, params)
+        tags = tuple(tags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > now:
+                self._hits += 1
+                return entry["value"]
+            self._misses += 1
+            generations = {tag: self._generations.get(tag, 0) for tag in tags}
+
+        value = compute()
+
+        with self._lock:
+            # A write that landed while we were reading makes this result stale; don't keep it
+            if all(self._generations.get(tag, 0) == gen for tag, gen in generations.items()):
+                if len(self._entries) >= self.max_entries and key not in self._entries:
+                    oldest = min(self._entries, key=lambda k: self._entries[k]["expires_at"])
+                    del self._entries[oldest]
+                self._entries[key] = {"value": value, "tags": tags, "expires_at": now + self.ttl_seconds}
+        return value
+
+    def invalidate(self, *tags: str):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [k for k, entry in self._entries.items() if any(tag in entry["tags"] for tag in tags)]
+            for k in stale:
+                del self._entries[k]
+            self._invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "invalidated_entries": self._invalidations,
+            }
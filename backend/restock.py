@@ -0,0 +1,195 @@
+"""
+Demand-forecasting restock engine.
+
+Pulls per-SKU daily unit sales from connected_orders with one aggregation, forecasts
+daily demand for every SKU at once with NumPy (simple moving average or simple
+exponential smoothing), and writes reorder points and suggested order quantities
+to the `restock_plan` collection.
+
+    python restock.py                     # forecast + write restock_plan
+    python restock.py --method sma --dry-run
+"""
+import os
+import time
+import uuid
+import datetime
+import argparse
+from typing import List, Dict, Any
+from pymongo import ReplaceOne, ASCENDING, DESCENDING
+
+RESTOCK_HISTORY_DAYS = int(os.getenv("RESTOCK_HISTORY_DAYS", 90))
+RESTOCK_METHOD = os.getenv("RESTOCK_METHOD", "ses").lower()
+RESTOCK_SMA_WINDOW = int(os.getenv("RESTOCK_SMA_WINDOW", 28))
+RESTOCK_ALPHA = float(os.getenv("RESTOCK_ALPHA", 0.3))
+# Days from placing a partner order until it is on the shelf, and days one order should cover after that
+RESTOCK_LEAD_TIME_DAYS = float(os.getenv("RESTOCK_LEAD_TIME_DAYS", 7))
+RESTOCK_REVIEW_DAYS = float(os.getenv("RESTOCK_REVIEW_DAYS", 14))
+# Safety-stock z-score (1.65 ~ 95% of lead times without a stock-out)
+RESTOCK_SERVICE_Z = float(os.getenv("RESTOCK_SERVICE_Z", 1.65))
+BATCH_SIZE = int(os.getenv("RESTOCK_BATCH_SIZE", 1000))
+
+METHODS = ("sma", "ses")
+
+
+def forecast_demand(sales, method: str = RESTOCK_METHOD, window: int = RESTOCK_SMA_WINDOW, alpha: float = RESTOCK_ALPHA):
+    """
+    sales: (skus, days) array of daily units, oldest day first.
+    Returns (daily demand forecast, daily demand std dev), one value per SKU.
+    """
+    import numpy as np
+
+    window = max(1, min(window, sales.shape[1]))
+    recent = sales[:, -window:]
+    sigma = recent.std(axis=1)
+    if method == "sma":
+        return recent.mean(axis=1), sigma
+
+    # SES level after the last day, as one matrix-vector product:
+    # level = (1-a)^(T-1) * x0 + sum_t a * (1-a)^(T-1-t) * x_t
+    days = sales.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=float)
+    weights[0] = (1 - alpha) ** (days - 1)
+    return sales @ weights, sigma
+
+
+def plan_quantities(demand, sigma, stock, lead_time: float = RESTOCK_LEAD_TIME_DAYS, review: float = RESTOCK_REVIEW_DAYS, z: float = RESTOCK_SERVICE_Z):
+    """Reorder point, order-up-to level and suggested quantity per SKU (all arrays)."""
+    import numpy as np
+
+    reorder_point = demand * lead_time + z * sigma * np.sqrt(lead_time)
+    order_up_to = demand * (lead_time + review) + z * sigma * np.sqrt(lead_time + review)
+    needs_reorder = (demand > 0) & (stock <= reorder_point)
+    suggested = np.where(needs_reorder, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_cover = np.where(demand > 0, stock / demand, np.inf)
+    return reorder_point, order_up_to, needs_reorder, suggested, days_of_cover
+
+
+class RestockPlanner:
+    def __init__(self, orders_col, inventory_col, plan_col, archive=None):
+        self.orders_col = orders_col
+        self.archive = archive
+        self.inventory_col = inventory_col
+        self.plan_col = plan_col
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        if not self._indexes_ready:
+            self.plan_col.create_index([("needs_reorder", DESCENDING), ("no_demand", ASCENDING), ("days_of_cover", ASCENDING)])
+            self.plan_col.create_index("run_id")
+            self._indexes_ready = True
+
+    def daily_sales(self, start: datetime.datetime, days: int) -> List[Dict[str, Any]]:
+        """Units sold per (product_id, day index since start), summed in Mongo."""
+        match = [{"$match": {"purchased_at": {"$gte": start}}}]
+        # Only reaches the archive when the history is longer than the orders horizon
+        union = self.archive.union_stages(match, start) if self.archive is not None else []
+        pipeline = match + union + [
+            {"$group": {
+                "_id": {
+                    "product_id": "$product.product_id",
+                    "day": {"$dateDiff": {"startDate": start, "endDate": "$purchased_at", "unit": "day"}},
+                },
+                "units": {"$sum": {"$ifNull": ["$quantity", 0]}},
+            }},
+            {"$match": {"_id.day": {"$gte": 0, "$lt": days}}},
+        ]
+        return list(self.orders_col.aggregate(pipeline, allowDiskUse=True))
+
+    def run(self, method: str = RESTOCK_METHOD, history_days: int = RESTOCK_HISTORY_DAYS, dry_run: bool = False) -> Dict[str, Any]:
+        import numpy as np
+
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {', '.join(METHODS)}")
+        if history_days < 1:
+            raise ValueError("history_days must be at least 1")
+        started = time.perf_counter()
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = today - datetime.timedelta(days=history_days - 1)
+
+        products = list(self.inventory_col.find({"product id": {"$ne": None}}, {"product id": 1, "product name": 1, "stock": 1}))
+        row_of = {p["product id"]: i for i, p in enumerate(products)}
+        stock = np.array([p.get("stock") or 0 for p in products], dtype=float)
+
+        sales = np.zeros((len(products), history_days))
+        rows = self.daily_sales(start, history_days)
+        hits = [(row_of[r["_id"]["product_id"]], r["_id"]["day"], r["units"]) for r in rows if r["_id"].get("product_id") in row_of]
+        if hits:
+            sku_idx, day_idx, units = (np.array(col) for col in zip(*hits))
+            np.add.at(sales, (sku_idx, day_idx.astype(int)), units.astype(float))
+        loaded = time.perf_counter()
+
+        demand, sigma = forecast_demand(sales, method)
+        reorder_point, order_up_to, needs_reorder, suggested, days_of_cover = plan_quantities(demand, sigma, stock)
+        computed = time.perf_counter()
+
+        run_id = uuid.uuid4().hex
+        now = datetime.datetime.utcnow()
+        summary = {
+            "run_id": run_id,
+            "method": method,
+            "history_days": history_days,
+            "skus": len(products),
+            "to_reorder": int(needs_reorder.sum()),
+            "load_ms": round((loaded - started) * 1000, 1),
+            "forecast_ms": round((computed - loaded) * 1000, 1),
+        }
+        if dry_run:
+            return summary
+
+        self.ensure_indexes()
+        ops = []
+        for i, product in enumerate(products):
+            ops.append(ReplaceOne({"_id": product["_id"]}, {
+                "product_id": product["product id"],
+                "product_name": product.get("product name"),
+                "stock": float(stock[i]),
+                "daily_demand": round(float(demand[i]), 3),
+                "demand_std": round(float(sigma[i]), 3),
+                "units_sold": int(sales[i].sum()),
+                "reorder_point": round(float(reorder_point[i]), 1),
+                "order_up_to": round(float(order_up_to[i]), 1),
+                "needs_reorder": bool(needs_reorder[i]),
+                "suggested_quantity": int(suggested[i]),
+                "days_of_cover": None if np.isinf(days_of_cover[i]) else round(float(days_of_cover[i]), 1),
+                # Mongo sorts null first; SKUs without demand (no days_of_cover) go after the rest
+                "no_demand": bool(np.isinf(days_of_cover[i])),
+                "method": method,
+                "run_id": run_id,
+                "generated_at": now,
+            }, upsert=True))
+            if len(ops) >= BATCH_SIZE:
+                self.plan_col.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.plan_col.bulk_write(ops, ordered=False)
+        # SKUs removed from the inventory since the last run
+        self.plan_col.delete_many({"run_id": {"$ne": run_id}})
+        summary["write_ms"] = round((time.perf_counter() - computed) * 1000, 1)
+        return summary
+
+    def plan(self, only_reorder: bool = True, limit: int = 200) -> List[Dict[str, Any]]:
+        query = {"needs_reorder": True} if only_reorder else {}
+        items = list(self.plan_col.find(query).sort([("needs_reorder", DESCENDING), ("no_demand", ASCENDING), ("days_of_cover", ASCENDING)]).limit(limit))
+        for i in items:
+            i["_id"] = str(i["_id"])
+        return items
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Forecast demand and write restock_plan")
+    parser.add_argument("--method", choices=METHODS, default=RESTOCK_METHOD)
+    parser.add_argument("--history-days", type=int, default=RESTOCK_HISTORY_DAYS)
+    parser.add_argument("--dry-run", action="store_true", help="Forecast only; don't write restock_plan")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URL"))
+    db = client[os.getenv("DB_NAME", "hackathon_db")]
+    from archive import Archive, ARCHIVE_ORDERS_DAYS
+    orders_col = db["connected_orders"]
+    planner = RestockPlanner(orders_col, db["dataset2"], db["restock_plan"], Archive(db, orders_col, "purchased_at", ARCHIVE_ORDERS_DAYS, []))
+    print(planner.run(args.method, args.history_days, args.dry_run))
@@ -1,31 +1,134 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 import os
+import time
 import random
+import argparse
 from dotenv import load_dotenv
+from low_stock import LowStockView, PROJECTION as LOW_STOCK_PROJECTION
+from catalog import stamped
 
 load_dotenv()
 
 client = MongoClient(os.getenv('MONGO_URL'))
-db = client[os.getenv('DB_NAME')]
+db = client[os.getenv('DB_NAME', 'hackathon_db')]
 col = db['dataset2']
+low_stock_view = LowStockView(db['low_stock_view'])
 
-def seed_missing_fields():
+BATCH_SIZE = int(os.getenv('SEED_BATCH_SIZE', 1000))
+
+
+def flush(ops, changed):
+    """One bulk_write round-trip per batch instead of one update_one per SKU."""
+    if ops:
+        col.bulk_write(ops, ordered=False)
+    if changed:
+        low_stock_view.record_many(changed)
+
+
+def report(label, count, started):
+    elapsed = time.time() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"{label} {count} documents in {elapsed:.2f}s ({rate:.0f} docs/s).")
+
+
+def seed_missing_fields(batch_size: int = BATCH_SIZE):
     print("Seeding stock and prescription_required fields...")
-    all_docs = list(col.find())
+    started = time.time()
+    # Only pull documents that need seeding, and only the fields we look at
+    cursor = col.find(
+        {'$or': [{'stock': {'$exists': False}}, {'prescription_required': {'$exists': False}}]},
+        {**LOW_STOCK_PROJECTION, 'prescription_required': 1},
+        batch_size=batch_size
+    )
     count = 0
-    for doc in all_docs:
+    ops, changed = [], []
+    for doc in cursor:
         update_data = {}
         if 'stock' not in doc:
             update_data['stock'] = random.randint(10, 50)
         if 'prescription_required' not in doc:
             # Most items don't need prescription (80% No, 20% Yes)
             update_data['prescription_required'] = "Yes" if random.random() < 0.2 else "No"
-        
+
         if update_data:
-            col.update_one({'_id': doc['_id']}, {'$set': update_data})
+            ops.append(UpdateOne({'_id': doc['_id']}, stamped({'$set': update_data})))
             count += 1
-    
-    print(f"Updated {count} documents.")
+            if 'stock' in update_data:
+                changed.append({**doc, **update_data})
+        if len(ops) >= batch_size:
+            flush(ops, changed)
+            ops, changed = [], []
+
+    flush(ops, changed)
+    report("Updated", count, started)
+
+
+def _key_variants(value):
+    # Spreadsheet codes arrive as numbers or strings; dataset2 may store either
+    variants = [value]
+    text = str(value).strip()
+    if text.endswith('.0'):
+        text = text[:-2]
+    variants.append(text)
+    if text.isdigit():
+        variants.append(int(text))
+    return list(dict.fromkeys(variants))
+
+
+def load_delivery_note(path: str, key: str):
+    """Reads a CSV/XLSX delivery note into {code: quantity}, summing repeated lines."""
+    import pandas as pd
+    # Read as text so PZNs keep their leading zeros
+    if path.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path, dtype=str)
+    else:
+        df = pd.read_csv(path, dtype=str)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+
+    qty_col = next((c for c in ('quantity', 'qty', 'delivered', 'stock') if c in df.columns), None)
+    if key not in df.columns or qty_col is None:
+        raise ValueError(f"Delivery note needs '{key}' and a quantity column, got {df.columns.tolist()}")
+
+    df[key] = df[key].str.strip()
+    df[qty_col] = pd.to_numeric(df[qty_col], errors='coerce')
+    df = df.dropna(subset=[key, qty_col])
+    return df.groupby(key)[qty_col].sum().to_dict()
+
+
+def restock_from_delivery_note(path: str, key: str = 'pzn', batch_size: int = BATCH_SIZE):
+    print(f"Restocking from delivery note {path} (matching on '{key}')...")
+    started = time.time()
+    deliveries = load_delivery_note(path, key)
+    items = list(deliveries.items())
+    matched = 0
+
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        ops = [UpdateOne({key: {'$in': _key_variants(code)}}, stamped({'$inc': {'stock': int(qty)}})) for code, qty in batch]
+        res = col.bulk_write(ops, ordered=False)
+        matched += res.matched_count
+
+        # Feed the new stock levels of this batch into the low-stock view
+        codes = [v for code, _ in batch for v in _key_variants(code)]
+        low_stock_view.record_many(list(col.find({key: {'$in': codes}}, LOW_STOCK_PROJECTION)))
+
+    report("Restocked", matched, started)
+    if matched < len(items):
+        print(f"⚠️ {len(items) - matched} delivery lines did not match any product by '{key}'.")
+
 
 if __name__ == "__main__":
-    seed_missing_fields()
+    parser = argparse.ArgumentParser(description="Bulk inventory updates for dataset2")
+    # Top-level only (goes before the mode): a subparser copy would overwrite it with its default
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Writes per bulk_write (before the mode, e.g. --batch-size 500 restock note.csv)")
+    sub = parser.add_subparsers(dest="mode")
+    sub.add_parser("seed", help="Fill in missing stock / prescription_required fields (default)")
+    restock = sub.add_parser("restock", help="Add delivered quantities from a CSV/XLSX delivery note")
+    restock.add_argument("path")
+    restock.add_argument("--key", default="pzn", choices=["pzn", "product id"], help="Column used to match products")
+    args = parser.parse_args()
+
+    if args.mode == "restock":
+        restock_from_delivery_note(args.path, args.key, args.batch_size)
+    else:
+        seed_missing_fields(args.batch_size)
@@ -0,0 +1,163 @@
+"""
+Conversation state carried between /chat-order turns.
+
+Each turn keeps its own session_id (traces, procurement jobs); turns of one
+conversation share a conversation_id, under which the extracted order, the resolved
+products and the safety verdicts are kept. Follow-ups ("yes, proceed", "make it 3
+instead", a prescription upload) are recognised without the LLM and applied to that
+state; anything else is a new intent and runs the full pipeline.
+
+    SESSION_TTL_SECONDS=1800   idle conversations are forgotten after this
+    SESSION_PERSIST=1          also write sessions to Mongo (survives restarts, shared by workers)
+"""
+import os
+import re
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from pymongo import ASCENDING
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 1800))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+SESSION_PERSIST = os.getenv("SESSION_PERSIST", "0") == "1"
+
+# What the conversation is waiting for
+AWAITING_PROCUREMENT = "awaiting_procurement"
+AWAITING_PRESCRIPTION = "awaiting_prescription"
+PLACED = "placed"
+CLOSED = "closed"
+
+YES_WORDS = r"yes|yeah|yep|sure|ok|okay|proceed|go ahead|confirm|please do|do it|haan|ha|ji|avunu|sare"
+NO_WORDS = r"no|nope|nah|cancel|don'?t|do not|stop|never ?mind|nahi|mat|vaddu|ledu"
+POLITE_WORDS = r"please|pls|thanks|thank you|ji|sir|madam|then|for now"
+# Only a message that is nothing but a yes/no (plus punctuation or politeness) answers the offer;
+# "ok, and also add 2 crocin" or "no, I want Dolo 650 instead" carry a new request and run the pipeline
+def _only(words: str) -> "re.Pattern":
+    return re.compile(rf"^[\s,.!]*(?:{words})(?:[\s,.!]+(?:{words}|{POLITE_WORDS}))*[\s,.!]*$", re.IGNORECASE)
+YES = _only(YES_WORDS)
+NO = _only(NO_WORDS)
+# Words that may accompany a prescription upload for the held item ("here is my prescription for it")
+PRESCRIPTION_WORDS = {"here", "is", "it", "its", "it's", "my", "the", "a", "for", "of", "prescription", "rx", "uploaded", "upload", "attached",
+                      "attaching", "sending", "sent", "i", "have", "now", "this", "that", "please", "ok", "okay", "yes", "doctor's", "doctors", "note"}
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+                "ek": 1, "teen": 3, "char": 4, "paanch": 5}
+# Words that may surround the number in a quantity change ("make it 3 instead", "change to 2 packs please")
+QUANTITY_WORDS = {"make", "it", "change", "to", "actually", "instead", "please", "only", "just", "pack", "packs", "box", "boxes",
+                  "unit", "units", "strip", "strips", "bottle", "bottles", "the", "quantity", "order", "of", "x", "let's", "lets",
+                  "can", "you", "i", "want", "need", "sorry", "no", "update", "set", "kar", "do", "karo", "chahiye"}
+
+
+def parse_quantity(text: str) -> Optional[int]:
+    """The new quantity if the text is only a quantity change, else None."""
+    words = re.findall(r"[a-z']+|\d+", text.lower())
+    numbers = [w for w in words if w.isdigit() or w in NUMBER_WORDS]
+    if len(numbers) != 1 or any(w not in QUANTITY_WORDS for w in words if w != numbers[0]):
+        return None
+    n = int(numbers[0]) if numbers[0].isdigit() else NUMBER_WORDS[numbers[0]]
+    return n if 0 < n <= 100 else None
+
+
+def is_about_held_items(text: str, session: Dict[str, Any]) -> bool:
+    """True when the text says nothing beyond handing over a prescription for the held item(s)."""
+    held = set()
+    for item, verdict in zip(session["order"].get("items", []), session.get("verdicts", [])):
+        if verdict.get("prescription_needed"):
+            for name in (item.get("medicine_name"), (verdict.get("product") or {}).get("product name")):
+                held.update(re.findall(r"[a-z']+|\d+", (name or "").lower()))
+    words = re.findall(r"[a-z']+|\d+", text.lower())
+    return all(w in PRESCRIPTION_WORDS or w in held for w in words)
+
+
+def classify_follow_up(text: str, session: Optional[Dict[str, Any]], prescription_data: Optional[str] = None) -> Optional[Tuple[str, Any]]:
+    """("confirm"|"decline"|"prescription"|"quantity", arg) for a follow-up to the session's last turn, None for a new intent."""
+    if not session:
+        return None
+    stage = session.get("stage")
+    # A multi-item turn can leave both an offer and a prescription hold open
+    awaiting_prescription = any(v.get("prescription_needed") for v in session.get("verdicts", []))
+    if awaiting_prescription and prescription_data and is_about_held_items(text, session):
+        return "prescription", prescription_data
+    quantity = parse_quantity(text)
+    if quantity and stage in (PLACED, AWAITING_PROCUREMENT, AWAITING_PRESCRIPTION) and len(session["order"].get("items", [])) == 1:
+        return "quantity", quantity
+    if session.get("procurement_job_ids") and YES.match(text):
+        return "confirm", None
+    if (session.get("procurement_job_ids") or awaiting_prescription) and stage != CLOSED and NO.match(text):
+        return "decline", None
+    return None
+
+
+class ConversationStore:
+    """In-process LRU of conversation state with an idle TTL, optionally written through to Mongo."""
+
+    def __init__(self, sessions_col=None, ttl_seconds: int = SESSION_TTL_SECONDS, max_entries: int = SESSION_MAX_ENTRIES, persist: bool = SESSION_PERSIST):
+        self.sessions_col = sessions_col if persist else None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "loaded": 0, "saved": 0, "evicted": 0}
+
+    def ensure_indexes(self):
+        if self.sessions_col is not None:
+            self.sessions_col.create_index("expires_at", expireAfterSeconds=0)
+            self.sessions_col.create_index([("patient_id", ASCENDING), ("updated_at", ASCENDING)])
+
+    def get(self, conversation_id: str, patient_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(conversation_id)
+                session = entry[1]
+            else:
+                session = None
+                if entry:
+                    del self._entries[conversation_id]
+        if session is None and self.sessions_col is not None:
+            session = self.sessions_col.find_one({"_id": conversation_id, "expires_at": {"$gt": datetime.datetime.utcnow()}})
+            if session is not None:
+                self.counters["loaded"] += 1
+                self._put(conversation_id, session)
+        # A conversation id never carries one patient's state into another's request
+        if session is None or session.get("patient_id") != patient_id:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return session
+
+    def save(self, conversation_id: str, patient_id: str, **state: Any) -> Dict[str, Any]:
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            previous = self._entries.get(conversation_id)
+        session = {
+            "_id": conversation_id,
+            "patient_id": patient_id,
+            "created_at": previous[1]["created_at"] if previous else now,
+            "turns": (previous[1]["turns"] if previous else 0) + 1,
+            **state,
+            "updated_at": now,
+            "expires_at": now + datetime.timedelta(seconds=self.ttl_seconds),
+        }
+        self._put(conversation_id, session)
+        if self.sessions_col is not None:
+            try:
+                self.sessions_col.replace_one({"_id": conversation_id}, session, upsert=True)
+            except Exception as e:
+                # The in-process copy still serves this worker
+                print(f"⚠️ [SESSIONS] Could not persist {conversation_id}: {e}")
+        self.counters["saved"] += 1
+        return session
+
+    def _put(self, conversation_id: str, session: Dict[str, Any]):
+        with self._lock:
+            self._entries[conversation_id] = (time.monotonic() + self.ttl_seconds, session)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "ttl_seconds": self.ttl_seconds, "persisted": self.sessions_col is not None, **self.counters}
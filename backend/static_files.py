@@ -0,0 +1,80 @@
+import os
+import re
+import hashlib
+import mimetypes
+from typing import Optional, Dict, Any
+from starlette.requests import Request
+from starlette.responses import Response, FileResponse
+
+# Content-hashed build output never changes under the same name
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Entry points (index.html, sw.js, ...) must be revalidated so new deploys are picked up
+REVALIDATE_CACHE = "no-cache"
+DEFAULT_CACHE = "public, max-age=86400"
+
+HASHED_NAME = re.compile(r"(^assets/)|(-[A-Za-z0-9_-]{8}\.\w+$)")
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+REVALIDATED = {"index.html", "sw.js", "registerSW.js", "manifest.webmanifest"}
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+class StaticBundle:
+    """
+    In-memory manifest of the built PWA in frontend/dist, loaded once at startup.
+    Serves the .br/.gz variants written by `npm run build` (see frontend/scripts/compress.mjs)
+    when the client accepts them, with cache headers chosen per file.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith((".br", ".gz")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    digest = hashlib.md5(f.read()).hexdigest()[:16]
+
+                if rel in REVALIDATED:
+                    cache_control = REVALIDATE_CACHE
+                elif HASHED_NAME.search(rel):
+                    cache_control = IMMUTABLE_CACHE
+                else:
+                    cache_control = DEFAULT_CACHE
+
+                files[rel] = {
+                    "path": path,
+                    "etag": f'"{digest}"',
+                    "media_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                    "cache_control": cache_control,
+                    "variants": {enc: path + ext for enc, ext in ENCODINGS if os.path.isfile(path + ext)},
+                }
+        self.files = files
+        print(f"🗂️ Loaded {len(files)} static files ({sum(len(f['variants']) for f in files.values())} precompressed variants)")
+
+    def get(self, rel: str) -> Optional[Dict[str, Any]]:
+        return self.files.get(rel)
+
+    def response(self, request: Request, entry: Dict[str, Any]) -> Response:
+        accepted = request.headers.get("accept-encoding", "")
+        encoding = next((enc for enc, _ in ENCODINGS if enc in entry["variants"] and enc in accepted), None)
+        etag = entry["etag"] if encoding is None else f'{entry["etag"][:-1]}-{encoding}"'
+        headers = {"Cache-Control": entry["cache_control"], "ETag": etag}
+        if entry["variants"]:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return FileResponse(entry["variants"][encoding], media_type=entry["media_type"], headers=headers)
+        return FileResponse(entry["path"], media_type=entry["media_type"], headers=headers)
@@ -0,0 +1,200 @@
+"""
+Structured LLM output for the agents: one Pydantic model per agent response and a
+single parse path shared by all of them.
+
+    1. fast path     the raw completion validated in one pass (pydantic-core JSON parser)
+    2. local repair  markdown fences / surrounding prose stripped; fields that fail
+                     validation but have a default fall back to it (no LLM call)
+    3. re-ask        only required fields still missing/invalid are asked for again,
+                     from the small model, with the original task as context
+
+Counters per agent and model show how often each step was needed (/admin/llm/parse-stats).
+"""
+import os
+import json
+from collections import defaultdict
+from typing import ClassVar, List, Optional, Dict, Any, Type
+from pydantic import BaseModel, ValidationError, Field, field_validator, model_validator
+import prompts
+
+STRUCTURED_REPAIR_MODEL = os.getenv("STRUCTURED_REPAIR_MODEL", "llama-3.1-8b-instant")
+STRUCTURED_REPAIR_MAX_TOKENS = int(os.getenv("STRUCTURED_REPAIR_MAX_TOKENS", 150))
+# Set to 0 to never spend a second round-trip on a malformed answer
+STRUCTURED_REASK = os.getenv("STRUCTURED_REASK", "1") == "1"
+
+
+class StructuredOutputError(ValueError):
+    """The completion could not be turned into the schema, even after repair."""
+
+
+# Response models
+class OrderItem(BaseModel):
+    medicine_name: Optional[str] = None
+    quantity: int = Field(1, ge=1)
+    dosage_frequency: Optional[str] = None
+    symptom: Optional[str] = None
+
+    @field_validator("quantity", mode="before")
+    @classmethod
+    def _default_quantity(cls, value):
+        return 1 if value is None else value
+
+
+class OrderExtraction(BaseModel):
+    SHAPES: ClassVar[Dict[str, str]] = {
+        "items": '[{"medicine_name":str,"quantity":int,"dosage_frequency":str,"symptom":str}]',
+        "detected_language": "str",
+    }
+    items: List[OrderItem]
+    detected_language: Optional[str] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _flat_order(cls, data):
+        # Older prompts (and some answers) put a single medicine at the top level
+        if isinstance(data, dict) and "items" not in data and "medicine_name" in data:
+            data = {"items": [data], "detected_language": data.get("detected_language")}
+        if isinstance(data, dict) and isinstance(data.get("items"), list):
+            data = {**data, "items": [{"medicine_name": i} if isinstance(i, str) else i for i in data["items"]]}
+        return data
+
+
+class PrescriptionValidation(BaseModel):
+    SHAPES: ClassVar[Dict[str, str]] = {"is_valid": "bool", "explanation": "str"}
+    is_valid: bool
+    explanation: str = ""
+
+
+class RefillAnalysis(BaseModel):
+    SHAPES: ClassVar[Dict[str, str]] = {"needs_refill": "bool", "days_until_refill": "int", "reason": "str"}
+    needs_refill: bool
+    days_until_refill: Optional[int] = None
+    reason: str = ""
+
+
+REPAIR_TEMPLATE = """Your answer to the task below was not valid.
+Task:
+{prompt}
+Your answer: {answer}
+Problem: {problem}
+Return ONLY JSON with these fields: {shape}"""
+
+
+def strip_wrapping(content: str) -> str:
+    """The JSON object inside markdown fences or surrounding prose, if any."""
+    start, end = content.find("{"), content.rfind("}")
+    return content[start:end + 1] if 0 <= start < end else content
+
+
+def _drop(data: Any, loc: tuple) -> bool:
+    """Removes the value at an error location so the field's default applies."""
+    for part in loc[:-1]:
+        try:
+            data = data[part]
+        except (KeyError, IndexError, TypeError):
+            return False
+    try:
+        del data[loc[-1]]
+        return True
+    except (KeyError, IndexError, TypeError):
+        return False
+
+
+class StructuredOutput:
+    def __init__(self, client, repair_model: str = STRUCTURED_REPAIR_MODEL):
+        self.client = client
+        self.repair_model = repair_model
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+            "calls": 0, "fast_path": 0, "repaired_locally": 0, "defaulted_fields": 0,
+            "reasked": 0, "reask_fixed": 0, "failed": 0,
+        })
+
+    def complete(self, agent: str, schema: Type[BaseModel], model: str, prompt: str, max_tokens: int,
+                 default: Optional[BaseModel] = None) -> BaseModel:
+        """One JSON-mode completion parsed into schema; default (if given) replaces a StructuredOutputError."""
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"},
+            max_tokens=max_tokens
+        )
+        try:
+            return self.parse(agent, model, schema, completion.choices[0].message.content or "", prompt)
+        except StructuredOutputError as e:
+            if default is None:
+                raise
+            print(f"⚠️ [STRUCTURED] {agent}: {e}; using default")
+            return default
+
+    def parse(self, agent: str, model: str, schema: Type[BaseModel], content: str, prompt: str) -> BaseModel:
+        counters = self.counters[f"{agent}|{model}"]
+        counters["calls"] += 1
+        try:
+            result = schema.model_validate_json(content)
+            counters["fast_path"] += 1
+            return result
+        except ValidationError:
+            pass
+
+        try:
+            data = json.loads(strip_wrapping(content))
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return self._reask(counters, schema, {}, list(schema.model_fields), prompt, content, "not a JSON object")
+
+        missing, problems = [], []
+        for _ in range(3):
+            try:
+                result = schema.model_validate(data)
+                counters["repaired_locally"] += 1
+                return result
+            except ValidationError as e:
+                errors = e.errors()
+            dropped = False
+            # Reverse order so list indices stay valid while items are removed
+            for error in reversed(errors):
+                if error["type"] != "missing" and _drop(data, error["loc"]):
+                    counters["defaulted_fields"] += 1
+                    dropped = True
+            missing = sorted({str(error["loc"][0]) for error in errors if error["loc"] and error["type"] == "missing"})
+            # The first pass has the model's actual mistakes; later passes only see the dropped fields as missing
+            problems = problems or [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in errors]
+            if not dropped:
+                break
+        return self._reask(counters, schema, data, missing or list(schema.model_fields), prompt, content, "; ".join(problems))
+
+    def _reask(self, counters: Dict[str, int], schema: Type[BaseModel], data: Dict[str, Any], fields: List[str],
+               prompt: str, answer: str, problem: str) -> BaseModel:
+        if not STRUCTURED_REASK:
+            counters["failed"] += 1
+            raise StructuredOutputError(f"{schema.__name__}: {problem}")
+        counters["reasked"] += 1
+        shape = "{" + ",".join(f'"{f}":{schema.SHAPES.get(f, "str")}' for f in fields) + "}"
+        repair_prompt = REPAIR_TEMPLATE.format(prompt=prompt, answer=prompts.clip(answer, 150), problem=prompts.clip(problem, 60), shape=shape)
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.repair_model,
+                messages=[{"role": "user", "content": repair_prompt}],
+                response_format={"type": "json_object"},
+                max_tokens=STRUCTURED_REPAIR_MAX_TOKENS
+            )
+            fixed = json.loads(strip_wrapping(completion.choices[0].message.content or ""))
+            result = schema.model_validate({**data, **{f: fixed[f] for f in fields if isinstance(fixed, dict) and f in fixed}})
+        except (ValidationError, json.JSONDecodeError, TypeError) as e:
+            counters["failed"] += 1
+            raise StructuredOutputError(f"{schema.__name__}: {problem} (re-ask failed: {type(e).__name__})")
+        counters["reask_fixed"] += 1
+        print(f"🔧 [STRUCTURED] Re-asked {self.repair_model} for {', '.join(fields)} of {schema.__name__}")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        out = {}
+        for key, c in self.counters.items():
+            agent, model = key.split("|", 1)
+            out.setdefault(agent, {})[model] = {
+                **c,
+                "parse_failures": c["calls"] - c["fast_path"],
+                "parse_failure_rate": round((c["calls"] - c["fast_path"]) / c["calls"], 4) if c["calls"] else 0.0,
+            }
+        return out
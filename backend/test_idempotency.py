@@ -0,0 +1,73 @@
+import itertools
+from pymongo.errors import DuplicateKeyError
+from idempotency import IdempotencyStore, IN_PROGRESS
+
+
+class KeysCollection:
+    """Just enough of a pymongo collection for IdempotencyStore, with the unique (scope, key) index."""
+
+    def __init__(self):
+        self.docs = []
+        self.ids = itertools.count()
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def _matches(self, doc, query):
+        return all(doc.get(k) == v for k, v in query.items())
+
+    def insert_one(self, doc):
+        if any(d["scope"] == doc["scope"] and d["key"] == doc["key"] for d in self.docs):
+            raise DuplicateKeyError("duplicate key")
+        self.docs.append({**doc, "_id": next(self.ids)})
+
+    def find_one(self, query):
+        return next((dict(d) for d in self.docs if self._matches(d, query)), None)
+
+    def update_one(self, query, update):
+        for d in self.docs:
+            if self._matches(d, query):
+                d.update(update["$set"])
+                return
+
+    def delete_one(self, query):
+        self.docs = [d for d in self.docs if not self._matches(d, query)]
+
+
+def test_failed_compute_is_retried():
+    print("Testing that a failed request releases its Idempotency-Key...")
+    store = IdempotencyStore(KeysCollection())
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise TimeoutError("LLM timed out")
+        return {"success": True}
+
+    try:
+        store.run("chat-order", "k1", {"text": "paracetamol"}, flaky)
+        raise AssertionError("the first attempt should have raised")
+    except TimeoutError:
+        pass
+    response, replayed = store.run("chat-order", "k1", {"text": "paracetamol"}, flaky)
+    assert (response, replayed, len(calls)) == ({"success": True}, False, 2)
+    # Now completed: a third attempt replays without running
+    assert store.run("chat-order", "k1", {"text": "paracetamol"}, flaky) == ({"success": True}, True)
+    assert len(calls) == 2
+    print("✅ SUCCESS: the retry re-executed, later duplicates replay")
+
+
+def test_retryable_response_is_not_stored():
+    print("Testing that a retryable error payload is not replayed...")
+    store = IdempotencyStore(KeysCollection())
+    answers = iter([{"success": False, "retryable": True}, {"success": True}])
+    keep = lambda response: not response.get("retryable")
+
+    first, replayed = store.run("chat-order", "k2", {"text": "dolo"}, lambda: next(answers), keep)
+    assert first == {"success": False, "retryable": True} and not replayed
+    assert store.keys_col.find_one({"key": "k2"}) is None
+    second, replayed = store.run("chat-order", "k2", {"text": "dolo"}, lambda: next(answers), keep)
+    assert second == {"success": True} and not replayed
+    assert store.keys_col.find_one({"key": "k2"})["status"] != IN_PROGRESS
+    print("✅ SUCCESS: the error payload released the key")
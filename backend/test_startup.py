@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", 3000))
+FIRST_RESPONSE_BUDGET_S = float(os.getenv("STARTUP_FIRST_RESPONSE_BUDGET_S", 15))
+LAZY_MODULES = ["groq", "langsmith", "pandas", "smtplib", "httpx"]
+
+def test_import_time():
+    print("Testing backend import time (python -X importtime -c 'import k')...")
+    check = "import sys, k; print('loaded:' + ','.join(m for m in %r if m in sys.modules))" % LAZY_MODULES
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", check], cwd=HERE, capture_output=True, text=True, timeout=120)
+    assert r.returncode == 0, r.stderr[-2000:]
+
+    rows = []
+    for line in r.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, raw_name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                # Nesting is encoded as two spaces per level in front of the module name
+                depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+                rows.append((int(cumulative), raw_name.strip(), depth))
+    total_ms = next(us for us, name, depth in rows if name == "k") / 1000
+    print(f"  k imported in {total_ms:.0f}ms. Heaviest imports made by k:")
+    for us, name, _ in sorted((row for row in rows if row[2] == 1), reverse=True)[:5]:
+        print(f"  - {name}: {us / 1000:.0f}ms")
+
+    loaded = next(line for line in r.stdout.splitlines() if line.startswith("loaded:"))
+    eager = [m for m in loaded[len("loaded:"):].split(",") if m]
+    assert not eager, f"Imported at startup but should be lazy: {eager}"
+    assert total_ms < IMPORT_BUDGET_MS, f"Import took {total_ms:.0f}ms (budget {IMPORT_BUDGET_MS:.0f}ms)"
+    print("✅ SUCCESS: heavy SDKs stay unloaded until first use")
+
+def test_time_to_first_response():
+    print("Testing time-to-first-response of a fresh `python k.py`...")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "k.py"], cwd=HERE, env={**os.environ, "PORT": str(port)},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        elapsed = None
+        while time.perf_counter() - start < FIRST_RESPONSE_BUDGET_S:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/email", timeout=1) as res:
+                    if res.status == 200:
+                        elapsed = time.perf_counter() - start
+                        break
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.05)
+        assert elapsed is not None, f"No response within {FIRST_RESPONSE_BUDGET_S}s"
+        print(f"✅ SUCCESS: first response after {elapsed * 1000:.0f}ms")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
@@ -0,0 +1,253 @@
+import re
+import datetime
+from typing import List, Optional, Dict, Any
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+MS_PER_DAY = 86400000
+
+
+def parse_purchase_date(value: Any) -> Optional[datetime.datetime]:
+    """
+    connected_orders.purchase_date is a datetime for rows imported from Excel
+    (main.py / connect.py) and an ISO string for orders placed by ActionAgent.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, (int, float)):
+        # Excel serial day number
+        return EXCEL_EPOCH + datetime.timedelta(days=float(value))
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(text.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for fmt in ("%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def daily_dose(dosage_frequency: Optional[str]) -> Optional[float]:
+    """Units taken per day from free-text dosage frequency; None when it can't be told (e.g. "as needed")."""
+    if not dosage_frequency:
+        return None
+    text = str(dosage_frequency).lower()
+    if "as needed" in text or "as directed" in text or "prn" in text:
+        return None
+    hours = re.search(r"every\s+(\d+)\s*h", text)
+    if hours and int(hours.group(1)) > 0:
+        return 24 / int(hours.group(1))
+    times = re.search(r"(\d+)\s*(?:x|times?)\b", text)
+    per_day = None
+    if times:
+        per_day = float(times.group(1))
+    elif "once" in text:
+        per_day = 1.0
+    elif "twice" in text:
+        per_day = 2.0
+    elif "thrice" in text or "three times" in text:
+        per_day = 3.0
+    elif "daily" in text or "day" in text:
+        per_day = 1.0
+    if per_day is None:
+        return None
+    if "week" in text:
+        return per_day / 7
+    if "month" in text:
+        return per_day / 30
+    return per_day
+
+
+def product_key(product: Dict[str, Any]) -> str:
+    if product.get("product_id") is not None:
+        return f"pid:{product.get('product_id')}"
+    return f"name:{(product.get('name') or '').strip().lower()}"
+
+
+class MedicationTimeline:
+    """
+    One document per (patient, product) with typed dates, the running supply on
+    hand and the last refill, maintained incrementally on every order insert and
+    recomputed from the orders when one is edited or deleted.
+    """
+
+    def __init__(self, timeline_col):
+        self.timeline_col = timeline_col
+
+    def ensure_indexes(self):
+        self.timeline_col.create_index([("patient_id", ASCENDING), ("product_key", ASCENDING)], unique=True)
+        self.timeline_col.create_index([("patient_id", ASCENDING), ("last_purchase", DESCENDING)])
+
+    def _apply(self, entry: Optional[Dict[str, Any]], order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        product = order.get("product") or {}
+        patient_id = (order.get("patient") or {}).get("id")
+        purchased_at = parse_purchase_date(order.get("purchase_date")) or datetime.datetime.utcnow()
+        if patient_id is None:
+            return None
+        quantity = float(order.get("quantity") or 1)
+        dose = daily_dose(order.get("dosage_frequency"))
+
+        if not entry:
+            entry = {
+                "patient_id": patient_id,
+                "product_key": product_key(product),
+                "product_id": product.get("product_id"),
+                "product_name": product.get("name"),
+                "first_purchase": purchased_at,
+                "last_purchase": purchased_at,
+                "order_count": 0,
+                "total_quantity": 0.0,
+                "supply_on_hand": 0.0,
+            }
+
+        if purchased_at >= entry["last_purchase"]:
+            # Use up the supply between the previous refill and this one
+            rate = dose if dose is not None else entry.get("daily_dose")
+            elapsed = (purchased_at - entry["last_purchase"]).total_seconds() / 86400
+            remaining = max(0.0, entry["supply_on_hand"] - rate * elapsed) if rate else entry["supply_on_hand"]
+            entry["supply_on_hand"] = remaining + quantity
+            entry["last_purchase"] = purchased_at
+            entry["last_quantity"] = quantity
+            entry["dosage_frequency"] = order.get("dosage_frequency")
+            if dose is not None:
+                entry["daily_dose"] = dose
+        else:
+            # Late-arriving older order: it only adds to what was bought
+            entry["supply_on_hand"] += quantity
+            entry["first_purchase"] = min(entry["first_purchase"], purchased_at)
+
+        entry["order_count"] += 1
+        entry["total_quantity"] += quantity
+        entry["last_refill"] = entry["last_purchase"]
+        rate = entry.get("daily_dose")
+        entry["runs_out_on"] = entry["last_purchase"] + datetime.timedelta(days=entry["supply_on_hand"] / rate) if rate else None
+        entry["updated_at"] = datetime.datetime.utcnow()
+        return entry
+
+    def record_order(self, order: Dict[str, Any]):
+        """
+        Applies one order in a single pipeline update (the same arithmetic as _apply), so
+        concurrent orders for one patient and product can't overwrite each other's changes.
+        """
+        patient_id = (order.get("patient") or {}).get("id")
+        if patient_id is None:
+            return
+        product = order.get("product") or {}
+        key = product_key(product)
+        purchased_at = parse_purchase_date(order.get("purchase_date")) or datetime.datetime.utcnow()
+        quantity = float(order.get("quantity") or 1)
+        dose = daily_dose(order.get("dosage_frequency"))
+        newer = lambda then, otherwise: {"$cond": ["$_newer", then, otherwise]}
+        elapsed_days = {"$divide": [{"$subtract": [purchased_at, "$last_purchase"]}, MS_PER_DAY]}
+        used_up = {"$max": [0, {"$subtract": ["$_supply", {"$multiply": ["$_rate", elapsed_days]}]}]}
+        pipeline = [
+            {"$set": {
+                "_newer": {"$or": [{"$eq": [{"$ifNull": ["$last_purchase", None]}, None]}, {"$gte": [purchased_at, "$last_purchase"]}]},
+                "_rate": dose if dose is not None else "$daily_dose",
+                "_supply": {"$ifNull": ["$supply_on_hand", 0.0]},
+            }},
+            {"$set": {
+                "product_id": {"$ifNull": ["$product_id", {"$literal": product.get("product_id")}]},
+                "product_name": {"$ifNull": ["$product_name", {"$literal": product.get("name")}]},
+                "first_purchase": {"$min": [{"$ifNull": ["$first_purchase", purchased_at]}, purchased_at]},
+                "order_count": {"$add": [{"$ifNull": ["$order_count", 0]}, 1]},
+                "total_quantity": {"$add": [{"$ifNull": ["$total_quantity", 0.0]}, quantity]},
+                # Newer than the last refill: use up the supply in between; a late older order only adds to it
+                "supply_on_hand": newer({"$add": [{"$cond": [{"$and": ["$_rate", "$last_purchase"]}, used_up, "$_supply"]}, quantity]},
+                                        {"$add": ["$_supply", quantity]}),
+                "last_purchase": newer(purchased_at, "$last_purchase"),
+                "last_quantity": newer(quantity, "$last_quantity"),
+                "dosage_frequency": newer({"$literal": order.get("dosage_frequency")}, "$dosage_frequency"),
+                "daily_dose": newer(dose, "$daily_dose") if dose is not None else "$daily_dose",
+            }},
+            *self._refresh_runs_out(),
+        ]
+        try:
+            self.timeline_col.update_one({"patient_id": patient_id, "product_key": key}, pipeline, upsert=True)
+        except DuplicateKeyError:
+            # Two first orders upserted at once; the entry exists now
+            self.timeline_col.update_one({"patient_id": patient_id, "product_key": key}, pipeline)
+
+    @staticmethod
+    def _refresh_runs_out() -> List[Dict[str, Any]]:
+        return [
+            {"$set": {
+                "last_refill": "$last_purchase",
+                "runs_out_on": {"$cond": [{"$gt": [{"$ifNull": ["$daily_dose", 0]}, 0]},
+                                          {"$add": ["$last_purchase", {"$multiply": [{"$divide": ["$supply_on_hand", "$daily_dose"]}, MS_PER_DAY]}]},
+                                          None]},
+                "updated_at": "$$NOW",
+            }},
+            {"$unset": ["_newer", "_rate", "_supply"]},
+        ]
+
+    def record_orders(self, orders: List[Dict[str, Any]]):
+        for order in orders:
+            self.record_order(order)
+
+    def adjust_quantity(self, patient_id: str, product: Dict[str, Any], delta: float):
+        """An already-recorded latest order changed quantity by delta (e.g. "make it 3 instead")."""
+        if not delta:
+            return
+        self.timeline_col.update_one({"patient_id": patient_id, "product_key": product_key(product)}, [
+            {"$set": {
+                "supply_on_hand": {"$max": [0.0, {"$add": ["$supply_on_hand", delta]}]},
+                "total_quantity": {"$add": ["$total_quantity", delta]},
+                "last_quantity": {"$add": [{"$ifNull": ["$last_quantity", 0]}, delta]},
+            }},
+            *self._refresh_runs_out(),
+        ])
+
+    def recompute(self, patient_id: str, product: Dict[str, Any], orders: List[Dict[str, Any]]):
+        """Replays a patient's orders for one product after one was edited or deleted (none left: entry removed)."""
+        key = product_key(product)
+        entry = None
+        for order in sorted(orders, key=lambda o: parse_purchase_date(o.get("purchase_date")) or datetime.datetime.min):
+            if product_key(order.get("product") or {}) == key:
+                entry = self._apply(entry, order)
+        if entry is None:
+            self.timeline_col.delete_one({"patient_id": patient_id, "product_key": key})
+        else:
+            entry.pop("_id", None)
+            self.timeline_col.replace_one({"patient_id": patient_id, "product_key": key}, entry, upsert=True)
+
+    def for_patient(self, patient_id: str, limit: int = 0) -> List[Dict[str, Any]]:
+        return list(self.timeline_col.find({"patient_id": patient_id}, {"_id": 0}).sort("last_purchase", DESCENDING).limit(limit))
+
+    def entry(self, patient_id: str, key: str) -> Optional[Dict[str, Any]]:
+        return self.timeline_col.find_one({"patient_id": patient_id, "product_key": key}, {"_id": 0})
+
+    def rebuild(self, orders: List[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Backfill from historical orders (any order); replays them per patient/product in date order."""
+        grouped: Dict[tuple, List[Dict[str, Any]]] = {}
+        for order in orders:
+            patient_id = (order.get("patient") or {}).get("id")
+            if patient_id is None:
+                continue
+            grouped.setdefault((patient_id, product_key(order.get("product") or {})), []).append(order)
+
+        ops, written = [], 0
+        for (patient_id, key), group in grouped.items():
+            group.sort(key=lambda o: parse_purchase_date(o.get("purchase_date")) or datetime.datetime.min)
+            entry = None
+            for order in group:
+                entry = self._apply(entry, order)
+            ops.append(ReplaceOne({"patient_id": patient_id, "product_key": key}, entry, upsert=True))
+            if len(ops) >= batch_size:
+                self.timeline_col.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            self.timeline_col.bulk_write(ops, ordered=False)
+            written += len(ops)
+        return written
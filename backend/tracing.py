@@ -0,0 +1,361 @@
+"""
+Tracing control layer for the @traceable agents.
+
+Spans are captured in-process (nesting follows the call stack) and a whole trace is
+decided when its root span ends:
+
+    TRACE_EXPORTERS=langsmith,file   where kept traces go; defaults to "langsmith" when
+                                     LANGSMITH_TRACING=true, else tracing is off
+    TRACE_SAMPLE_RATE=0.1            head sampling: share of ordinary traces kept
+    TRACE_SLOW_MS=3000               tail sampling: slower traces are always kept
+    TRACE_KEEP_ERRORS=1              tail sampling: traces with an exception are always kept
+    TRACE_FILE=traces/runs.jsonl     file exporter output (one trace per line), usable offline
+
+Kept traces are redacted and truncated, then handed to a bounded queue drained by one
+background thread; when the queue is full the trace is dropped, never the request.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import random
+import inspect
+import datetime
+import functools
+import threading
+import contextvars
+from typing import List, Optional, Dict, Any
+
+_langsmith_default = "langsmith" if os.getenv("LANGSMITH_TRACING", os.getenv("LANGCHAIN_TRACING_V2", "")).lower() == "true" else ""
+TRACE_EXPORTERS = [e.strip() for e in os.getenv("TRACE_EXPORTERS", _langsmith_default).lower().split(",") if e.strip() and e.strip() != "none"]
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 3000))
+TRACE_KEEP_ERRORS = os.getenv("TRACE_KEEP_ERRORS", "1") == "1"
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", 1000))
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(os.path.dirname(__file__), "traces", "runs.jsonl"))
+TRACE_MAX_STRING = int(os.getenv("TRACE_MAX_STRING", 1000))
+TRACE_MAX_ITEMS = int(os.getenv("TRACE_MAX_ITEMS", 20))
+TRACE_MAX_DEPTH = int(os.getenv("TRACE_MAX_DEPTH", 5))
+TRACE_REDACT_KEYS = {k.strip().lower() for k in os.getenv(
+    "TRACE_REDACT_KEYS", "password,email,prescription,prescription_data,api_key,token,authorization"
+).split(",") if k.strip()}
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+REDACTED = "[redacted]"
+
+
+# Redaction / truncation
+def sanitize(value: Any, depth: int = 0) -> Any:
+    """JSON-safe copy with sensitive keys and e-mail addresses masked and large values cut down."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        value = EMAIL.sub(REDACTED, value)
+        return value if len(value) <= TRACE_MAX_STRING else value[:TRACE_MAX_STRING] + f"... [{len(value) - TRACE_MAX_STRING} chars truncated]"
+    if depth >= TRACE_MAX_DEPTH:
+        return f"[{type(value).__name__} truncated]"
+    if isinstance(value, dict):
+        out = {}
+        for i, (k, v) in enumerate(value.items()):
+            if i >= TRACE_MAX_ITEMS:
+                out["..."] = f"{len(value) - TRACE_MAX_ITEMS} more keys"
+                break
+            out[str(k)] = REDACTED if str(k).lower() in TRACE_REDACT_KEYS and v is not None else sanitize(v, depth + 1)
+        return out
+    if isinstance(value, (list, tuple, set)):
+        items = [sanitize(v, depth + 1) for v in list(value)[:TRACE_MAX_ITEMS]]
+        if len(value) > TRACE_MAX_ITEMS:
+            items.append(f"... {len(value) - TRACE_MAX_ITEMS} more items")
+        return items
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return sanitize(str(value), depth + 1)
+
+
+# Spans
+class _Trace:
+    __slots__ = ("trace_id", "spans", "head_sampled")
+
+    def __init__(self):
+        self.trace_id = None
+        self.spans: List["_Span"] = []
+        self.head_sampled = random.random() < TRACE_SAMPLE_RATE
+
+
+class _Span:
+    __slots__ = ("id", "trace", "parent", "name", "signature", "args", "kwargs", "start", "start_time", "duration_ms", "output", "error")
+
+    def __init__(self, trace: _Trace, parent: Optional["_Span"], name: str, signature, args, kwargs):
+        self.id = None
+        self.trace = trace
+        self.parent = parent
+        self.name = name
+        self.signature = signature
+        # Raw references only; they are sanitized later, and only if the trace is kept
+        self.args = args
+        self.kwargs = kwargs
+        self.start = time.perf_counter()
+        self.start_time = time.time()
+        self.duration_ms = None
+        self.output = None
+        self.error = None
+
+    def inputs(self) -> Dict[str, Any]:
+        try:
+            bound = self.signature.bind(*self.args, **self.kwargs)
+            inputs = {k: v for k, v in bound.arguments.items() if k != "self"}
+        except TypeError:
+            inputs = {"args": self.args[1:], "kwargs": self.kwargs}
+        return sanitize(inputs)
+
+    def record(self, keep_reason: str) -> Dict[str, Any]:
+        # Ids are only minted for kept traces; spans are recorded parent-first
+        self.id = uuid.uuid4()
+        if self.trace.trace_id is None:
+            self.trace.trace_id = self.id
+        start_time = datetime.datetime.fromtimestamp(self.start_time, datetime.timezone.utc).replace(tzinfo=None)
+        return {
+            "id": str(self.id),
+            "trace_id": str(self.trace.trace_id),
+            "parent_id": str(self.parent.id) if self.parent else None,
+            "name": self.name,
+            "start_time": start_time.isoformat(),
+            "end_time": (start_time + datetime.timedelta(milliseconds=self.duration_ms)).isoformat(),
+            "duration_ms": round(self.duration_ms, 2),
+            "inputs": self.inputs(),
+            "outputs": sanitize(self.output),
+            "error": self.error,
+            "keep_reason": keep_reason,
+        }
+
+
+_current: contextvars.ContextVar[Optional[_Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+# Exporters
+class FileExporter:
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, spans: List[Dict[str, Any]]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(spans, default=str) + "\n")
+
+
+class LangSmithExporter:
+    def __init__(self):
+        # langsmith pulls in its client, requests and pydantic models; only pay for that in the export thread
+        from langsmith import Client
+        self.client = Client()
+        self.project = os.getenv("LANGSMITH_PROJECT", os.getenv("LANGCHAIN_PROJECT", "default"))
+
+    def export(self, spans: List[Dict[str, Any]]):
+        by_id = {s["id"]: s for s in spans}
+
+        def dotted(span):
+            stamp = datetime.datetime.fromisoformat(span["start_time"]).strftime("%Y%m%dT%H%M%S%fZ") + span["id"]
+            parent = by_id.get(span["parent_id"])
+            return f"{dotted(parent)}.{stamp}" if parent else stamp
+
+        runs = [{
+            "id": s["id"],
+            "trace_id": s["trace_id"],
+            "parent_run_id": s["parent_id"],
+            "dotted_order": dotted(s),
+            "name": s["name"],
+            "run_type": "chain",
+            "start_time": datetime.datetime.fromisoformat(s["start_time"]),
+            "end_time": datetime.datetime.fromisoformat(s["end_time"]),
+            "inputs": s["inputs"],
+            "outputs": {"output": s["outputs"]},
+            "error": s["error"],
+            "session_name": self.project,
+            "extra": {"metadata": {"keep_reason": s["keep_reason"]}},
+        } for s in spans]
+        self.client.batch_ingest_runs(create=runs, pre_sampled=True)
+
+    def flush(self):
+        self.client.flush()
+
+
+EXPORTERS = {"file": FileExporter, "langsmith": LangSmithExporter}
+
+
+class TraceExportQueue:
+    """Bounded hand-off from request threads to a single export thread."""
+
+    def __init__(self, exporter_names: List[str] = TRACE_EXPORTERS, maxsize: int = TRACE_QUEUE_SIZE):
+        self.exporter_names = exporter_names
+        self.queue: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(maxsize=maxsize)
+        self.exporters = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.counters = {"traces": 0, "kept": 0, "sampled_out": 0, "dropped": 0, "exported": 0, "export_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporter_names)
+
+    def count(self, counter: str):
+        # Request threads and the export thread all bump these
+        with self._counters_lock:
+            self.counters[counter] += 1
+
+    def submit(self, spans: List[Dict[str, Any]]):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.count("dropped")
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._drain, name="trace-export", daemon=True)
+                self._thread.start()
+
+    def _drain(self):
+        while True:
+            spans = self.queue.get()
+            if spans is None:
+                self.queue.task_done()
+                return
+            try:
+                if self.exporters is None:
+                    self.exporters = [EXPORTERS[name]() for name in self.exporter_names if name in EXPORTERS]
+                for exporter in self.exporters:
+                    exporter.export(spans)
+                self.count("exported")
+            except Exception as e:
+                self.count("export_errors")
+                print(f"⚠️ [TRACING] Export failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (bounded) for queued traces to be exported, e.g. on shutdown."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for exporter in self.exporters or []:
+            if hasattr(exporter, "flush"):
+                exporter.flush()
+
+    def _counters_snapshot(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return dict(self.counters)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exporters": self.exporter_names,
+            "sample_rate": TRACE_SAMPLE_RATE,
+            "slow_ms": TRACE_SLOW_MS,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            **self._counters_snapshot(),
+        }
+
+
+export_queue = TraceExportQueue()
+
+
+def _finish_trace(root: _Span):
+    q = export_queue
+    q.count("traces")
+    if TRACE_KEEP_ERRORS and any(s.error for s in root.trace.spans):
+        reason = "error"
+    elif root.duration_ms >= TRACE_SLOW_MS:
+        reason = "slow"
+    elif root.trace.head_sampled:
+        reason = "sampled"
+    else:
+        q.count("sampled_out")
+        return
+    q.count("kept")
+    q.submit([s.record(reason) for s in root.trace.spans])
+
+
+def _traceable_generator(func, name: str, signature):
+    """Generators (streamed chains) get one span from the first item to exhaustion or close."""
+    @functools.wraps(func)
+    def wrapper(*args, **call_kwargs):
+        if not export_queue.enabled:
+            return (yield from func(*args, **call_kwargs))
+        parent = _current.get()
+        trace = parent.trace if parent else _Trace()
+        span = _Span(trace, parent, name, signature, args, call_kwargs)
+        trace.spans.append(span)
+        gen = func(*args, **call_kwargs)
+        try:
+            while True:
+                # Current only while the generator body runs: each step may run in another thread/context
+                token = _current.set(span)
+                try:
+                    item = next(gen)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    _current.reset(token)
+                span.output = item
+                yield item
+        except GeneratorExit:
+            gen.close()
+            raise
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span.start) * 1000
+            if parent is None:
+                try:
+                    _finish_trace(span)
+                except Exception as e:
+                    print(f"⚠️ [TRACING] Could not record trace '{name}': {e}")
+    return wrapper
+
+
+def traceable(name: str, **kwargs):
+    """Drop-in for langsmith.traceable(name=...) that goes through the sampling/export layer above."""
+    def decorator(func):
+        signature = inspect.signature(func)
+        if inspect.isgeneratorfunction(func):
+            return _traceable_generator(func, name, signature)
+
+        @functools.wraps(func)
+        def wrapper(*args, **call_kwargs):
+            if not export_queue.enabled:
+                return func(*args, **call_kwargs)
+            parent = _current.get()
+            trace = parent.trace if parent else _Trace()
+            span = _Span(trace, parent, name, signature, args, call_kwargs)
+            trace.spans.append(span)
+            token = _current.set(span)
+            try:
+                span.output = func(*args, **call_kwargs)
+                return span.output
+            except BaseException as e:
+                span.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                span.duration_ms = (time.perf_counter() - span.start) * 1000
+                _current.reset(token)
+                if parent is None:
+                    try:
+                        _finish_trace(span)
+                    except Exception as e:
+                        print(f"⚠️ [TRACING] Could not record trace '{name}': {e}")
+        return wrapper
+    return decorator
+
+
+def stats() -> Dict[str, Any]:
+    return export_queue.stats()
+
+
+def flush(timeout: float = 5.0):
+    export_queue.flush(timeout)
@@ -1,5 +1,6 @@
 import React, { useEffect, useState, useRef } from "react";
 import "./index.css";
+import { syncCatalog, readCatalog, registerPeriodicCatalogSync } from "./catalogStore";
 
 const API_BASE = import.meta.env.VITE_API_BASE_URL || "";
 
@@ -33,6 +34,8 @@ function App() {
     const [databaseSnapshot, setDatabaseSnapshot] = useState({ orders: [], inventory: [] });
     const [isEmailServiceLive, setIsEmailServiceLive] = useState(false);
     const [apiStatus, setApiStatus] = useState("checking"); // checking, connected, failed
+    // Lets the backend treat "make it 3 instead" or a prescription upload as a follow-up, not a new order
+    const [conversationId, setConversationId] = useState(null);
 
     const recognitionRef = useRef(null);
     const scrollRef = useRef(null);
@@ -49,6 +52,7 @@ function App() {
             setDeferredPrompt(e);
         };
         window.addEventListener('beforeinstallprompt', handleBeforeInstallPrompt);
+        registerPeriodicCatalogSync();
 
         if ("webkitSpeechRecognition" in window || "SpeechRecognition" in window) {
             const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
@@ -89,6 +93,22 @@ function App() {
         }
     }, [user, activeTab]);
 
+    // Live low-stock feed for the admin panel (snapshot, then per-item changes)
+    useEffect(() => {
+        if (!user || activeTab !== "dashboard" || !("EventSource" in window)) return;
+        const source = new EventSource(`${API_BASE}/admin/low-stock/stream`);
+        source.addEventListener("snapshot", (e) => setLowStock(JSON.parse(e.data)));
+        source.addEventListener("upsert", (e) => {
+            const item = JSON.parse(e.data);
+            setLowStock(prev => [...prev.filter(i => i._id !== item._id), item].sort((a, b) => a.stock - b.stock));
+        });
+        source.addEventListener("remove", (e) => {
+            const item = JSON.parse(e.data);
+            setLowStock(prev => prev.filter(i => i._id !== item._id));
+        });
+        return () => source.close();
+    }, [user, activeTab]);
+
     const checkApiHealth = async () => {
         try {
             const res = await fetch(`${API_BASE}/health/email`);
@@ -111,9 +131,14 @@ function App() {
 
     const fetchDatabaseSnapshot = async () => {
         try {
-            const res = await fetch(`${API_BASE}/admin/database-snapshot`);
+            // With the service worker's local catalog only changed SKUs are fetched; without it, the full snapshot
+            const synced = await syncCatalog(API_BASE);
+            const res = await fetch(`${API_BASE}/admin/database-snapshot${synced ? "?include_inventory=false" : ""}`);
             const data = await res.json();
+            if (synced) data.inventory = await readCatalog();
             setDatabaseSnapshot(data);
+            // First sync of a large catalog: render what has arrived, re-read as the worker fills in the rest
+            if (synced && !synced.complete) setTimeout(fetchDatabaseSnapshot, 2000);
         } catch (err) {
             console.error("DB Snapshot fetch error", err);
         }
@@ -143,6 +168,7 @@ function App() {
 
     const handleLogout = () => {
         setUser(null);
+        setConversationId(null);
         localStorage.removeItem("rxgenie_user");
         setMessages([{ role: "assistant", content: "👋 Welcome to RxGenie AI. I'm your premium digital pharmacist. How can I assist you with your health today?" }]);
     };
@@ -215,32 +241,94 @@ function App() {
                 patient_id: user.patient_id,
                 text: textToSubmit
             };
+            if (conversationId) payload.conversation_id = conversationId;
             if (uploadedPrescription) {
                 payload.prescription_data = uploadedPrescription;
             }
 
-            const res = await fetch(`${API_BASE}/chat-order`, {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(payload)
+            const streamId = Date.now();
+            // One key per submission, sent on the stream and on the fallback: a retry replays the first attempt's order
+            const idempotencyKey = `${user.patient_id}-${window.crypto?.randomUUID?.() || `${streamId}-${Math.random().toString(36).slice(2)}`}`;
+            const upsertStreamMessage = (patch) => setMessages(prev => {
+                const exists = prev.some(m => m.streamId === streamId);
+                if (!exists) return [...prev, { role: "assistant", content: "", traces: [], streamId, ...patch }];
+                return prev.map(m => m.streamId === streamId ? { ...m, ...patch } : m);
             });
-            const data = await res.json();
+
+            let aiContent = "";
+            let collectedTraces = [];
+            let data = null;
+
+            const headers = { "Content-Type": "application/json", "Idempotency-Key": idempotencyKey };
+            let res = null;
+            try {
+                res = await fetch(`${API_BASE}/chat-order/stream`, { method: "POST", headers, body: JSON.stringify(payload) });
+            } catch (err) {
+                // Network error before the stream opened: the fallback below retries with the same key
+            }
+
+            let streamed = false;
+            if (res?.ok && res.body) {
+                // Each agent stage arrives as its own SSE event, so we can speak before the whole chain finishes
+                try {
+                    await readEventStream(res, (event, eventData) => {
+                        if (eventData.traces) collectedTraces = [...collectedTraces, ...eventData.traces];
+                        if (event === "session") {
+                            if (eventData.conversation_id) setConversationId(eventData.conversation_id);
+                        } else if (event === "extraction") {
+                            const med = eventData.order?.medicine_name;
+                            const interim = med ? `🔍 Checking ${med} for you...` : "🔍 Looking into that for you...";
+                            upsertStreamMessage({ content: interim, traces: collectedTraces });
+                            speakContent(interim);
+                        } else if (event === "confirmation") {
+                            aiContent = eventData.message;
+                            if (eventData.action?.status === "Order Processed") {
+                                aiContent += `\n\n✅ Order confirmed and saved to your records!`;
+                            }
+                            upsertStreamMessage({ content: aiContent, traces: collectedTraces });
+                            speakContent(aiContent);
+                        } else if (event === "refill") {
+                            if (eventData.refill_alerts?.length > 0) {
+                                const reminder = `🔔 Refill reminder: ${eventData.refill_alerts[0].reason || "Check your stock soon."}`;
+                                aiContent += `\n${reminder}`;
+                                upsertStreamMessage({ content: aiContent, traces: collectedTraces });
+                            }
+                        } else if (event === "final") {
+                            data = eventData;
+                        }
+                    });
+                    streamed = data !== null;
+                } catch (err) {
+                    // Connection dropped mid-stream: the server finishes the order and the fallback replays it
+                }
+            }
+            if (!streamed) {
+                const fallbackRes = await fetch(`${API_BASE}/chat-order`, { method: "POST", headers, body: JSON.stringify(payload) });
+                data = await fallbackRes.json();
+                if (data.conversation_id) setConversationId(data.conversation_id);
+            }
+            data = data || {};
 
             // Clear prescription after sending
             setUploadedPrescription(null);
-            let aiContent = data.message || data.response || data.reason || "I've processed your request.";
 
-            // If order was successful, append extra info
-            if (data.success && data.action?.status === "Order Processed") {
-                aiContent += `\n\n✅ Order confirmed and saved to your records!`;
-                if (data.refill_alerts?.length > 0) {
-                    aiContent += `\n🔔 Refill reminder: ${data.refill_alerts[0].reason || "Check your stock soon."}`;
+            if (!aiContent) {
+                aiContent = data.message || data.response || data.reason || "I've processed your request.";
+
+                // If order was successful, append extra info
+                if (data.success && data.action?.status === "Order Processed") {
+                    aiContent += `\n\n✅ Order confirmed and saved to your records!`;
+                    if (data.refill_alerts?.length > 0) {
+                        aiContent += `\n🔔 Refill reminder: ${data.refill_alerts[0].reason || "Check your stock soon."}`;
+                    }
                 }
+                speakContent(aiContent);
             }
 
-            setMessages(prev => [...prev, { role: "assistant", content: aiContent, traces: data.traces || [] }]);
-            speakContent(aiContent);
+            upsertStreamMessage({ content: aiContent, traces: collectedTraces.length ? collectedTraces : (data.traces || []) });
             fetchDashboardData();
+            // Refill analysis finishes after the response; pick up its stored alerts shortly after
+            if (data.refill_deferred) setTimeout(fetchDashboardData, 10000);
 
         } catch (err) {
             const errorMsg = "I'm having trouble connecting to the medical nexus. Please try again.";
@@ -251,6 +339,30 @@ function App() {
         }
     };
 
+    // Minimal SSE reader for POST responses (EventSource only supports GET)
+    const readEventStream = async (res, onEvent) => {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                const chunk = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = "message";
+                let dataLines = [];
+                chunk.split("\n").forEach(line => {
+                    if (line.startsWith("event:")) event = line.slice(6).trim();
+                    else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length) onEvent(event, JSON.parse(dataLines.join("\n")));
+            }
+        }
+    };
+
     const TraceAccordion = ({ traces, index }) => {
         if (!traces || traces.length === 0) return null;
         const isExpanded = expandedTrace === index;
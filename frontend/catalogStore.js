@@ -0,0 +1,43 @@
+// Page side of the offline catalog kept by the service worker (public/catalog-sync.js).
+const CATALOG_DB = "rxgenie-catalog";
+const CATALOG_SYNC_TAG = "catalog-sync";
+
+// Asks the service worker to apply /catalog/changes deltas; null when there is no active worker (e.g. vite dev)
+export const syncCatalog = async (apiBase, timeoutMs = 15000) => {
+    const worker = navigator.serviceWorker?.controller;
+    if (!worker) return null;
+    const channel = new MessageChannel();
+    const reply = new Promise((resolve) => {
+        channel.port1.onmessage = (event) => resolve(event.data);
+        setTimeout(() => resolve(null), timeoutMs);
+    });
+    worker.postMessage({ type: CATALOG_SYNC_TAG, apiBase }, [channel.port2]);
+    const result = await reply;
+    return result?.ok ? result : null;
+};
+
+export const readCatalog = () => new Promise((resolve) => {
+    const request = indexedDB.open(CATALOG_DB, 1);
+    // Opened before the worker ever synced: nothing stored yet
+    request.onupgradeneeded = () => {
+        request.result.createObjectStore("products", { keyPath: "_id" });
+        request.result.createObjectStore("meta");
+    };
+    request.onerror = () => resolve([]);
+    request.onsuccess = () => {
+        const db = request.result;
+        const all = db.transaction("products", "readonly").objectStore("products").getAll();
+        all.onsuccess = () => { db.close(); resolve(all.result); };
+        all.onerror = () => { db.close(); resolve([]); };
+    };
+});
+
+// Background refresh where the browser allows it (installed PWA); harmless elsewhere
+export const registerPeriodicCatalogSync = async () => {
+    try {
+        const registration = await navigator.serviceWorker?.ready;
+        await registration?.periodicSync?.register(CATALOG_SYNC_TAG, { minInterval: 15 * 60 * 1000 });
+    } catch (err) {
+        // Permission not granted or API unsupported
+    }
+};
@@ -0,0 +1,91 @@
+// Loaded into the generated service worker (workbox importScripts, see vite.config.js).
+// Keeps an IndexedDB copy of the product catalog current through /catalog/changes deltas,
+// so inventory views read locally and only changed SKUs cross the network.
+const CATALOG_DB = "rxgenie-catalog";
+const CATALOG_SYNC_TAG = "catalog-sync";
+
+const openCatalogDb = () => new Promise((resolve, reject) => {
+    const request = indexedDB.open(CATALOG_DB, 1);
+    request.onupgradeneeded = () => {
+        request.result.createObjectStore("products", { keyPath: "_id" });
+        request.result.createObjectStore("meta");
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+});
+
+const idb = (db, store, mode, run) => new Promise((resolve, reject) => {
+    const tx = db.transaction(store, mode);
+    const result = run(tx.objectStore(store));
+    tx.oncomplete = () => resolve(result && "result" in result ? result.result : undefined);
+    tx.onerror = () => reject(tx.error);
+});
+
+let runningSync = null;
+
+// onPage(result) runs after each committed page, so a first sync can answer before the whole catalog is in
+const syncCatalog = async (apiBase, onPage = () => {}) => {
+    const db = await openCatalogDb();
+    // "" is a real base (API served from the same origin); only a missing one falls back to the stored base
+    if (apiBase === undefined || apiBase === null) apiBase = await idb(db, "meta", "readonly", s => s.get("apiBase"));
+    if (apiBase === undefined) {
+        db.close();
+        throw new Error("catalog sync: no API base known yet");
+    }
+    let version = (await idb(db, "meta", "readonly", s => s.get("version"))) || 0;
+    let changed = 0;
+    while (true) {
+        const res = await fetch(`${apiBase}/catalog/changes?since=${version}`, { cache: "no-store" });
+        if (!res.ok) throw new Error(`catalog sync failed: ${res.status}`);
+        const page = await res.json();
+        // One transaction per page: products and the version they bring us to move together
+        await new Promise((resolve, reject) => {
+            const tx = db.transaction(["products", "meta"], "readwrite");
+            const products = tx.objectStore("products");
+            if (page.reset) products.clear();
+            page.changes.forEach(p => products.put(p));
+            tx.objectStore("meta").put(page.version, "version");
+            tx.objectStore("meta").put(apiBase, "apiBase");
+            tx.oncomplete = resolve;
+            tx.onerror = () => reject(tx.error);
+        });
+        changed += page.changes.length;
+        version = page.version;
+        onPage({ version, changed, complete: !page.has_more });
+        if (!page.has_more) break;
+    }
+    db.close();
+    return { version, changed };
+};
+
+// Concurrent requests (several tabs, periodic sync) share one pass
+const pageListeners = new Set();
+const syncOnce = (apiBase) => {
+    if (!runningSync) {
+        runningSync = syncCatalog(apiBase, result => pageListeners.forEach(listener => listener(result)))
+            .finally(() => { runningSync = null; pageListeners.clear(); });
+    }
+    return runningSync;
+};
+
+self.addEventListener("message", (event) => {
+    if (event.data?.type !== CATALOG_SYNC_TAG) return;
+    const reply = event.ports[0];
+    let replied = false;
+    const answer = (message) => {
+        if (!replied) reply?.postMessage(message);
+        replied = true;
+    };
+    // The page gets its answer after the first page (a first sync of a large catalog keeps going in the background)
+    const listener = result => answer({ ok: true, ...result });
+    pageListeners.add(listener);
+    event.waitUntil(syncOnce(event.data.apiBase)
+        .then(result => answer({ ok: true, complete: true, ...result }))
+        .catch(err => answer({ ok: false, error: String(err) }))
+        .finally(() => pageListeners.delete(listener)));
+});
+
+// Where supported (installed Chrome PWAs), refresh in the background too
+self.addEventListener("periodicsync", (event) => {
+    if (event.tag === CATALOG_SYNC_TAG) event.waitUntil(syncOnce().catch(() => null));
+});
@@ -0,0 +1,27 @@
+// Writes .br and .gz siblings for compressible files in dist/ so the backend
+// can serve them without compressing per request. Runs after `vite build`.
+import { readdirSync, readFileSync, writeFileSync, statSync } from "node:fs";
+import { join, extname } from "node:path";
+import { brotliCompressSync, gzipSync, constants } from "node:zlib";
+
+const DIST = new URL("../dist/", import.meta.url).pathname;
+const COMPRESSIBLE = new Set([".html", ".js", ".css", ".json", ".webmanifest", ".svg", ".txt"]);
+const MIN_SIZE = 256;
+
+const walk = (dir) => readdirSync(dir).flatMap((name) => {
+    const path = join(dir, name);
+    return statSync(path).isDirectory() ? walk(path) : [path];
+});
+
+let raw = 0, br = 0, gz = 0;
+for (const file of walk(DIST)) {
+    if (!COMPRESSIBLE.has(extname(file))) continue;
+    const data = readFileSync(file);
+    if (data.length < MIN_SIZE) continue;
+    const brotli = brotliCompressSync(data, { params: { [constants.BROTLI_PARAM_QUALITY]: 11 } });
+    const gzip = gzipSync(data, { level: 9 });
+    writeFileSync(`${file}.br`, brotli);
+    writeFileSync(`${file}.gz`, gzip);
+    raw += data.length; br += brotli.length; gz += gzip.length;
+}
+console.log(`precompressed ${(raw / 1024).toFixed(1)} KiB -> br ${(br / 1024).toFixed(1)} KiB, gzip ${(gz / 1024).toFixed(1)} KiB`);
@@ -8,6 +8,10 @@ export default defineConfig({
         react(),
         VitePWA({
             registerType: 'autoUpdate',
+            workbox: {
+                // Offline catalog kept current through /catalog/changes (public/catalog-sync.js)
+                importScripts: ['catalog-sync.js']
+            },
             manifest: {
                 name: 'RxGenie Premium',
                 short_name: 'RxGenie',